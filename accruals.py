@@ -0,0 +1,130 @@
+# accruals.py
+# Nightly interest accrual and late penalties. For every approved, unpaid loan
+# and every day not yet processed, one NumPy pass works out that day's accrued
+# contractual interest and any late penalty; rows go into accruals (loan_id, day)
+# with executemany, and penalties are added to what the borrower owes.
+#
+# Each day is one transaction that also records the day in accrual_runs, so a
+# day is either fully processed or not at all. Days already in accrual_runs are
+# skipped: running the job twice, or after a crash, never charges anything twice.
+#   python accruals.py [DB_FILE] [--through YYYY-MM-DD] [--since YYYY-MM-DD]
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import db
+
+PENALTY_RATE = 0.24     # annual, on the outstanding balance, for every day past due + grace
+GRACE_DAYS = 3
+LATE_FEE = 500.0        # one-off, with a loan's first penalty
+PENALTY_CAP = 0.25      # total penalties never exceed this share of the principal
+CHUNK = 200000          # loans loaded and computed at a time
+
+# contractual interest is what total_payable carried at application (flat or reducing),
+# spread evenly over the days from the application date to the due date
+OPEN_LOANS = """SELECT id, amount, total_payable, COALESCE(penalty_accrued, 0), COALESCE(outstanding, total_payable),
+                       julianday(date(created_at)), julianday(due_date)
+                FROM loans
+                WHERE status = 'approved' AND COALESCE(payment_status, '') != 'Paid' AND id > ?
+                ORDER BY id LIMIT ?"""
+INSERT_ACCRUAL = "INSERT OR REPLACE INTO accruals (loan_id, day, interest, penalty) VALUES (?, ?, ?, ?)"
+CHARGE_PENALTY = """UPDATE loans SET penalty_accrued = COALESCE(penalty_accrued, 0) + ?,
+                                     total_payable = total_payable + ?,
+                                     outstanding = COALESCE(outstanding, total_payable) + ?
+                    WHERE id = ?"""
+INSERT_RUN = "INSERT OR REPLACE INTO accrual_runs (day, loans, interest, penalty, finished_at) VALUES (?, ?, ?, ?, ?)"
+
+def accrue(loans, day):
+    # loans: float array with OPEN_LOANS' columns; day: julian day number.
+    # Returns (interest, penalty) arrays, one entry per loan.
+    amount, total, penalty_so_far, outstanding, start, due = loans[:, 1:].T
+    term = np.maximum(due - start, 1.0)
+    contract_interest = np.maximum(total - penalty_so_far - amount, 0.0)
+    interest = np.where((day > start) & (day <= due), contract_interest / term, 0.0)
+    days_late = day - due - GRACE_DAYS
+    penalty = np.where(days_late > 0, outstanding * PENALTY_RATE / 365.0, 0.0)
+    # the fee comes with the first penalty charged - on the first late day normally, or on
+    # the first run for loans already late; penalty_accrued is only ever raised by this job
+    penalty += np.where((days_late >= 1) & (penalty_so_far <= 0), LATE_FEE, 0.0)
+    penalty = np.clip(np.minimum(penalty, amount * PENALTY_CAP - penalty_so_far), 0.0, None)
+    return np.round(interest, 4), np.round(penalty, 2)
+
+def _julian(day):
+    return (np.datetime64(day, "D") - np.datetime64("-4713-11-24", "D")).astype(float) - 0.5
+
+def process_day(cur, day):
+    # call inside Database.write; returns the day's totals
+    jd = _julian(day)
+    iso = day.isoformat()
+    last_id, totals = 0, {"loans": 0, "interest": 0.0, "penalty": 0.0}
+    while True:
+        rows = cur.execute(OPEN_LOANS, (last_id, CHUNK)).fetchall()
+        if not rows:
+            break
+        loans = np.array(rows, dtype=float)
+        last_id = int(loans[-1, 0])
+        interest, penalty = accrue(loans, jd)
+        ids = loans[:, 0].astype(np.int64)
+        hit = (interest > 0) | (penalty > 0)
+        cur.executemany(INSERT_ACCRUAL, zip(ids[hit].tolist(), [iso] * int(hit.sum()),
+                                            interest[hit].tolist(), penalty[hit].tolist()))
+        late = penalty > 0
+        p = penalty[late].tolist()
+        cur.executemany(CHARGE_PENALTY, zip(p, p, p, ids[late].tolist()))
+        totals["loans"] += int(hit.sum())
+        totals["interest"] += float(interest.sum())
+        totals["penalty"] += float(penalty.sum())
+    cur.execute(INSERT_RUN, (iso, totals["loans"], round(totals["interest"], 2), round(totals["penalty"], 2),
+                             datetime.utcnow().isoformat()))
+    return totals
+
+def last_run_day(conn):
+    row = conn.execute("SELECT MAX(day) FROM accrual_runs").fetchone()
+    return date.fromisoformat(row[0]) if row and row[0] else None
+
+def pending_days(conn, through=None, since=None):
+    # days after the last processed one up to `through`; a first run only does `through`
+    through = through or date.today()
+    last = last_run_day(conn)
+    start = since or (last + timedelta(days=1) if last else through)
+    done = {r[0] for r in conn.execute("SELECT day FROM accrual_runs WHERE day >= ?", (start.isoformat(),))}
+    days = []
+    while start <= through:
+        if start.isoformat() not in done:
+            days.append(start)
+        start += timedelta(days=1)
+    return days
+
+def run(database, through=None, since=None, progress=None):
+    reader = database.reader()
+    days = pending_days(reader, through, since)
+    reader.close()
+    results = []
+    for day in days:
+        t0 = time.perf_counter()
+        totals = database.write(process_day, day)
+        totals["day"] = day.isoformat()
+        totals["seconds"] = round(time.perf_counter() - t0, 2)
+        results.append(totals)
+        if progress:
+            progress(totals)
+    if results:
+        # every penalty charged logged a loan for the analytics replica
+        database.write(db.trim_replica_changes)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accrue daily interest and late penalties")
+    parser.add_argument("db_file", nargs="?", default="loans_pro.db")
+    parser.add_argument("--through", type=date.fromisoformat, default=None, help="last day to process (default today)")
+    parser.add_argument("--since", type=date.fromisoformat, default=None,
+                        help="first day to consider (default: the day after the last run)")
+    args = parser.parse_args()
+    database = db.Database(args.db_file)
+    results = run(database, args.through, args.since,
+                  progress=lambda t: print(f"{t['day']}: {t['loans']:,} loans, interest {t['interest']:,.2f}, "
+                                           f"penalties {t['penalty']:,.2f} ({t['seconds']}s)", flush=True))
+    if not results:
+        print("nothing to do - already accrued through", last_run_day(database.reader()))
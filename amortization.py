@@ -0,0 +1,100 @@
+# amortization.py
+# Installment schedules for many loans at once. Every input is an array (one
+# entry per loan); the schedules are laid out on a loans x max(installments)
+# grid, computed column-wise in NumPy, then flattened to one row per installment.
+from datetime import date
+
+import numpy as np
+
+FLAT = "flat"            # simple interest on the full principal, equal installments (calculate_total_simple)
+REDUCING = "reducing"    # reducing-balance EMI: interest each period on what is still owed
+
+def _inputs(principal, annual_rate, days, installments, start):
+    p = np.atleast_1d(np.asarray(principal, dtype=float))
+    r = np.broadcast_to(np.asarray(annual_rate, dtype=float), p.shape)
+    d = np.broadcast_to(np.asarray(days, dtype=np.int64), p.shape)
+    n = np.broadcast_to(np.asarray(installments, dtype=np.int64), p.shape)
+    s = np.broadcast_to(np.asarray(date.today() if start is None else start, dtype="datetime64[D]"), p.shape)
+    k = np.arange(1, int(n.max()) + 1 if n.size else 1)     # installment numbers
+    mask = k[None, :] <= n[:, None]
+    interval = np.where(n > 0, d // np.maximum(n, 1), d)   # same spacing as create_installment_schedule
+    return p, r, d, n, s, k, mask, interval
+
+def _flatten(mask, k, s, interval, amount, principal_part, interest_part):
+    rows, cols = np.nonzero(mask)
+    return {
+        "loan": rows,   # index into the input arrays
+        "inst_no": k[cols],
+        "due_date": s[rows] + interval[rows] * k[cols],
+        "amount": amount[rows, cols],
+        "principal": principal_part[rows, cols],
+        "interest": interest_part[rows, cols],
+    }
+
+def flat_schedules(principal, annual_rate, days, installments, start=None):
+    p, r, d, n, s, k, mask, interval = _inputs(principal, annual_rate, days, installments, start)
+    # rounded as calculate_total_simple does (np.round differs at some half-paisa
+    # values), so the schedule adds up to loans.total_payable exactly
+    total = np.array([round(t, 2) for t in (p + p * r * d / 365.0).tolist()])
+    safe_n = np.maximum(n, 1)
+    shape = mask.shape
+    each, each_principal = np.round(total / safe_n, 2), np.round(p / safe_n, 2)
+    amount = np.repeat(each[:, None], shape[1], axis=1)
+    principal_part = np.repeat(each_principal[:, None], shape[1], axis=1)
+    # the last installment absorbs rounding so the installments add up to total_payable
+    has = np.flatnonzero(n > 0)
+    last = (has, n[has] - 1)
+    amount[last] = np.round(total[has] - each[has] * (n[has] - 1), 2)
+    principal_part[last] = np.round(p[has] - each_principal[has] * (n[has] - 1), 2)
+    return _flatten(mask, k, s, interval, amount, principal_part, np.round(amount - principal_part, 2))
+
+def reducing_schedules(principal, annual_rate, days, installments, start=None):
+    p, r, d, n, s, k, mask, interval = _inputs(principal, annual_rate, days, installments, start)
+    safe_n = np.maximum(n, 1)
+    rp = r * interval / 365.0                                  # rate per installment period
+    growth = (1.0 + rp)[:, None] ** (k[None, :] - 1)           # (1+r)^(k-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        emi = np.where(rp > 0, p * rp / (1.0 - (1.0 + rp) ** -safe_n), p / safe_n)
+        # balance still owed before the k-th payment
+        opening = np.where(rp[:, None] > 0,
+                           p[:, None] * growth - emi[:, None] * (growth - 1.0) / rp[:, None],
+                           p[:, None] - emi[:, None] * (k[None, :] - 1))
+    interest_part = np.round(opening * rp[:, None], 2)
+    principal_part = np.round(emi[:, None] - interest_part, 2)
+    principal_part = np.where(mask, principal_part, 0.0)
+    # the last installment absorbs rounding so principal repaid equals principal lent
+    last = (np.arange(len(p)), safe_n - 1)
+    principal_part[last] += np.round(p - principal_part.sum(axis=1), 2)
+    amount = np.round(principal_part + interest_part, 2)
+    return _flatten(mask, k, s, interval, amount, principal_part, interest_part)
+
+def calculate_total_simple(principal: float, annual_rate: float, days: int) -> float:
+    # simple interest
+    interest = (principal * annual_rate * days) / 365.0
+    total = principal + interest
+    return round(total, 2)
+
+def create_installment_schedule(principal, annual_rate, days, installments):
+    # naive equal installments (simple interest); single-loan view of flat_schedules
+    s = flat_schedules(principal, annual_rate, days, installments)
+    return [{"inst_no": int(n), "due_date": str(d), "amount": float(a), "paid": False}
+            for n, d, a in zip(s["inst_no"], s["due_date"], s["amount"])]
+
+def schedules(method, principal, annual_rate, days, installments, start=None):
+    fn = reducing_schedules if method == REDUCING else flat_schedules
+    return fn(principal, annual_rate, days, installments, start)
+
+def installment_rows(loan_ids, sched):
+    # tuples for INSERT INTO installments (loan_id, inst_no, due_date, amount, principal, interest)
+    ids = np.asarray(loan_ids)[sched["loan"]]
+    due = np.datetime_as_string(sched["due_date"], unit="D")
+    return list(zip(ids.tolist(), sched["inst_no"].tolist(), due.tolist(), sched["amount"].tolist(),
+                    sched["principal"].tolist(), sched["interest"].tolist()))
+
+INSERT_INSTALLMENTS = "INSERT INTO installments (loan_id, inst_no, due_date, amount, principal, interest) VALUES (?, ?, ?, ?, ?, ?)"
+
+def insert_schedules(cur, loan_ids, principal, annual_rate, days, installments, method=FLAT, start=None):
+    # call inside Database.write, in the same transaction as the loan rows
+    rows = installment_rows(loan_ids, schedules(method, principal, annual_rate, days, installments, start))
+    cur.executemany(INSERT_INSTALLMENTS, rows)
+    return len(rows)
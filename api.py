@@ -0,0 +1,218 @@
+# api.py
+# HTTP API over service.py for callers that aren't the Streamlit pages - partner
+# apps, back-office scripts, wallet settlement uploads. It runs as its own ASGI
+# process next to the Streamlit server on the same database files; each request
+# does its work in a worker thread, so slow reads don't hold up other requests,
+# and writes queue for the single write slot as the pages' do. Notifications only
+# go into the outbox - the Streamlit process's dispatcher delivers them.
+#   python api.py [DB_FILE] [--host 127.0.0.1] [--port 8000]
+#
+# With UDHAR_API_KEY set, every request but /health needs a matching X-API-Key header.
+# The API is a trusted back-office surface: no per-user sessions.
+#   POST /users                  {name, phone, email, password}
+#   POST /login                  {login, password}
+#   POST /loans                  one application (service.APPLICATION_FIELDS)
+#   POST /loans/batch            {"loans": [...]} or a JSON list
+#   GET  /loans/{id}
+#   POST /loans/{id}/approve     /loans/{id}/reject
+#   GET  /users/{id}/loans       ?archived=1 includes archived loans
+#   POST /payments               {loan_id, amount, method, receipt?}
+#   POST /payments/batch         a JSON list of payments, or a text/csv settlement file
+#                                (loan_id, amount, receipt[, paid_at, method]); ?method= for the file
+#   POST /reminders              {days_ahead}
+import argparse
+import hmac
+import json
+import os
+import threading
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import archive
+import db
+import service
+
+DB_FILE = "loans_pro.db"
+API_KEY_ENV = "UDHAR_API_KEY"
+MAX_BATCH = 50000   # rows per batch request; bigger files should be split by the caller
+
+class _State:
+    # the Database (one writer) and a read connection per worker thread
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.database = None
+        self._local = threading.local()
+
+    def open(self):
+        self.database = db.Database(self.db_file)
+        archive.attach(self.database)
+
+    def reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.database.reader()
+        return conn
+
+    def close(self):
+        self.database.close()
+
+def _rows(conn, sql, params):
+    cur = conn.execute(sql, params)
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+async def _json(request):
+    body = await request.body()
+    if not body:
+        return {}
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        raise service.ServiceError("Request body must be JSON.")
+
+async def _json_object(request):
+    # for endpoints that take one JSON object
+    body = await _json(request)
+    if not isinstance(body, dict):
+        raise service.ServiceError("Request body must be a JSON object.")
+    return body
+
+async def _json_or_csv(request):
+    # settlement files come in as text/csv, everything else is JSON
+    if request.headers.get("content-type", "").startswith("text/"):
+        return (await request.body()).decode("utf-8-sig")
+    return await _json(request)
+
+def _endpoint(fn, read_body=None):
+    # Route handler: read_body(request) here, fn(state, request, body) in a worker
+    # thread. fn returns a payload or (status, payload); ServiceError becomes a JSON error.
+    async def endpoint(request):
+        try:
+            body = await read_body(request) if read_body else None
+            result = await run_in_threadpool(fn, request.app.state.loans, request, body)
+        except service.ServiceError as e:
+            return JSONResponse({"error": str(e)}, status_code=e.status)
+        status, payload = result if isinstance(result, tuple) else (200, result)
+        return JSONResponse(payload, status_code=status)
+    return endpoint
+
+# -----------------------
+# Endpoints (run in worker threads)
+# -----------------------
+def health(state, request, body):
+    return {"ok": True, "db": state.db_file}
+
+def create_user(state, request, body):
+    name, phone, email, password = (str(body[k]) if body.get(k) is not None else None
+                                    for k in ("name", "phone", "email", "password"))
+    user_id = service.signup(state.database, name, phone, email, password)
+    return 201, {"id": user_id}
+
+def login(state, request, body):
+    return service.login(state.reader(), str(body.get("login") or ""), str(body.get("password") or ""))
+
+def create_loan(state, request, body):
+    return 201, service.apply_loan(state.database, state.reader(), body)
+
+def create_loans(state, request, body):
+    apps = body.get("loans") if isinstance(body, dict) else body
+    if not isinstance(apps, list) or len(apps) > MAX_BATCH:
+        raise service.ServiceError(f"Expected a list of at most {MAX_BATCH} loans.")
+    return service.submit_loans(state.database, state.reader(), apps)
+
+def get_loan(state, request, body):
+    rows = _rows(state.reader(), db.LOAN_BY_ID, (int(request.path_params["loan_id"]),))
+    if not rows:
+        raise service.ServiceError("Loan not found.", 404)
+    loan = rows[0]
+    loan["installments"] = _rows(state.reader(), db.LOAN_INSTALLMENTS, (loan["id"],))
+    return loan
+
+def decide(approve):
+    def endpoint(state, request, body):
+        loan_id = int(request.path_params["loan_id"])
+        if not service.decide_loan(state.database, loan_id, approve):
+            raise service.ServiceError("Loan not found.", 404)
+        return {"id": loan_id, "status": "approved" if approve else "rejected"}
+    return endpoint
+
+def user_loans(state, request, body):
+    user_id = int(request.path_params["user_id"])
+    if request.query_params.get("archived") in ("1", "true"):
+        return _rows(state.reader(), archive.USER_LOANS, (user_id, user_id))
+    return _rows(state.reader(), db.USER_LOANS, (user_id,))
+
+def create_payment(state, request, body):
+    loan_id, amount, method, receipt, _ = service.payment_row(body)
+    return 201, service.repay(state.database, loan_id, amount, method, receipt)
+
+def create_payments(state, request, body):
+    if isinstance(body, str):
+        payments = service.parse_settlement(body, request.query_params.get("method", service.PAYMENT_METHODS[0]))
+    elif isinstance(body, list):
+        payments = [service.payment_row(p, where=f"Payment {i}") for i, p in enumerate(body)]
+    else:
+        raise service.ServiceError("Expected a list of payments or a CSV settlement file.")
+    if len(payments) > MAX_BATCH:
+        raise service.ServiceError(f"At most {MAX_BATCH} payments per request.")
+    return service.post_payments(state.database, payments)
+
+def reminders(state, request, body):
+    days_ahead = body.get("days_ahead", 7)
+    if not isinstance(days_ahead, int) or days_ahead < 0:
+        raise service.ServiceError("days_ahead must be a whole number of days.")
+    return {"queued": service.queue_reminders(state.database, state.reader(), days_ahead)}
+
+class _ApiKey(BaseHTTPMiddleware):
+    def __init__(self, app, key):
+        super().__init__(app)
+        self.key = key
+
+    async def dispatch(self, request, call_next):
+        if self.key and request.url.path != "/health" \
+                and not hmac.compare_digest(request.headers.get("x-api-key", ""), self.key):
+            return JSONResponse({"error": "Missing or wrong X-API-Key."}, status_code=401)
+        return await call_next(request)
+
+def create_app(db_file=DB_FILE, api_key=None):
+    state = _State(db_file)
+    routes = [
+        Route("/health", _endpoint(health)),
+        Route("/users", _endpoint(create_user, _json_object), methods=["POST"]),
+        Route("/login", _endpoint(login, _json_object), methods=["POST"]),
+        Route("/loans", _endpoint(create_loan, _json_object), methods=["POST"]),
+        Route("/loans/batch", _endpoint(create_loans, _json), methods=["POST"]),
+        Route("/loans/{loan_id:int}", _endpoint(get_loan)),
+        Route("/loans/{loan_id:int}/approve", _endpoint(decide(True)), methods=["POST"]),
+        Route("/loans/{loan_id:int}/reject", _endpoint(decide(False)), methods=["POST"]),
+        Route("/users/{user_id:int}/loans", _endpoint(user_loans)),
+        Route("/payments", _endpoint(create_payment, _json_object), methods=["POST"]),
+        Route("/payments/batch", _endpoint(create_payments, _json_or_csv), methods=["POST"]),
+        Route("/reminders", _endpoint(reminders, _json_object), methods=["POST"]),
+    ]
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await run_in_threadpool(state.open)   # migrations may take a while on first start
+        yield
+        state.close()
+
+    app = Starlette(routes=routes, lifespan=lifespan,
+                    middleware=[Middleware(_ApiKey, key=api_key or os.environ.get(API_KEY_ENV))])
+    app.state.loans = state
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="HTTP API for loan submission, repayments and settlement files")
+    parser.add_argument("db_file", nargs="?", default=DB_FILE)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.db_file), host=args.host, port=args.port)
@@ -1,26 +1,38 @@
 # app.py
 import streamlit as st
-import pandas as pd
-import sqlite3
 from datetime import datetime, timedelta, date
-import os, hashlib, random, string, io
-from fpdf import FPDF
-import matplotlib.pyplot as plt
-import base64
-import requests  # for payment / webhook (placeholders)
-from pathlib import Path
+import os, tempfile, time
+
+# Project modules are cheap to import; pandas, matplotlib, NumPy (amortization),
+# fpdf and Pillow are imported inside the functions and pages that use them, so
+# Home and Signup / Login never load them (see: python benchmarks.py rerun).
+import archive
+import db
+import exports
+import notify
+import pdfs
+import perf
+import replica
+import rollups
+import search
+import service
+import storage
+from pdfs import mask_cnic
 
 # -----------------------
 # Config / Constants
 # -----------------------
 DB_FILE = "loans_pro.db"
-UPLOAD_FOLDER = "uploads"
+UPLOAD_FOLDER = storage.UPLOAD_FOLDER
 ADMIN_DEFAULT = {"phone": "0000000000", "email": "admin@example.com", "password": "admin123"}  # change ASAP
 EMAIL_NOTIFICATIONS_ENABLED = False  # set True & configure below to send emails
 SMS_NOTIFICATIONS_ENABLED = False
 EASYPaisa_ENABLED = False
 JAZZCASH_ENABLED = False
 
+SLOW_QUERY_MS = 200   # statements slower than this go to perf.SLOW_LOG_FILE
+ANALYTICS_REPLICA_ENABLED = True   # heavy reports + portfolio export on DuckDB, when duckdb is installed
+
 # Email/SMS / Payment config placeholders
 EMAIL_CONFIG = {
     "smtp_server": "smtp.example.com",
@@ -42,161 +54,73 @@ JAZZPAY_CONFIG = {"api_key": "JAZZ_API_KEY", "sandbox": True}
 def ensure_folder(p):
     os.makedirs(p, exist_ok=True)
 
-ensure_folder(UPLOAD_FOLDER)
-
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
-
-def verify_password(password: str, hashed: str) -> bool:
-    return hash_password(password) == hashed
-
-def random_txn():
-    return "TXN-" + ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-
 # -----------------------
 # Database Setup & Migration
 # -----------------------
-conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+# Streamlit re-executes this file on every interaction; everything that only
+# needs doing once per server process (folders, migrations, default admin,
+# the notification dispatcher) happens here and is cached.
+@st.cache_resource
+def bootstrap():
+    ensure_folder(UPLOAD_FOLDER)
+    recorder = perf.Recorder(SLOW_QUERY_MS)
+    database = db.Database(DB_FILE, observe=recorder.query)
+    database.write(service.ensure_admin, ADMIN_DEFAULT)
+    # long-closed loans live in loans_archive.db (python archive.py moves them)
+    archive.attach(database)
+    # Notifications go through the outbox: pages enqueue inside their own write
+    # transaction and the background dispatcher does the sending.
+    senders = {
+        notify.EMAIL: notify.SmtpSender(**EMAIL_CONFIG) if EMAIL_NOTIFICATIONS_ENABLED else None,
+        notify.SMS: notify.TwilioSmsSender(**TWILIO_CONFIG) if SMS_NOTIFICATIONS_ENABLED else None,
+    }
+    dispatcher = notify.Dispatcher(database, senders).start()
+    return database, dispatcher, recorder
+
+database, dispatcher, recorder = bootstrap()
+
+@st.cache_resource
+def open_replica():
+    # opened on first use, so pages that never report don't load DuckDB
+    return replica.Replica(replica.replica_path(DB_FILE))
+
+def analytics_replica():
+    # the DuckDB replica, refreshed if stale - or None to stay on SQLite
+    if not (ANALYTICS_REPLICA_ENABLED and replica.available()):
+        return None
+    analytics = open_replica()
+    analytics.refresh_if_stale(database)
+    return analytics
+
+# each session reads through its own connection; WAL keeps readers off the writer's lock
+if "db_reader" not in st.session_state:
+    st.session_state["db_reader"] = database.reader()
+conn = st.session_state["db_reader"]
 c = conn.cursor()
 
-# Create users table
-c.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT,
-    phone TEXT UNIQUE,
-    email TEXT UNIQUE,
-    password_hash TEXT,
-    is_admin INTEGER DEFAULT 0,
-    created_at TEXT
-)
-""")
-
-# Base loans table
-c.execute("""
-CREATE TABLE IF NOT EXISTS loans (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    name TEXT,
-    father_name TEXT,
-    phone TEXT,
-    cnic TEXT,
-    address TEXT,
-    user_image_path TEXT,
-    cnic_image_path TEXT,
-    amount REAL,
-    interest_rate REAL,
-    total_payable REAL,
-    status TEXT,            -- pending/approved/rejected/paid
-    due_date TEXT,
-    created_at TEXT,
-    payment_status TEXT,    -- Unpaid / Partially Paid / Paid
-    receipt_no TEXT,
-    installment_plan TEXT   -- JSON string or text describing installments
-)
-""")
-conn.commit()
-
-# helper to add columns safely (migration)
-def add_column_if_not_exists(table, column, coltype):
-    try:
-        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {coltype}")
-        conn.commit()
-    except Exception:
-        pass
-
-# add any future columns here using add_column_if_not_exists if needed
-
-# Create default admin if none exists
-def ensure_admin():
-    c.execute("SELECT COUNT(*) as cnt FROM users WHERE is_admin=1")
-    if c.fetchone()[0] == 0:
-        pwd_hash = hash_password(ADMIN_DEFAULT["password"])
-        c.execute("INSERT OR IGNORE INTO users (name, phone, email, password_hash, is_admin, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                  ("Admin", ADMIN_DEFAULT["phone"], ADMIN_DEFAULT["email"], pwd_hash, 1, datetime.utcnow().isoformat()))
-        conn.commit()
-
-ensure_admin()
-
 # -----------------------
 # Helper Functions
 # -----------------------
 def save_upload(uploaded_file, folder=UPLOAD_FOLDER):
-    if uploaded_file is None:
-        return None
-    ensure_folder(folder)
-    safe_name = f"{int(datetime.utcnow().timestamp())}_{uploaded_file.name}"
-    path = os.path.join(folder, safe_name)
-    with open(path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return path
-
-def calculate_total_simple(principal: float, annual_rate: float, days: int) -> float:
-    # simple interest
-    interest = (principal * annual_rate * days) / 365.0
-    total = principal + interest
-    return round(total, 2)
-
-def mask_cnic(cnic):
-    # show like 42101-XXXXX-2 (keep first 5 and last 1)
-    if not cnic or len(cnic) < 5:
-        return "****"
-    return cnic[:5] + "-" + "X"*7 + "-" + cnic[-1]
-
-def generate_pdf_agreement(loan_record: dict):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    pdf.cell(0, 10, "Loan Agreement", ln=True, align="C")
-    pdf.ln(5)
-    pdf.set_font("Arial", size=10)
-    pdf.multi_cell(0, 7, f"Loan ID: {loan_record['id']}")
-    pdf.multi_cell(0, 7, f"Borrower Name: {loan_record['name']}")
-    pdf.multi_cell(0, 7, f"Father Name: {loan_record.get('father_name','')}")
-    pdf.multi_cell(0, 7, f"CNIC: {mask_cnic(loan_record.get('cnic',''))}")
-    pdf.multi_cell(0, 7, f"Loan Amount: PKR {loan_record['amount']}")
-    pdf.multi_cell(0, 7, f"Total Payable: PKR {loan_record['total_payable']}")
-    pdf.multi_cell(0, 7, f"Due Date: {loan_record['due_date']}")
-    pdf.ln(10)
-    pdf.multi_cell(0, 7, "Terms & Conditions:")
-    pdf.multi_cell(0, 6, "1. This is a sample agreement for demo purposes only.")
-    pdf.multi_cell(0, 6, "2. The borrower agrees to repay by the due date.")
-    pdf.ln(20)
-    pdf.multi_cell(0, 7, f"Signed: {loan_record['name']}")
-    output = io.BytesIO()
-    pdf.output(output)
-    output.seek(0)
-    return output
-
-def send_email_placeholder(to_email, subject, body):
-    # placeholder: implement real SMTP send if EMAIL_NOTIFICATIONS_ENABLED
-    if not EMAIL_NOTIFICATIONS_ENABLED:
-        st.info(f"(Email not sent) would send to {to_email}: {subject}")
-        return False
-    # Implement actual SMTP here using EMAIL_CONFIG...
-    return True
-
-def send_sms_placeholder(to_number, message):
-    if not SMS_NOTIFICATIONS_ENABLED:
-        st.info(f"(SMS not sent) would send to {to_number}: {message}")
-        return False
-    # Implement Twilio logic...
-    return True
-
-def create_installment_schedule(principal, annual_rate, days, installments):
-    # naive equal installments (simple interest)
-    total = calculate_total_simple(principal, annual_rate, days)
-    per_inst = round(total / installments, 2)
-    schedule = []
-    start = date.today()
-    interval = int(days / installments) if installments>0 else days
-    for i in range(installments):
-        d = start + timedelta(days=interval*(i+1))
-        schedule.append({"inst_no": i+1, "due_date": d.isoformat(), "amount": per_inst, "paid": False})
-    return schedule
+    # streamed, stored once per distinct content, thumbnails pre-built
+    return storage.save_upload(uploaded_file, folder)
+
+def export_button(label, name, sql, params, fmt, file_stem, connect=None):
+    # The export only runs when the button is clicked - on its own read connection
+    # (connect(), default a SQLite reader), streamed chunk by chunk into a temp file (see exports.py).
+    def build():
+        reader = (connect or database.reader)()
+        try:
+            with recorder.timed(perf.TASK, f"{name} export ({fmt})"):
+                return exports.export(reader, sql, params, fmt)[0]
+        finally:
+            reader.close()
+    return st.download_button(label, build, file_name=exports.file_name(file_stem, fmt), mime=exports.mime(fmt))
 
 def df_from_query(query, params=()):
-    return pd.read_sql_query(query, conn, params=params)
+    import pandas as pd
+    # cached across reruns and sessions until a write touches one of the query's tables
+    return database.cached(query, params, lambda: pd.read_sql_query(query, conn, params=params))
 
 # -----------------------
 # Streamlit UI & Auth
@@ -213,6 +137,8 @@ tabs = ["Home", "Signup / Login"]
 if st.session_state["user"]:
     tabs = ["Home", "Dashboard", "Apply Loan", "Repay", "History", "Admin"]
 page = st.sidebar.selectbox("Navigation", tabs)
+view = page   # what the render time is recorded under; admin actions refine it
+view_started = time.perf_counter()
 
 # Quick Home
 if page == "Home":
@@ -244,18 +170,14 @@ if page == "Signup / Login":
             password2 = st.text_input("Confirm Password", type="password", key="su_pass2")
             submit = st.form_submit_button("Create Account")
             if submit:
-                if not name or not phone or not password:
-                    st.error("Name, phone and password are required.")
-                elif password != password2:
+                if password != password2:
                     st.error("Passwords don't match.")
                 else:
                     try:
-                        c.execute("INSERT INTO users (name, phone, email, password_hash, is_admin, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                                  (name, phone, email, hash_password(password), 0, datetime.utcnow().isoformat()))
-                        conn.commit()
+                        service.signup(database, name, phone, email, password)
                         st.success("Account created. Please login in the right column.")
-                    except sqlite3.IntegrityError as e:
-                        st.error("Phone or Email already registered.")
+                    except service.ServiceError as e:
+                        st.error(str(e))
 
     with col2:
         st.subheader("Login")
@@ -265,36 +187,36 @@ if page == "Signup / Login":
             login_btn = st.form_submit_button("Login")
             if login_btn:
                 # allow login by phone or email
-                c.execute("SELECT * FROM users WHERE phone=? OR email=?", (login_phone, login_phone))
-                row = c.fetchone()
-                if not row:
-                    st.error("User not found.")
+                try:
+                    st.session_state["user"] = service.login(conn, login_phone, login_pass)
+                except service.ServiceError as e:
+                    st.error(str(e))
                 else:
-                    if verify_password(login_pass, row[4]):
-                        st.session_state["user"] = {"id": row[0], "name": row[1], "phone": row[2], "email": row[3], "is_admin": row[5]}
-                        st.success(f"Welcome {row[1]}")
-                        st.rerun()
-
-                    else:
-                        st.error("Invalid password.")
+                    st.success(f"Welcome {st.session_state['user']['name']}")
+                    st.rerun()
 
 # Dashboard for logged-in user
 if page == "Dashboard" and st.session_state["user"]:
     u = st.session_state["user"]
     st.header(f"Dashboard — {u['name']}")
     st.write(f"Phone: {u['phone']}  |  Email: {u.get('email','-')}")
+    # closed loans archived long ago are only read when asked for
+    if st.checkbox("Include archived loans", key="dashboard_archived"):
+        stats_query, loans_query, params = archive.USER_LOAN_STATS, archive.USER_LOANS, (u["id"], u["id"])
+    else:
+        stats_query, loans_query, params = db.USER_LOAN_STATS, db.USER_LOANS, (u["id"],)
     # quick stats
-    df_total = df_from_query("SELECT COUNT(*) as total, SUM(amount) as total_amount FROM loans WHERE user_id=?", (u["id"],))
+    df_total = df_from_query(stats_query, params)
     st.write("Your total applications:", int(df_total["total"][0]) if not df_total.empty else 0)
-    user_loans = df_from_query("SELECT * FROM loans WHERE user_id=? ORDER BY created_at DESC", (u["id"],))
+    user_loans = df_from_query(loans_query, params)
     if not user_loans.empty:
         st.dataframe(user_loans[["id","amount","total_payable","status","due_date","payment_status"]])
         # download CSV
-        csv = user_loans.to_csv(index=False).encode()
-        st.download_button("Download My Loan Data (CSV)", csv, file_name=f"my_loans_{u['phone']}.csv")
+        export_button("Download My Loan Data (CSV)", "Dashboard", loans_query, params, "csv", f"my_loans_{u['phone']}")
 
 # Apply Loan page
 if page == "Apply Loan" and st.session_state["user"]:
+    import amortization
     st.header("Apply for a Loan")
     with st.form("apply"):
         name = st.text_input("Full Name", value=st.session_state["user"]["name"])
@@ -304,91 +226,69 @@ if page == "Apply Loan" and st.session_state["user"]:
         address = st.text_area("Address")
         profile = st.file_uploader("Upload Profile Image", type=["jpg","jpeg","png"])
         cnic_img = st.file_uploader("Upload CNIC Image (front/back)", type=["jpg","jpeg","png"])
-        amount = st.number_input("Loan Amount (PKR)", min_value=1000.0, step=500.0)
-        duration = st.number_input("Duration (days)", min_value=7, max_value=365, value=30)
-        rate = st.number_input("Annual Interest Rate (%)", value=10.0)/100
+        amount = st.number_input("Loan Amount (PKR)", min_value=service.MIN_AMOUNT, max_value=service.MAX_AMOUNT, step=500.0)
+        duration = st.number_input("Duration (days)", min_value=service.MIN_DAYS, max_value=service.MAX_DAYS, value=30)
+        rate = st.number_input("Annual Interest Rate (%)", min_value=0.0, max_value=service.MAX_RATE*100, value=10.0)/100
         plan_type = st.selectbox("Repayment Type", ["One-Time", "Installments (EMI)"])
         installments = 0
-        inst_json = None
         if plan_type == "Installments (EMI)":
-            installments = st.number_input("Number of Installments", min_value=1, max_value=12, value=3)
+            installments = st.number_input("Number of Installments", min_value=1, max_value=service.MAX_INSTALLMENTS, value=3)
+        interest_model = st.selectbox("Interest Model", ["Flat (simple interest)", "Reducing balance"])
         sub = st.form_submit_button("Submit Loan Application")
         if sub:
-            if not name.strip() or not phone.strip() or not cnic.strip():
-                st.error("Name, Phone & CNIC required.")
+            application = {"user_id": st.session_state["user"]["id"], "user_email": st.session_state["user"].get("email"),
+                           "name": name, "father_name": father, "phone": phone, "cnic": cnic, "address": address,
+                           "amount": amount, "duration_days": int(duration), "interest_rate": rate,
+                           "installments": int(installments),
+                           "interest_model": amortization.REDUCING if interest_model == "Reducing balance" else amortization.FLAT}
+            try:
+                warnings = service.check_application(conn, application)
+            except service.ServiceError as e:
+                st.error(str(e))
             else:
-                user_img_path = save_upload(profile)
-                cnic_img_path = save_upload(cnic_img)
-                total = calculate_total_simple(amount, rate, int(duration))
-                inst_info = None
-                if installments > 1:
-                    schedule = create_installment_schedule(amount, rate, int(duration), int(installments))
-                    inst_info = str(schedule)
-                created_at = datetime.utcnow().isoformat()
-                c.execute("""INSERT INTO loans (user_id, name, father_name, phone, cnic, address,
-                             user_image_path, cnic_image_path, amount, interest_rate, total_payable,
-                             status, due_date, created_at, payment_status, receipt_no, installment_plan)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                          (st.session_state["user"]["id"], name, father, phone, cnic, address,
-                           user_img_path, cnic_img_path, amount, rate, total,
-                           "pending", (date.today()+timedelta(days=duration)).isoformat(), created_at, "Unpaid", None, inst_info))
-                conn.commit()
+                for warning in warnings:
+                    st.warning(warning)
+                # uploads are only stored for an application that goes in
+                application["user_image_path"] = save_upload(profile)
+                application["cnic_image_path"] = save_upload(cnic_img)
+                # loan row, installment rows and notifications commit together
+                _, total = service.insert_loan(database, application)
                 st.success(f"Application submitted. Total payable PKR {total}. Pending admin approval.")
-                # send notification placeholders
-                send_email_placeholder(st.session_state["user"].get("email"), "Loan Submitted", f"Your loan for PKR {amount} submitted.")
-                send_sms_placeholder(phone, f"Your loan application of PKR {amount} submitted.")
 
 # Repay page (user)
 if page == "Repay" and st.session_state["user"]:
     st.header("Repay Loan")
     u = st.session_state["user"]
-    df = df_from_query("SELECT * FROM loans WHERE user_id=? AND status='approved' AND payment_status!='Paid'", (u["id"],))
+    df = df_from_query(db.USER_REPAYABLE_LOANS, (u["id"],))
     if df.empty:
         st.info("No approved unpaid loans.")
     else:
-        st.dataframe(df[["id","amount","total_payable","due_date","payment_status","installment_plan"]])
+        st.dataframe(df[["id","amount","total_payable","amount_paid","outstanding","penalty_accrued","due_date","payment_status","installment_plan"]])
         loan_id = st.number_input("Enter Loan ID to pay", min_value=1, step=1)
-        payment_mode = st.selectbox("Payment Method", ["Mock - Easypaisa", "Mock - JazzCash"])
-        pay_amt = st.number_input("Payment Amount (PKR)", min_value=1.0)
+        payment_mode = st.selectbox("Payment Method", service.PAYMENT_METHODS)
+        pay_amt = st.number_input("Payment Amount (PKR)", min_value=1.0, max_value=service.MAX_AMOUNT)
         if st.button("Make Payment"):
             # In production you'd call the gateway and verify webhook.
-            receipt = random_txn()
-            # handle partial payment logic
-            c.execute("SELECT total_payable FROM loans WHERE id=?", (loan_id,))
-            row = c.fetchone()
-            if not row:
-                st.error("Loan not found.")
+            # ledger insert, balance update and receipt notifications commit together
+            try:
+                result = service.repay(database, int(loan_id), pay_amt, payment_mode)
+            except service.ServiceError as e:
+                st.error(str(e))
             else:
-                total_pay = float(row[0])
-                # simplistic: if pay_amt >= remaining => mark Paid
-                c.execute("SELECT SUM(amount) FROM (SELECT amount FROM payments WHERE loan_id=?)", (loan_id,))
-                # payments table may not exist yet; ensure it later
-                # For simplicity, when payment >= total_pay, mark Paid
-                if pay_amt >= total_pay:
-                    c.execute("UPDATE loans SET payment_status='Paid', receipt_no=? WHERE id=?", (receipt, loan_id))
-                else:
-                    c.execute("UPDATE loans SET payment_status='Partially Paid' WHERE id=?", (loan_id,))
-                # create payments table if not exists then insert
-                c.execute("""CREATE TABLE IF NOT EXISTS payments (
-                                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                loan_id INTEGER,
-                                amount REAL,
-                                payment_method TEXT,
-                                paid_at TEXT,
-                                receipt TEXT
-                            )""")
-                c.execute("INSERT INTO payments (loan_id, amount, payment_method, paid_at, receipt) VALUES (?, ?, ?, ?, ?)",
-                          (loan_id, pay_amt, payment_mode, datetime.utcnow().isoformat(), receipt))
-                conn.commit()
-                st.success(f"Payment recorded. Receipt: {receipt}")
-                send_email_placeholder(u.get("email"), "Payment Received", f"Payment of PKR {pay_amt} received. Receipt {receipt}")
-                send_sms_placeholder(u.get("phone"), f"Payment PKR {pay_amt} received. Receipt {receipt}")
+                st.success(f"Payment recorded. Receipt: {result['receipt']}. "
+                           f"Remaining balance PKR {result['outstanding']:,.2f} ({result['payment_status']}).")
 
 # History page
 if page == "History" and st.session_state["user"]:
     st.header("Loan History & Documents")
     u = st.session_state["user"]
-    df = df_from_query("SELECT * FROM loans WHERE user_id=? ORDER BY created_at DESC", (u["id"],))
+    with_archive = st.checkbox("Include archived loans", key="history_archived",
+                               help="Loans paid off or rejected long ago are kept in the archive.")
+    if with_archive:
+        loans_query, params = archive.USER_LOANS, (u["id"], u["id"])
+    else:
+        loans_query, params = db.USER_LOANS, (u["id"],)
+    df = df_from_query(loans_query, params)
     if df.empty:
         st.info("You have no loan records.")
     else:
@@ -398,84 +298,250 @@ if page == "History" and st.session_state["user"]:
         st.write("Borrower:", loan["name"])
         st.write("CNIC (masked):", mask_cnic(loan.get("cnic","")))
         st.write("Status:", loan["status"])
+        if with_archive:
+            inst = df_from_query(archive.LOAN_INSTALLMENTS, (int(sel), int(sel)))
+        else:
+            inst = df_from_query(db.LOAN_INSTALLMENTS, (int(sel),))
+        if not inst.empty:
+            st.markdown("**Installment schedule**")
+            st.dataframe(inst)
         if loan.get("user_image_path"):
-            st.image(loan["user_image_path"], width=150, caption="Profile image")
+            st.image(storage.thumbnail(loan["user_image_path"], 150), width=150, caption="Profile image")
         if loan.get("cnic_image_path"):
-            st.image(loan["cnic_image_path"], width=300, caption="CNIC image")
+            st.image(storage.thumbnail(loan["cnic_image_path"], 300), width=300, caption="CNIC image")
         if st.button("Download Agreement (PDF)"):
-            pdf_bytes = generate_pdf_agreement(loan).read()
+            # cached on disk by content; only re-rendered when a printed field changes
+            with recorder.timed(perf.TASK, "Agreement PDF"):
+                with open(pdfs.render_cached(pdfs.AGREEMENT, pdfs.agreement_fields(loan)), "rb") as f:
+                    pdf_bytes = f.read()
             st.download_button("Download Agreement", pdf_bytes, file_name=f"agreement_loan_{sel}.pdf", mime="application/pdf")
-        if st.button("Export My Data (Excel)"):
-            out = io.BytesIO()
-            df.to_excel(out, index=False)
-            out.seek(0)
-            st.download_button("Download Excel", out, file_name=f"loan_history_{u['phone']}.xlsx")
+        export_button("Export My Data (Excel)", "History", loans_query, params, "xlsx", f"loan_history_{u['phone']}")
 
 # Admin area
 if page == "Admin" and st.session_state["user"] and st.session_state["user"].get("is_admin"):
     st.header("Admin Panel — Manage Loans")
-    menu_admin = st.sidebar.selectbox("Admin Actions", ["All Loans", "Pending Approvals", "Analytics", "Reminders & Export", "User Management"])
+    qc = database.cache.stats()
+    st.caption(f"Query cache: {qc['hits']} hits / {qc['misses']} misses ({qc['hit_rate']:.0%}), {qc['entries']} entries")
+    menu_admin = st.sidebar.selectbox("Admin Actions", ["All Loans", "Borrower Search", "Pending Approvals", "Analytics",
+                                                        "Reminders & Export", "Portfolio Export", "User Management",
+                                                        "Performance"])
+    view = f"Admin / {menu_admin}"
     if menu_admin == "All Loans":
-        df = df_from_query("SELECT loans.*, users.email as user_email, users.name as user_fullname FROM loans LEFT JOIN users ON loans.user_id=users.id ORDER BY created_at DESC")
+        fc1, fc2, fc3, fc4, fc5 = st.columns(5)
+        f_status = fc1.selectbox("Status", ["All", "pending", "approved", "rejected", "paid"])
+        f_from = fc2.date_input("Created from", value=None)
+        f_to = fc3.date_input("Created to", value=None)
+        f_min = fc4.number_input("Min amount", min_value=0.0, step=500.0)
+        f_max = fc5.number_input("Max amount (0 = any)", min_value=0.0, step=500.0)
+        filters = (None if f_status == "All" else f_status, f_from, f_to, f_min, f_max)
+        # keyset cursors of the pages visited so far; start over whenever the filters change
+        if st.session_state.get("all_loans_filters") != filters:
+            st.session_state["all_loans_filters"] = filters
+            st.session_state["all_loans_cursors"] = [None]
+        cursors = st.session_state["all_loans_cursors"]
+        df = df_from_query(*db.loans_page_query(*filters, after=cursors[-1]))
         st.dataframe(df)
+        pc1, pc2, pc3 = st.columns([1, 1, 4])
+        pc3.caption(f"Page {len(cursors)}")
+        if pc1.button("Previous", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        if pc2.button("Next", disabled=len(df) < db.ADMIN_PAGE_SIZE):
+            last = df.iloc[-1]
+            cursors.append((last["created_at"], int(last["id"])))
+            st.rerun()
         # show each loan with preview + approve/reject
         st.markdown("### Approve / Reject")
         loan_id = st.number_input("Loan ID", min_value=1, step=1)
         if loan_id:
-            r = df[df["id"]==loan_id]
+            r = df_from_query(db.LOAN_BY_ID, (int(loan_id),))
             if r.empty:
-                st.info("Loan not found.")
+                st.info("Loan not found. Loans closed long ago are in the archive.")
             else:
                 rec = r.iloc[0].to_dict()
                 st.write("Applicant:", rec.get("name"))
                 st.write("Phone:", rec.get("phone"))
                 st.write("CNIC (masked):", mask_cnic(rec.get("cnic","")))
                 if rec.get("user_image_path"):
-                    st.image(rec.get("user_image_path"), width=120)
+                    st.image(storage.thumbnail(rec.get("user_image_path"), 120), width=120)
                 if rec.get("cnic_image_path"):
-                    st.image(rec.get("cnic_image_path"), width=300)
+                    st.image(storage.thumbnail(rec.get("cnic_image_path"), 300), width=300)
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button("Approve"):
-                        c.execute("UPDATE loans SET status='approved' WHERE id=?", (loan_id,))
-                        conn.commit()
+                        service.decide_loan(database, int(loan_id), approve=True)
                         st.success("Loan approved.")
-                        # send notifications
-                        send_email_placeholder(rec.get("user_email"), "Loan Approved", f"Your loan ID {loan_id} approved.")
-                        send_sms_placeholder(rec.get("phone"), f"Loan {loan_id} approved.")
                 with col2:
                     if st.button("Reject"):
-                        c.execute("UPDATE loans SET status='rejected' WHERE id=?", (loan_id,))
-                        conn.commit()
+                        service.decide_loan(database, int(loan_id), approve=False)
                         st.error("Loan rejected.")
-                        send_email_placeholder(rec.get("user_email"), "Loan Rejected", f"Your loan ID {loan_id} rejected.")
-                        send_sms_placeholder(rec.get("phone"), f"Loan {loan_id} rejected.")
+    elif menu_admin == "Borrower Search":
+        text = st.text_input("Search by name, father name, phone, CNIC or email",
+                             placeholder="e.g. Faisal Ahmed, 0300123, 42101-1234567-1")
+        if st.session_state.get("search_text") != text:
+            st.session_state["search_text"] = text
+            st.session_state["search_page"] = 0
+        query = search.search_query(text, st.session_state["search_page"])
+        if query:
+            t0 = time.perf_counter()
+            hits = df_from_query(*query)
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            has_next = len(hits) > search.SEARCH_PAGE_SIZE
+            hits = hits.head(search.SEARCH_PAGE_SIZE).copy()
+            hits["cnic"] = hits["cnic"].map(mask_cnic)
+            if hits.empty:
+                st.info("No borrowers match.")
+            else:
+                st.dataframe(hits, hide_index=True)
+            sc1, sc2, sc3 = st.columns([1, 1, 4])
+            sc3.caption(f"Page {st.session_state['search_page'] + 1}, best matches first - {elapsed_ms:.1f} ms")
+            if sc1.button("Previous", disabled=st.session_state["search_page"] == 0):
+                st.session_state["search_page"] -= 1
+                st.rerun()
+            if sc2.button("Next", disabled=not has_next):
+                st.session_state["search_page"] += 1
+                st.rerun()
+            st.caption("Open a loan by its ID under All Loans to approve or reject it.")
     elif menu_admin == "Pending Approvals":
-        df = df_from_query("SELECT * FROM loans WHERE status='pending' ORDER BY created_at DESC")
+        import pandas as pd
+        import underwriting
+        df = df_from_query(db.PENDING_LOANS)
         st.dataframe(df)
+        st.markdown("### Bulk decisions")
+        st.caption("Reject rules beat review rules; a loan no rule fires on is approved. Review loans stay pending.")
+        rules_table = st.data_editor(
+            pd.DataFrame(underwriting.DEFAULT_RULES, columns=underwriting.RULE_COLUMNS), key="uw_rules", num_rows="dynamic",
+            column_config={"feature": st.column_config.SelectboxColumn(options=underwriting.FEATURES),
+                           "operator": st.column_config.SelectboxColumn(options=list(underwriting.OPERATORS)),
+                           "decision": st.column_config.SelectboxColumn(options=[underwriting.REJECT, underwriting.REVIEW])})
+        if st.button("Preview decisions (dry run)"):
+            decided, timings = underwriting.preview(conn, underwriting.rules_from_table(rules_table),
+                                                    archive_schema=archive.SCHEMA if archive.SCHEMA in database.attached else None)
+            recorder.record(perf.TASK, "Underwriting rule evaluation", timings["evaluate_ms"] / 1000)
+            st.session_state["uw_preview"] = (decided, timings)
+        if "uw_preview" in st.session_state:
+            decided, timings = st.session_state["uw_preview"]
+            counts = underwriting.summary(decided)
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Approve", counts[underwriting.APPROVE])
+            m2.metric("Reject", counts[underwriting.REJECT])
+            m3.metric("Manual review", counts[underwriting.REVIEW])
+            st.caption(f"{len(decided)} pending loans: loaded in {timings['load_ms']} ms, "
+                       f"rules evaluated in {timings['evaluate_ms']} ms")
+            st.dataframe(decided[["id", "name", "amount", "duration_days", "interest_rate", "open_exposure", "overdue_loans",
+                                  "paid_loans", "decision", "reasons"]])
+            if st.button("Apply decisions"):
+                applied = database.write(underwriting.apply_decisions, decided)
+                del st.session_state["uw_preview"]
+                st.success(f"{applied[underwriting.APPROVE]} approved, {applied[underwriting.REJECT]} rejected; "
+                           f"notifications queued.")
     elif menu_admin == "Analytics":
         st.subheader("Portfolio Analytics")
-        df_all = df_from_query("SELECT status, COUNT(*) as count, SUM(amount) as sum_amount FROM loans GROUP BY status")
+        # everything here reads the trigger-maintained rollup tables, never loans itself
+        totals = df_from_query(rollups.TOTALS).iloc[0]
+        aging = df_from_query(rollups.AGING, (date.today().isoformat(),))
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Loans originated", f"{int(totals['originated']):,}")
+        m2.metric("Disbursed (PKR)", f"{totals['disbursed']:,.0f}")
+        m3.metric("Collected (PKR)", f"{totals['collected']:,.0f}")
+        m4.metric("Outstanding principal (PKR)", f"{aging['principal'].sum() if not aging.empty else 0:,.0f}")
+        accrued = df_from_query(db.ACCRUAL_SUMMARY).iloc[0]
+        if accrued["through"]:
+            a1, a2 = st.columns(2)
+            a1.metric("Interest accrued (PKR)", f"{accrued['interest']:,.0f}")
+            a2.metric("Late penalties charged (PKR)", f"{accrued['penalty']:,.0f}")
+            st.caption(f"Accrued through {accrued['through']} by the nightly job (python accruals.py).")
+        df_all = df_from_query(db.LOAN_STATUS_SUMMARY)
         st.table(df_all)
         # simple chart
         if not df_all.empty:
+            import matplotlib.pyplot as plt
             fig, ax = plt.subplots()
             ax.pie(df_all["count"], labels=df_all["status"], autopct="%1.1f%%")
             st.pyplot(fig)
+        st.markdown("**Delinquency aging (days past due date)**")
+        st.table(aging.set_index("bucket").reindex(rollups.AGING_BUCKETS).fillna(0) if not aging.empty else aging)
+        st.markdown("**Last 90 days**")
+        daily = df_from_query(rollups.DAILY, ((date.today()-timedelta(days=90)).isoformat(),))
+        if not daily.empty:
+            st.line_chart(daily.set_index("day")[["originated_amount", "disbursed_amount", "collected_amount"]])
+        # the reports below scan loans / payments, so they go to the DuckDB replica when there is one
+        analytics = analytics_replica()
+        reports = replica.report_params(archive_schema=archive.SCHEMA if archive.SCHEMA in database.attached else None)
+        engine = "duckdb" if analytics else "sqlite"
+        results = {}
+        for name, (sqlite_sql, duckdb_sql, params) in reports.items():
+            with recorder.timed(perf.TASK, f"Report {name} ({engine})"):
+                results[name] = analytics.query(duckdb_sql, params) if analytics else df_from_query(sqlite_sql, params)
+        st.markdown(f"**Cohort repayment curves (last {replica.COHORT_MONTHS} monthly cohorts)**")
+        cohorts = results["cohorts"]
+        if not cohorts.empty:
+            st.line_chart(cohorts.pivot(index="month_no", columns="cohort", values="repaid_share"))
+            st.caption("Share of each cohort's total payable collected by N months after the loans were taken.")
+        st.markdown("**Collection rate by interest-rate band**")
+        bands = results["rate_bands"]
+        if not bands.empty:
+            bands = bands.assign(band=bands["band_from"].map(replica.band_label)).set_index("band").drop(columns="band_from")
+            st.dataframe(bands)
+        if analytics:
+            last = analytics.last_refresh
+            rc1, rc2 = st.columns([4, 1])
+            rc1.caption(f"From the DuckDB analytics replica, refreshed at {last.get('at', '-')} "
+                        f"in {last.get('seconds', 0)}s (every {replica.REFRESH_AFTER_S}s while in use).")
+            if rc2.button("Refresh now"):
+                analytics.refresh(database)
+                st.rerun()
+        else:
+            st.caption("Computed on SQLite - install duckdb for the columnar analytics replica.")
     elif menu_admin == "Reminders & Export":
         st.subheader("Loans due in next N days")
-        days = st.number_input("Days ahead", min_value=1, value=7)
+        days = st.number_input("Days ahead", min_value=1, max_value=service.MAX_DAYS, value=7)
         target = (date.today()+timedelta(days=days)).isoformat()
-        df = df_from_query("SELECT * FROM loans WHERE due_date <= ? AND status='approved' AND payment_status!='Paid'", (target,))
+        df = df_from_query(db.DUE_LOANS, (target,))
         st.dataframe(df)
-        if st.button("Export Reminders CSV"):
-            out = df.to_csv(index=False).encode()
-            st.download_button("Download Reminders CSV", out, file_name=f"reminders_{target}.csv")
-        if st.button("Send Reminders (Email/SMS placeholders)"):
-            for _, r in df.iterrows():
-                send_email_placeholder(r.get("user_email"), "Loan Due Reminder", f"Loan {r['id']} is due on {r['due_date']}.")
-                send_sms_placeholder(r.get("phone"), f"Loan {r['id']} due on {r['due_date']}.")
-            st.success("Reminder placeholders executed.")
+        due_inst = df_from_query(db.DUE_INSTALLMENTS, (date.today().isoformat(), target))
+        if not due_inst.empty:
+            st.markdown(f"**Installments due by {target}**")
+            st.dataframe(due_inst)
+        export_button("Export Reminders CSV", "Reminders", db.DUE_LOANS, (target,), "csv", f"reminders_{target}")
+        if st.button("Send Reminders (Email/SMS)"):
+            # one batched insert; the dedupe key makes repeat clicks on the same day no-ops
+            queued = service.queue_reminders(database, conn, int(days))
+            st.success(f"{queued} reminder(s) queued for delivery.")
+        st.markdown("### Bulk documents")
+        bulk_n = st.number_input("Most recent approved loans", min_value=1, value=100, step=50)
+        if st.button("Build agreements + receipts ZIP"):
+            ids = [r[0] for r in c.execute("SELECT id FROM loans WHERE status='approved' ORDER BY created_at DESC LIMIT ?", (int(bulk_n),))]
+            docs = pdfs.documents_for(conn, ids)
+            with recorder.timed(perf.TASK, "Bulk documents ZIP"), tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp:
+                count = pdfs.write_zip(docs, tmp, workers=min(8, os.cpu_count() or 1))
+            with open(tmp.name, "rb") as f:
+                zip_bytes = f.read()
+            os.unlink(tmp.name)
+            st.download_button(f"Download {count} documents (ZIP)", zip_bytes, file_name=f"loan_documents_{date.today().isoformat()}.zip",
+                               mime="application/zip")
+    elif menu_admin == "Portfolio Export":
+        st.subheader("Full portfolio export")
+        columns = st.multiselect("Columns", list(exports.PORTFOLIO_COLUMNS), default=list(exports.PORTFOLIO_COLUMNS))
+        ec1, ec2 = st.columns(2)
+        statuses = ec1.multiselect("Status", ["pending", "approved", "rejected", "paid"])
+        pay_statuses = ec2.multiselect("Payment status", ["Unpaid", "Partially Paid", "Paid"])
+        dc1, dc2, dc3 = st.columns(3)
+        date_field = dc1.selectbox("Date field", exports.DATE_FIELDS)
+        d_from = dc2.date_input("From", value=None, key="export_from")
+        d_to = dc3.date_input("To", value=None, key="export_to")
+        fmt = st.radio("Format", exports.available_formats(), horizontal=True)
+        if not columns:
+            st.info("Pick at least one column.")
+        else:
+            analytics = analytics_replica()
+            sql, params = exports.portfolio_query(columns, statuses, pay_statuses, date_field, d_from, d_to,
+                                                  engine="duckdb" if analytics else "sqlite")
+            st.caption("Rows are streamed from the database into the file, so any size of portfolio can be exported.")
+            if analytics:
+                st.caption(f"Exported from the analytics replica, as of {analytics.last_refresh.get('at', '-')}.")
+            export_button(f"Download portfolio ({fmt.upper()})", "Portfolio", sql, params, fmt,
+                          f"loan_portfolio_{date.today().isoformat()}", connect=analytics.cursor if analytics else None)
     elif menu_admin == "User Management":
         st.subheader("Users")
         users = df_from_query("SELECT id,name,phone,email,is_admin,created_at FROM users")
@@ -486,11 +552,35 @@ if page == "Admin" and st.session_state["user"] and st.session_state["user"].get
             r = c.fetchone()
             if r:
                 new = 0 if r[0]==1 else 1
-                c.execute("UPDATE users SET is_admin=? WHERE id=?", (new, uid))
-                conn.commit()
+                database.execute("UPDATE users SET is_admin=? WHERE id=?", (new, uid))
                 st.success("Updated user admin status.")
             else:
                 st.error("User not found.")
+    elif menu_admin == "Performance":
+        import pandas as pd
+        st.subheader("Performance")
+        st.caption(f"Since {datetime.fromtimestamp(recorder.started).strftime('%Y-%m-%d %H:%M:%S')} in this server process. "
+                   f"Percentiles are over the last {perf.RECENT_SAMPLES} samples of each entry; "
+                   f"statements over {recorder.slow_ms} ms are logged to {recorder.log_path}.")
+        cols = ["name", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "mean_ms", "total_ms"]
+        st.markdown("**Pages**")
+        st.dataframe(pd.DataFrame(recorder.summary(perf.PAGE), columns=cols))
+        st.markdown("**PDFs & exports**")
+        st.dataframe(pd.DataFrame(recorder.summary(perf.TASK), columns=cols))
+        st.markdown("**SQL statements**")
+        queries = pd.DataFrame(recorder.summary(perf.QUERY), columns=cols + ["avg_rows"])
+        st.dataframe(queries)
+        if not queries.empty:
+            sql = st.selectbox("Latency histogram for", queries["name"].tolist())
+            st.bar_chart(pd.DataFrame({"statements": recorder.histogram(perf.QUERY, sql)}, index=perf.bucket_labels()), sort=False)
+        st.markdown("**Slow query log (latest)**")
+        tail = recorder.slow_log_tail()
+        st.code("".join(tail) if tail else "(empty)")
+        if st.button("Reset measurements"):
+            recorder.reset()
+            st.rerun()
+
+recorder.record(perf.PAGE, view, time.perf_counter() - view_started)
 
 # Logout option
 if st.sidebar.button("Logout"):
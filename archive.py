@@ -0,0 +1,156 @@
+# archive.py
+# Hot/cold split. Loans that were paid off or rejected more than ARCHIVE_AFTER_DAYS
+# ago move, with their payments, installments and accrual rows, into
+# loans_archive.db, which is attached to every connection as schema "archive".
+# The live tables then only hold what pages and jobs actually work on; History
+# and the Dashboard read the archive (a UNION over both) only when asked to.
+#
+# The job walks the loans table in id order and moves BATCH_SIZE loans per write
+# transaction, giving the write slot back between batches, so pages keep writing
+# while it runs. Each batch re-checks its loans inside the transaction. In WAL mode
+# a commit spanning two files is not atomic across them; rows are copied with
+# INSERT OR REPLACE, so a batch interrupted half-way is simply redone next run.
+# loans uses AUTOINCREMENT, so ids of archived loans are never handed out again.
+#   python archive.py [DB_FILE] [--days 90] [--archive loans_archive.db]
+import argparse
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+import db
+
+SCHEMA = "archive"
+ARCHIVE_FILE = "loans_archive.db"
+ARCHIVE_AFTER_DAYS = 90
+BATCH_SIZE = 500
+PAUSE_S = 0.01   # between batches, so queued page writes get the write slot
+
+# moved tables -> the column that ties their rows to a loan
+TABLES = {"loans": "id", "payments": "loan_id", "installments": "loan_id", "accruals": "loan_id"}
+INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_archive_loans_user_created ON loans (user_id, created_at)",
+    f"CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_archive_payments_loan_paid ON payments (loan_id, paid_at)",
+    f"CREATE UNIQUE INDEX IF NOT EXISTS {SCHEMA}.idx_archive_installments_loan_no ON installments (loan_id, inst_no)",
+]
+
+# closed = paid off (dated by its last payment) or rejected (dated by application,
+# there is no decision date), before the cutoff. Two positional cutoff parameters.
+CLOSED = """((loans.status = 'rejected' AND loans.created_at < ?)
+             OR (loans.payment_status = 'Paid'
+                 AND COALESCE((SELECT MAX(paid_at) FROM payments WHERE payments.loan_id = loans.id),
+                              loans.approved_at, loans.created_at) < ?))"""
+CANDIDATES = f"SELECT id FROM loans WHERE id > ? AND {CLOSED} ORDER BY id LIMIT ?"
+# archived loans keep counting in the Analytics status summary: put back what
+# the rollup delete trigger is about to take off (rollups.rebuild counts them
+# again from the archive)
+KEEP_STATUS_ROLLUP = """INSERT INTO rollup_status (status, loan_count, amount)
+                        SELECT COALESCE(status, ''), COUNT(*), COALESCE(SUM(amount), 0) FROM loans
+                        WHERE {where} GROUP BY 1 HAVING 1
+                        ON CONFLICT(status) DO UPDATE SET loan_count = loan_count + excluded.loan_count,
+                                                          amount = amount + excluded.amount"""
+
+def archive_path(db_path, name=ARCHIVE_FILE):
+    # next to the live database
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), name)
+
+def _columns(cur, schema, table):
+    return [r[1] for r in cur.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def ensure_schema(cur):
+    # call inside Database.write, once attached. Archive tables copy the live
+    # definitions; columns added to the live tables since are appended, in the
+    # same order, so SELECT * lines up across the UNION.
+    for table in TABLES:
+        row = cur.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        cur.execute(re.sub(r"^CREATE TABLE \"?\w+\"?", f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{table}", row[0]))
+        have = set(_columns(cur, SCHEMA, table))
+        for cid, name, coltype, notnull, default, pk in cur.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if name not in have:
+                cur.execute(f"ALTER TABLE {SCHEMA}.{table} ADD COLUMN {name} {coltype}"
+                            + (f" DEFAULT {default}" if default is not None else ""))
+    for stmt in INDEXES:
+        cur.execute(stmt)
+
+def attach(database, path=None):
+    # attach (creating it on first use) the archive to the writer and future readers
+    database.attach(SCHEMA, path or archive_path(database.path))
+    database.write(ensure_schema)
+
+def move_batch(cur, ids, cutoff):
+    # Call inside Database.write. Moves the loans among ids that are still closed;
+    # returns {table: rows moved}.
+    marks = ",".join("?" * len(ids))
+    ids = [r[0] for r in cur.execute(f"SELECT id FROM loans WHERE id IN ({marks}) AND {CLOSED}",
+                                     (*ids, cutoff, cutoff))]
+    moved = {table: 0 for table in TABLES}
+    if not ids:
+        return moved
+    marks = ",".join("?" * len(ids))
+    cur.execute(KEEP_STATUS_ROLLUP.format(where=f"id IN ({marks})"), ids)
+    # children first, the loan rows (whose delete fires the rollup / search triggers) last
+    for table, key in reversed(TABLES.items()):
+        cols = ", ".join(_columns(cur, "main", table))
+        cur.execute(f"INSERT OR REPLACE INTO {SCHEMA}.{table} ({cols}) SELECT {cols} FROM main.{table} "
+                    f"WHERE {key} IN ({marks})", ids)
+        cur.execute(f"DELETE FROM main.{table} WHERE {key} IN ({marks})", ids)
+        moved[table] = cur.rowcount
+    return moved
+
+def run(database, days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, progress=None):
+    # the archive must be attached first (see attach); returns {table: rows moved}
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    reader = database.reader()
+    totals = {table: 0 for table in TABLES}
+    last_id = 0
+    try:
+        while True:
+            # candidates are found on a read connection; only the move holds the write slot
+            ids = [r[0] for r in reader.execute(CANDIDATES, (last_id, cutoff, cutoff, batch_size))]
+            if not ids:
+                break
+            last_id = ids[-1]
+            for table, n in database.write(move_batch, ids, cutoff).items():
+                totals[table] += n
+            if progress:
+                progress(totals)
+            time.sleep(PAUSE_S)
+    finally:
+        reader.close()
+    # every moved loan logged a delete for the analytics replica
+    database.write(db.trim_replica_changes)
+    return totals
+
+# -----------------------
+# Read path: live + archived
+# -----------------------
+# Same shapes as db.USER_LOAN_STATS / USER_LOANS / LOAN_INSTALLMENTS; every id is
+# passed twice, once per side of the UNION.
+USER_LOAN_STATS = (f"SELECT COUNT(*) as total, SUM(amount) as total_amount FROM "
+                   f"(SELECT amount FROM loans WHERE user_id=? UNION ALL SELECT amount FROM {SCHEMA}.loans WHERE user_id=?)")
+USER_LOANS = (f"SELECT * FROM (SELECT * FROM loans WHERE user_id=? UNION ALL SELECT * FROM {SCHEMA}.loans WHERE user_id=?) "
+              f"ORDER BY created_at DESC")
+LOAN_INSTALLMENTS = (f"SELECT inst_no, due_date, amount, principal, interest, paid, paid_at FROM installments WHERE loan_id=? "
+                     f"UNION ALL SELECT inst_no, due_date, amount, principal, interest, paid, paid_at "
+                     f"FROM {SCHEMA}.installments WHERE loan_id=? ORDER BY inst_no")
+
+def counts(conn):
+    # rows per table, live and archived
+    return {table: (conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0],
+                    conn.execute(f"SELECT COUNT(*) FROM {SCHEMA}.{table}").fetchone()[0]) for table in TABLES}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move long-closed loans into the archive database")
+    parser.add_argument("db_file", nargs="?", default="loans_pro.db")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="closed for more than this many days")
+    parser.add_argument("--archive", default=None, help=f"archive file (default {ARCHIVE_FILE} next to DB_FILE)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    database = db.Database(args.db_file)
+    attach(database, args.archive)
+    t0 = time.perf_counter()
+    moved = run(database, args.days, args.batch,
+                progress=lambda t: print(f"  {t['loans']:,} loans moved", end="\r", flush=True))
+    print(f"moved {moved} in {time.perf_counter() - t0:.1f}s")
+    for table, (live, archived) in counts(database.reader()).items():
+        print(f"{table:>14}: {live:,} live, {archived:,} archived")
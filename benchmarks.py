@@ -0,0 +1,491 @@
+# benchmarks.py
+# Headless benchmarks - no browser or Streamlit server needed.
+#   python benchmarks.py loadtest [--sessions 50] [--ops 200]
+#   python benchmarks.py pdfs [--loans 400] [--workers 1 4 8]
+#   python benchmarks.py rerun [--runs 20]
+#   python benchmarks.py suite [--scales 10000 100000] [--out bench_results.json]
+#   python benchmarks.py compare OLD.json NEW.json [--threshold 1.25]
+#   python benchmarks.py archive [--loans 200000] [--days 90]
+#   python benchmarks.py replica [--loans 200000]   (needs duckdb)
+#   python benchmarks.py api [--loans 2000] [--clients 8]   (needs starlette, uvicorn)
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, date
+
+import accruals
+import amortization
+import archive
+import db
+import exports
+import ledger
+import pdfs
+import replica
+import rollups
+import search
+import seed
+from perf import percentile
+
+# -----------------------
+# Concurrent session load test
+# -----------------------
+LOAN_INSERT = """INSERT INTO loans (user_id, name, father_name, phone, cnic, address, amount, interest_rate,
+                 total_payable, status, due_date, created_at, payment_status, amount_paid, outstanding)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+def _loan_row(user_id):
+    amount = float(random.randrange(1000, 100000, 500))
+    return (user_id, f"user{user_id}", "father", f"03{user_id:09d}", "42101-1234567-1", "address",
+            amount, 0.1, round(amount * 1.01, 2), "approved",
+            (date.today() + timedelta(days=30)).isoformat(), datetime.utcnow().isoformat(), "Unpaid",
+            0.0, round(amount * 1.01, 2))
+
+def _session(database, user_id, ops, write_ratio, stats):
+    # mirrors one Streamlit session: Dashboard/History reads, Apply/Repay writes
+    reader = database.reader()
+    read_lat, write_lat, errors = [], [], 0
+    for _ in range(ops):
+        t0 = time.perf_counter()
+        try:
+            if random.random() < write_ratio:
+                if random.random() < 0.5:
+                    database.execute(LOAN_INSERT, _loan_row(user_id))
+                else:
+                    database.write(ledger.record_payment, random.randint(1, 1000), 500.0, "Mock - Easypaisa", "TXN-LOAD")
+                write_lat.append(time.perf_counter() - t0)
+            else:
+                reader.execute(db.USER_LOAN_STATS, (user_id,)).fetchall()
+                reader.execute(db.USER_LOANS, (user_id,)).fetchall()
+                read_lat.append(time.perf_counter() - t0)
+        except sqlite3.Error:
+            errors += 1
+    reader.close()
+    stats.append((read_lat, write_lat, errors))
+
+def loadtest(sessions=50, ops=200, write_ratio=0.2, seed_loans=20000):
+    path = os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    database = db.Database(path)
+    database.write(lambda cur: cur.executemany(LOAN_INSERT, [_loan_row(random.randint(1, sessions)) for _ in range(seed_loans)]))
+    stats = []
+    threads = [threading.Thread(target=_session, args=(database, i + 1, ops, write_ratio, stats)) for i in range(sessions)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    database.close()
+    reads = [x for s in stats for x in s[0]]
+    writes = [x for s in stats for x in s[1]]
+    return {
+        "sessions": sessions,
+        "elapsed_s": round(elapsed, 3),
+        "ops_per_s": round((len(reads) + len(writes)) / elapsed, 1),
+        "reads": len(reads),
+        "writes": len(writes),
+        "errors": sum(s[2] for s in stats),
+        "read_p50_ms": round(percentile(reads, 50) * 1000, 2),
+        "read_p95_ms": round(percentile(reads, 95) * 1000, 2),
+        "write_p50_ms": round(percentile(writes, 50) * 1000, 2),
+        "write_p95_ms": round(percentile(writes, 95) * 1000, 2),
+    }
+
+# -----------------------
+# Batch PDF throughput
+# -----------------------
+def pdf_throughput(loans=400, workers=(1, 4, 8)):
+    # cold cache per worker count, then one warm pass to show cache hits cost
+    docs = []
+    for i in range(1, loans + 1):
+        rec = dict(zip(["id", "name", "father_name", "cnic", "amount", "total_payable", "due_date", "amount_paid", "outstanding"],
+                       [i, f"Borrower {i}", "Father", "42101-1234567-1", 10000.0, 10082.19, "2026-12-31", 5000.0, 5082.19]))
+        docs.append((pdfs.AGREEMENT, pdfs.agreement_fields(rec), f"agreement_loan_{i}.pdf"))
+        docs.append((pdfs.RECEIPT, pdfs.receipt_fields(rec, [(5000.0, "Mock - Easypaisa", "2026-10-01T10:00:00", "TXN-1")]),
+                     f"receipt_loan_{i}.pdf"))
+    results = {}
+    for w in workers:
+        folder = tempfile.mkdtemp()
+        t0 = time.perf_counter()
+        with open(os.path.join(folder, "out.zip"), "wb") as f:
+            n = pdfs.write_zip(docs, f, workers=w, folder=os.path.join(folder, "cache"))
+        results[f"cold_{w}_workers_pdf_per_s"] = round(n / (time.perf_counter() - t0), 1)
+    t0 = time.perf_counter()
+    with open(os.path.join(folder, "warm.zip"), "wb") as f:
+        n = pdfs.write_zip(docs, f, workers=workers[-1], folder=os.path.join(folder, "cache"))
+    results["warm_cache_pdf_per_s"] = round(n / (time.perf_counter() - t0), 1)
+    return results
+
+# -----------------------
+# Streamlit rerun cost
+# -----------------------
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+HEAVY_MODULES = ("pandas", "matplotlib", "numpy", "fpdf", "PIL", "requests")
+ADMIN_SESSION = {"id": 1, "name": "Admin", "phone": "0000000000", "email": "admin@example.com", "is_admin": 1}
+
+def _seed_app_db(folder, loans=2000):
+    # the app opens loans_pro.db in its working directory
+    database = db.Database(os.path.join(folder, "loans_pro.db"))
+    database.write(lambda cur: cur.executemany(LOAN_INSERT, [_loan_row(1) for _ in range(loans)]))
+    database.execute("UPDATE loans SET status='pending' WHERE id % 3 = 0")
+    database.close()
+
+def cold_start():
+    # run in a fresh interpreter (see rerun): the first script run pays for bootstrap
+    # and every import the Home page triggers
+    t0 = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    import_s = time.perf_counter() - t0
+    before = set(sys.modules)
+    t0 = time.perf_counter()
+    at = AppTest.from_file(APP_FILE, default_timeout=120).run()
+    first_run = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    at.run()
+    second_run = time.perf_counter() - t0
+    return {
+        "streamlit_import_ms": round(import_s * 1000, 1),
+        "first_run_ms": round(first_run * 1000, 1),
+        "second_run_ms": round(second_run * 1000, 1),
+        "heavy_loaded_by_home": ",".join(m for m in HEAVY_MODULES if m in sys.modules and m not in before) or "-",
+    }
+
+def _timed_reruns(at, runs):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - t0)
+        if at.exception:
+            raise RuntimeError(at.exception)
+    return times
+
+def rerun_latency(runs=20, loans=2000):
+    from streamlit.testing.v1 import AppTest
+    folder = tempfile.mkdtemp()
+    _seed_app_db(folder, loans)
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "cold-start"], cwd=folder,
+                         capture_output=True, text=True, check=True)
+    results = {f"cold_{k}": v for k, v in json.loads(out.stdout).items()}
+    os.chdir(folder)
+    at = AppTest.from_file(APP_FILE, default_timeout=120).run()
+    at.session_state["user"] = ADMIN_SESSION
+    at.run()
+    views = []
+    for page in at.sidebar.selectbox[0].options:
+        at.sidebar.selectbox[0].select(page).run()
+        if page == "Admin":
+            for action in at.sidebar.selectbox[1].options:
+                at.sidebar.selectbox[1].select(action).run()
+                views.append((f"Admin/{action}", _timed_reruns(at, runs)))
+        else:
+            views.append((page, _timed_reruns(at, runs)))
+    for name, times in views:
+        results[f"{name} p50/p95_ms"] = f"{percentile(times, 50) * 1000:.1f} / {percentile(times, 95) * 1000:.1f}"
+    return results
+
+# -----------------------
+# Benchmark suite
+# -----------------------
+# Seeds a synthetic portfolio at each scale and times the page queries, the
+# interest / schedule helpers, agreement PDFs and the exports. Results are saved
+# as JSON; compare two runs with "compare".
+
+def suite_queries():
+    # db.PAGE_QUERIES with dates that hit real rows in a seeded portfolio; user 1 is the heaviest borrower
+    today = date.today()
+    queries = dict(db.PAGE_QUERIES)
+    queries.update({
+        "Admin Analytics daily": (rollups.DAILY, ((today - timedelta(days=90)).isoformat(),)),
+        "Admin Analytics totals": (rollups.TOTALS, ()),
+        "Admin Analytics aging": (rollups.AGING, (today.isoformat(),)),
+        "Admin Analytics accruals": (db.ACCRUAL_SUMMARY, ()),
+        "Admin Reminders": (db.DUE_LOANS, ((today + timedelta(days=7)).isoformat(),)),
+        "Admin Reminders installments": (db.DUE_INSTALLMENTS, (today.isoformat(), (today + timedelta(days=7)).isoformat())),
+        # a common first name: the most matches a search has to rank
+        "Admin Borrower Search (common name)": search.search_query("Ali"),
+    })
+    return queries
+
+def _time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return times, result
+
+def _stats(times, **extra):
+    return dict(p50_ms=round(percentile(times, 50) * 1000, 3), p95_ms=round(percentile(times, 95) * 1000, 3),
+                runs=len(times), **extra)
+
+def bench_scale(loans, repeat=5, uploads=20):
+    import pandas as pd
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "bench.db")
+    database = db.Database(path)
+    t0 = time.perf_counter()
+    counts = seed.generate(database, loans, uploads, upload_folder=os.path.join(folder, "uploads"))
+    result = {"seed_s": round(time.perf_counter() - t0, 2), "rows": counts,
+              "db_mb": round(os.path.getsize(path) / 1e6, 1), "queries": {}, "functions": {}, "exports": {}}
+    conn = database.reader()
+    for name, (sql, params) in suite_queries().items():
+        # what df_from_query does on a cache miss
+        times, df = _time(lambda: pd.read_sql_query(sql, conn, params=params), repeat)
+        result["queries"][name] = _stats(times, rows=len(df))
+
+    calls = 10000
+    times, _ = _time(lambda: [amortization.calculate_total_simple(25000.0, 0.1, 90) for _ in range(calls)], repeat)
+    result["functions"]["calculate_total_simple"] = _stats([t / calls for t in times])
+    calls = 200
+    times, _ = _time(lambda: [amortization.create_installment_schedule(25000.0, 0.1, 180, 6) for _ in range(calls)], repeat)
+    result["functions"]["create_installment_schedule"] = _stats([t / calls for t in times])
+    loan = pd.read_sql_query(db.LOAN_BY_ID, conn, params=(1,)).iloc[0].to_dict()
+    times, _ = _time(lambda: pdfs.generate_pdf_agreement(loan), repeat)
+    result["functions"]["generate_pdf_agreement"] = _stats(times)
+
+    # the same streaming exports the pages offer, plus the full portfolio in every format
+    target = (date.today() + timedelta(days=7)).isoformat()
+    export_runs = [("Dashboard CSV", db.USER_LOANS, (1,), "csv"), ("History Excel", db.USER_LOANS, (1,), "xlsx"),
+                   ("Reminders CSV", db.DUE_LOANS, (target,), "csv")]
+    export_runs += [(f"Portfolio {fmt}", *exports.portfolio_query(), fmt) for fmt in exports.available_formats()]
+    for name, sql, params, fmt in export_runs:
+        runs = 1 if name.startswith("Portfolio") else repeat
+        times, (f, rows) = _time(lambda: exports.export(conn, sql, params, fmt), runs)
+        result["exports"][name] = _stats(times, rows=rows, kb=os.fstat(f.fileno()).st_size // 1024)
+        f.close()
+    conn.close()
+
+    # last: it changes balances. One nightly accrual run over every open loan.
+    result["jobs"] = {}
+    times, days = _time(lambda: accruals.run(database, date.today()), 1)
+    result["jobs"]["Nightly accrual (1 day)"] = _stats(times, rows=days[0]["loans"] if days else 0)
+    database.close()
+    return result
+
+def run_suite(scales=(10000,), repeat=5, uploads=20):
+    results = {"meta": {"created_at": datetime.utcnow().isoformat(), "python": platform.python_version(),
+                        "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "repeat": repeat},
+               "scales": {}}
+    for loans in scales:
+        print(f"scale {loans:,} loans ...", flush=True)
+        results["scales"][str(loans)] = bench_scale(loans, repeat, uploads)
+    return results
+
+def _flatten_results(results):
+    # {(scale, section, name): p50_ms}
+    return {(scale, section, name): entry["p50_ms"]
+            for scale, data in results["scales"].items()
+            for section in ("queries", "functions", "exports", "jobs")
+            for name, entry in data.get(section, {}).items()}
+
+def compare(old, new, threshold=1.25):
+    # entries whose p50 got slower by more than threshold x; tiny timings are noise
+    before, after = _flatten_results(old), _flatten_results(new)
+    slower = []
+    for key, ms in sorted(after.items()):
+        prev = before.get(key)
+        if prev is not None and ms > prev * threshold and ms - prev > 0.05:
+            slower.append((key, prev, ms))
+    return slower
+
+# -----------------------
+# Hot/cold archival
+# -----------------------
+def bench_archive(loans=200000, days=archive.ARCHIVE_AFTER_DAYS, repeat=5):
+    # page-query latency on the live tables before and after moving closed loans out
+    import pandas as pd
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "bench.db")
+    database = db.Database(path)
+    seed.generate(database, loans, 0, upload_folder=os.path.join(folder, "uploads"))
+    archive.attach(database)
+
+    def time_queries():
+        conn = database.reader()
+        timings = {name: _time(lambda: pd.read_sql_query(sql, conn, params=params), repeat)[0]
+                   for name, (sql, params) in suite_queries().items()}
+        timings["History with archive (UNION)"] = _time(
+            lambda: pd.read_sql_query(archive.USER_LOANS, conn, params=(1, 1)), repeat)[0]
+        conn.close()
+        return timings
+
+    before = time_queries()
+    t0 = time.perf_counter()
+    moved = archive.run(database, days)
+    result = {"archive_s": round(time.perf_counter() - t0, 1), "loans_moved": moved["loans"],
+              "payments_moved": moved["payments"]}
+    after = time_queries()
+    for name in before:
+        result[f"{name} p50_ms"] = f"{percentile(before[name], 50) * 1000:.2f} -> {percentile(after[name], 50) * 1000:.2f}"
+    result["live (not vacuumed) / archive MB"] = (f"{os.path.getsize(path) / 1e6:.0f} / "
+                                   f"{os.path.getsize(archive.archive_path(path)) / 1e6:.0f}")
+    database.close()
+    return result
+
+# -----------------------
+# DuckDB analytics replica
+# -----------------------
+def bench_replica(loans=200000, repeat=5, writes=1000):
+    # refresh cost (first copy, then after a burst of writes) and report / export
+    # latency on SQLite vs the replica
+    import pandas as pd
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "bench.db")
+    database = db.Database(path)
+    seed.generate(database, loans, 0, upload_folder=os.path.join(folder, "uploads"))
+    analytics = replica.Replica(replica.replica_path(path))
+    result = {"first_refresh_s": analytics.refresh(database)["seconds"]}
+    database.write(lambda cur: cur.executemany(LOAN_INSERT, [_loan_row(random.randint(1, 1000)) for _ in range(writes)]))
+    for loan_id in random.sample(range(1, loans + 1), writes):
+        database.write(ledger.record_payment, loan_id, 500.0, "Mock - Easypaisa", "TXN-BENCH")
+    stats = analytics.refresh(database)
+    result[f"refresh after {writes} loans + {writes} payments_s"] = stats["seconds"]
+
+    conn = database.reader()
+    schema = archive.SCHEMA if archive.SCHEMA in database.attached else None
+    for name, (sqlite_sql, duckdb_sql, params) in replica.report_params(archive_schema=schema).items():
+        on_sqlite = _time(lambda: pd.read_sql_query(sqlite_sql, conn, params=params), repeat)[0]
+        on_duckdb = _time(lambda: analytics.query(duckdb_sql, params), repeat)[0]
+        result[f"{name} sqlite -> duckdb p50_ms"] = (f"{percentile(on_sqlite, 50) * 1000:.1f} -> "
+                                                     f"{percentile(on_duckdb, 50) * 1000:.1f}")
+    for fmt in exports.available_formats():
+        sqlite_sql, params = exports.portfolio_query()
+        duckdb_sql, _ = exports.portfolio_query(engine="duckdb")
+        on_sqlite = _time(lambda: exports.export(conn, sqlite_sql, params, fmt)[0].close(), 1)[0]
+        on_duckdb = _time(lambda: exports.export(analytics.cursor(), duckdb_sql, params, fmt)[0].close(), 1)[0]
+        result[f"Portfolio {fmt} sqlite -> duckdb_s"] = f"{on_sqlite[0]:.2f} -> {on_duckdb[0]:.2f}"
+    conn.close()
+    result["sqlite / replica MB"] = f"{os.path.getsize(path) / 1e6:.0f} / {os.path.getsize(analytics.path) / 1e6:.0f}"
+    analytics.close()
+    database.close()
+    return result
+
+def bench_api(loans=2000, clients=8):
+    # the HTTP API on a local uvicorn: one request per loan / payment from
+    # `clients` concurrent callers vs the batch endpoints
+    import socket
+    import requests
+    import uvicorn
+    from concurrent.futures import ThreadPoolExecutor
+    import api
+    folder = tempfile.mkdtemp()
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(api.create_app(os.path.join(folder, "bench.db"), api_key=""),
+                                           port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{port}"
+    http = requests.Session()
+    http.mount(base, requests.adapters.HTTPAdapter(pool_maxsize=clients))
+    for i in range(clients):
+        http.post(f"{base}/users", json={"name": f"Client {i}", "phone": f"0300{i:07d}", "password": "x"}).raise_for_status()
+
+    def application(i):
+        return {"user_id": i % clients + 1, "name": f"Borrower {i}", "phone": f"0300{i % clients:07d}",
+                "cnic": f"{i:013d}", "amount": 5000 + i, "duration_days": 90, "interest_rate": 0.2,
+                "installments": i % 4, "interest_model": amortization.REDUCING if i % 2 else amortization.FLAT}
+
+    def timed_parallel(fn, items):
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            codes = list(pool.map(fn, items))
+        assert set(codes) == {201}, set(codes)
+        return time.perf_counter() - t0
+
+    result = {}
+    one_by_one = timed_parallel(lambda i: http.post(f"{base}/loans", json=application(i)).status_code, range(loans))
+    t0 = time.perf_counter()
+    body = http.post(f"{base}/loans/batch", json=[application(i) for i in range(loans, 2 * loans)]).json()
+    batched = time.perf_counter() - t0
+    assert len(body["submitted"]) == loans, body["rejected"][:3]
+    result[f"{loans} loans: {clients} clients -> one batch_s"] = f"{one_by_one:.2f} -> {batched:.2f}"
+    with ThreadPoolExecutor(clients) as pool:   # only approved loans take payments
+        list(pool.map(lambda i: http.post(f"{base}/loans/{i + 1}/approve").raise_for_status(), range(2 * loans)))
+    one_by_one = timed_parallel(lambda i: http.post(f"{base}/payments", json={"loan_id": i + 1, "amount": 100}).status_code,
+                                range(loans))
+    settlement = "loan_id,amount,receipt\n" + "".join(f"{i},100,SETTLE-{i}\n" for i in range(loans + 1, 2 * loans + 1))
+    t0 = time.perf_counter()
+    body = http.post(f"{base}/payments/batch", data=settlement, headers={"Content-Type": "text/csv"}).json()
+    batched = time.perf_counter() - t0
+    assert body["posted"] == loans, body["skipped"][:3]
+    result[f"{loans} payments: {clients} clients -> settlement file_s"] = f"{one_by_one:.2f} -> {batched:.2f}"
+    server.should_exit = True
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Udhar headless benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("loadtest", help="concurrent simulated sessions against one Database")
+    p.add_argument("--sessions", type=int, default=50)
+    p.add_argument("--ops", type=int, default=200)
+    p.add_argument("--write-ratio", type=float, default=0.2)
+    p = sub.add_parser("pdfs", help="agreements + receipts per second at several pool sizes")
+    p.add_argument("--loans", type=int, default=400)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    p = sub.add_parser("rerun", help="cold start, then warm rerun latency of every page")
+    p.add_argument("--runs", type=int, default=20)
+    p.add_argument("--loans", type=int, default=2000)
+    sub.add_parser("cold-start", help=argparse.SUPPRESS)
+    p = sub.add_parser("suite", help="seed synthetic portfolios and time queries, helpers, PDFs and exports")
+    p.add_argument("--scales", type=int, nargs="+", default=[10000], help="loans per run, e.g. 10000 100000 1000000 5000000")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--uploads", type=int, default=20)
+    p.add_argument("--out", default="bench_results.json")
+    p = sub.add_parser("compare", help="list timings that regressed between two suite runs")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=1.25)
+    p = sub.add_parser("archive", help="page-query latency before and after archiving closed loans")
+    p.add_argument("--loans", type=int, default=200000)
+    p.add_argument("--days", type=int, default=archive.ARCHIVE_AFTER_DAYS)
+    p.add_argument("--repeat", type=int, default=5)
+    p = sub.add_parser("replica", help="DuckDB replica refresh cost and report / export speed vs SQLite")
+    p.add_argument("--loans", type=int, default=200000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--writes", type=int, default=1000)
+    p = sub.add_parser("api", help="HTTP API: single-item requests from concurrent clients vs the batch endpoints")
+    p.add_argument("--loans", type=int, default=2000)
+    p.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+    if args.cmd == "cold-start":
+        print(json.dumps(cold_start()))
+        sys.exit(0)
+    if args.cmd == "loadtest":
+        result = loadtest(args.sessions, args.ops, args.write_ratio)
+    elif args.cmd == "pdfs":
+        result = pdf_throughput(args.loans, tuple(args.workers))
+    elif args.cmd == "rerun":
+        result = rerun_latency(args.runs, args.loans)
+    elif args.cmd == "suite":
+        data = run_suite(tuple(args.scales), args.repeat, args.uploads)
+        with open(args.out, "w") as f:
+            json.dump(data, f, indent=2)
+        result = {f"{scale} {section} / {name}": f"{ms} ms" for (scale, section, name), ms in _flatten_results(data).items()}
+        result["saved"] = args.out
+    elif args.cmd == "archive":
+        result = bench_archive(args.loans, args.days, args.repeat)
+    elif args.cmd == "api":
+        result = bench_api(args.loans, args.clients)
+    elif args.cmd == "replica":
+        result = bench_replica(args.loans, args.repeat, args.writes)
+    elif args.cmd == "compare":
+        with open(args.old) as f_old, open(args.new) as f_new:
+            slower = compare(json.load(f_old), json.load(f_new), args.threshold)
+        for (scale, section, name), before, after in slower:
+            print(f"{scale} {section} / {name}: {before} -> {after} ms")
+        print(f"{len(slower)} regression(s) over {args.threshold}x")
+        sys.exit(1 if slower else 0)
+    for k, v in result.items():
+        print(f"{k:>36}: {v}")
@@ -0,0 +1,667 @@
+# db.py
+import ast
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import rollups
+import search
+
+# -----------------------
+# Schema migrations
+# -----------------------
+# Migrations run once each, in order. The number of the last applied one is kept
+# in PRAGMA user_version, so a fresh database and an old one converge on the same
+# schema. Only ever append to MIGRATIONS - never edit or reorder shipped entries.
+
+def add_column(cur, table, column, coltype):
+    # ALTER TABLE has no IF NOT EXISTS for columns, so look first
+    cols = [r[1] for r in cur.execute(f"PRAGMA table_info({table})")]
+    if column not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {coltype}")
+
+def _m001_base_tables(cur):
+    # IF NOT EXISTS so databases created before versioning are adopted as-is
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        phone TEXT UNIQUE,
+        email TEXT UNIQUE,
+        password_hash TEXT,
+        is_admin INTEGER DEFAULT 0,
+        created_at TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS loans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        name TEXT,
+        father_name TEXT,
+        phone TEXT,
+        cnic TEXT,
+        address TEXT,
+        user_image_path TEXT,
+        cnic_image_path TEXT,
+        amount REAL,
+        interest_rate REAL,
+        total_payable REAL,
+        status TEXT,            -- pending/approved/rejected/paid
+        due_date TEXT,
+        created_at TEXT,
+        payment_status TEXT,    -- Unpaid / Partially Paid / Paid
+        receipt_no TEXT,
+        installment_plan TEXT   -- JSON string or text describing installments
+    )
+    """)
+    # used to be created lazily by the Repay page
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        loan_id INTEGER,
+        amount REAL,
+        payment_method TEXT,
+        paid_at TEXT,
+        receipt TEXT
+    )
+    """)
+
+def _m002_query_indexes(cur):
+    # one index per query shape; every index implicitly ends with the rowid (id),
+    # so (created_at) also orders ties by id
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_loans_user_created ON loans (user_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_loans_status_created ON loans (status, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_loans_status_payment_due ON loans (status, payment_status, due_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_loans_created ON loans (created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_is_admin ON users (is_admin)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_loan_paid ON payments (loan_id, paid_at)")
+
+def _m003_loan_balances(cur):
+    # running totals maintained by ledger.record_payment; backfilled from the ledger
+    add_column(cur, "loans", "amount_paid", "REAL DEFAULT 0")
+    add_column(cur, "loans", "outstanding", "REAL")
+    cur.execute("UPDATE loans SET amount_paid = COALESCE((SELECT SUM(amount) FROM payments WHERE payments.loan_id=loans.id), 0)")
+    cur.execute("""UPDATE loans SET outstanding = CASE WHEN payment_status='Paid' THEN 0
+                   ELSE MAX(COALESCE(total_payable, 0) - amount_paid, 0) END""")
+
+def _m004_installments(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS installments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        loan_id INTEGER,
+        inst_no INTEGER,
+        due_date TEXT,
+        amount REAL,
+        principal REAL,
+        interest REAL,
+        paid INTEGER DEFAULT 0,
+        paid_at TEXT
+    )
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_installments_loan_no ON installments (loan_id, inst_no)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_installments_due_paid ON installments (due_date, paid)")
+    # move schedules stored as str(list_of_dicts) into rows; literal_eval only parses literals
+    rows = []
+    for loan_id, plan in cur.execute("SELECT id, installment_plan FROM loans WHERE installment_plan LIKE '[%'").fetchall():
+        try:
+            schedule = ast.literal_eval(plan)
+        except (ValueError, SyntaxError):
+            continue
+        for inst in schedule:
+            rows.append((loan_id, inst["inst_no"], inst["due_date"], inst["amount"], None, None, int(bool(inst.get("paid")))))
+    cur.executemany("INSERT OR IGNORE INTO installments (loan_id, inst_no, due_date, amount, principal, interest, paid) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+def _m005_outbox(cur):
+    # notification outbox drained by notify.Dispatcher
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT,           -- email / sms
+        recipient TEXT,
+        subject TEXT,
+        body TEXT,
+        dedupe_key TEXT UNIQUE, -- channel:kind:loan_id:day for reminders, NULL otherwise
+        status TEXT,            -- pending / sending / sent / failed / skipped
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at TEXT,
+        last_error TEXT,
+        created_at TEXT,
+        sent_at TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_channel_next ON outbox (status, channel, next_attempt_at)")
+
+def _m006_rollups(cur):
+    # approved_at dates disbursements; loans approved before this have none and
+    # fall back to created_at in the rebuild
+    add_column(cur, "loans", "approved_at", "TEXT")
+    for stmt in rollups.TABLES + rollups.TRIGGERS:
+        cur.execute(stmt)
+    rollups.rebuild(cur)
+
+def _m007_accruals(cur):
+    # written by accruals.run: one row per open loan per day, plus one per day processed
+    add_column(cur, "loans", "penalty_accrued", "REAL DEFAULT 0")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS accruals (
+        loan_id INTEGER,
+        day TEXT,
+        interest REAL,
+        penalty REAL,
+        PRIMARY KEY (loan_id, day)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_accruals_day ON accruals (day)")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS accrual_runs (
+        day TEXT PRIMARY KEY,
+        loans INTEGER,
+        interest REAL,
+        penalty REAL,
+        finished_at TEXT
+    )
+    """)
+
+def _m008_borrower_search(cur):
+    for stmt in search.TABLES + search.TRIGGERS:
+        cur.execute(stmt)
+    search.rebuild(cur)
+
+def _m009_payment_receipts(cur):
+    # settlement files are matched against the ledger by receipt, see ledger.record_payments
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_receipt ON payments (receipt)")
+
+def _m010_replica_change_log(cur):
+    # ids of loans / users rows changed in place, for the analytics replica's
+    # incremental refresh (replica.py); kept short by trim_replica_changes
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS replica_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT,
+        row_id INTEGER
+    )
+    """)
+    for table, row, event in (("loans", "NEW", "UPDATE"), ("loans", "OLD", "DELETE"), ("users", "NEW", "UPDATE")):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_replica_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+            INSERT INTO replica_changes (tbl, row_id) VALUES ('{table}', {row}.id);
+        END""")
+
+def _m011_flat_schedule_rounding(cur):
+    # flat schedules rounded every installment to the paisa, so they could add up to a
+    # few paisa more than the loan and a settled loan kept its last installment open;
+    # the last installment now takes the difference (amortization.flat_schedules)
+    rows = cur.execute("""SELECT i.loan_id, MAX(i.inst_no), COUNT(*),
+                                 ROUND(l.total_payable - COALESCE(l.penalty_accrued, 0) - SUM(i.amount), 2),
+                                 ROUND(l.amount - SUM(i.principal), 2)
+                          FROM installments i JOIN loans l ON l.id = i.loan_id
+                          GROUP BY i.loan_id""").fetchall()
+    fixes = []
+    for loan_id, last, count, diff, principal_diff in rows:
+        # only rounding-sized differences; anything bigger was edited on purpose
+        diff, principal_diff = [d if d is not None and abs(d) <= 0.005 * count + 1e-9 else 0
+                                for d in (diff, principal_diff)]
+        if diff or principal_diff:
+            fixes.append({"d": diff, "p": principal_diff, "loan_id": loan_id, "inst_no": last})
+    # every SET sees the old values, as in ledger.APPLY_PAYMENT
+    cur.executemany("""UPDATE installments SET amount = ROUND(amount + :d, 2), principal = ROUND(principal + :p, 2),
+                                               interest = ROUND(amount + :d - principal - :p, 2)
+                       WHERE loan_id=:loan_id AND inst_no=:inst_no""", fixes)
+    cur.execute("""UPDATE installments SET paid=1,
+                       paid_at=(SELECT MAX(paid_at) FROM payments WHERE payments.loan_id=installments.loan_id)
+                   WHERE paid=0 AND loan_id IN (SELECT id FROM loans WHERE payment_status='Paid')""")
+
+REPLICA_CHANGES_MAX = 100000
+
+def trim_replica_changes(cur, keep=REPLICA_CHANGES_MAX):
+    # Call inside Database.write; the batch jobs do after a run. A refreshing replica
+    # trims what it has copied; without one (or one nobody opens) the log is capped
+    # here, and a replica that finds entries it never saw trimmed re-copies in full.
+    cur.execute("DELETE FROM replica_changes WHERE seq <= (SELECT MAX(seq) FROM replica_changes) - ?", (keep,))
+    return cur.rowcount
+
+MIGRATIONS = [
+    _m001_base_tables,
+    _m002_query_indexes,
+    _m003_loan_balances,
+    _m004_installments,
+    _m005_outbox,
+    _m006_rollups,
+    _m007_accruals,
+    _m008_borrower_search,
+    _m009_payment_receipts,
+    _m010_replica_change_log,
+    _m011_flat_schedule_rounding,
+]
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn) -> int:
+    current = schema_version(conn)
+    for version, step in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        # DDL and the version bump commit together, or not at all
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            step(cur)
+            cur.execute(f"PRAGMA user_version = {version}")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        current = version
+    return current
+
+# -----------------------
+# Connections
+# -----------------------
+# One Database per process (app.py keeps it in st.cache_resource). WAL lets any
+# number of readers run alongside the single writer, so each Streamlit session
+# gets its own read connection while every write goes through one connection
+# guarded by a lock: short BEGIN IMMEDIATE transactions, retried if another
+# process holds the file lock for longer than busy_timeout.
+
+BUSY_TIMEOUT_MS = 5000
+WRITE_RETRIES = 5
+
+def connect(path, read_only=False, observe=None, attach=None):
+    # isolation_level=None: no implicit BEGINs, transactions are always explicit.
+    # attach: {schema name: file} of extra databases (see archive.py)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, isolation_level=None,
+                           factory=_TimedConnection if observe else sqlite3.Connection)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # durable across app crashes; fsync only at checkpoints
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16000")   # ~16 MB page cache per connection
+    for name, attached_path in (attach or {}).items():
+        conn.execute(f"ATTACH DATABASE ? AS {name}", (attached_path,))
+    if read_only:
+        conn.execute("PRAGMA query_only=1")
+    if observe:
+        conn.observe = observe
+    return conn
+
+# -----------------------
+# Statement timing
+# -----------------------
+# With an observe(sql, seconds, rows) hook, every statement is timed: reads from
+# execute until the last row has been fetched (or the cursor is reused, closed or
+# dropped), writes per statement inside the transaction.
+
+class _TimedCursor:
+    def __init__(self, cur, observe):
+        self._cur = cur
+        self._observe = observe
+        self._open = None   # [sql, seconds so far, rows fetched]
+
+    def _finish(self):
+        if self._open:
+            sql, seconds, rows = self._open
+            self._open = None
+            self._observe(sql, seconds, rows)
+
+    def _run(self, sql, call, *args):
+        self._finish()
+        t0 = time.perf_counter()
+        call(sql, *args)
+        self._open = [sql, time.perf_counter() - t0, 0]
+        if self._cur.description is None:   # no result rows to wait for
+            self._open[2] = max(self._cur.rowcount, 0)
+            self._finish()
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(sql, self._cur.execute, params)
+
+    def executemany(self, sql, seq):
+        return self._run(sql, self._cur.executemany, seq)
+
+    def _fetch(self, call, *args):
+        t0 = time.perf_counter()
+        result = call(*args)
+        if self._open:
+            self._open[1] += time.perf_counter() - t0
+        return result
+
+    def fetchone(self):
+        row = self._fetch(self._cur.fetchone)
+        if self._open:
+            if row is None:
+                self._finish()
+            else:
+                self._open[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(self._cur.fetchmany, size or self._cur.arraysize)
+        if self._open:
+            self._open[2] += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cur.fetchall)
+        if self._open:
+            self._open[2] += len(rows)
+            self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        self._cur.close()
+
+    def __del__(self):
+        self._finish()
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+class _TimedConnection(sqlite3.Connection):
+    # a real sqlite3.Connection (pandas checks), whose cursors are timed
+    observe = None
+
+    def cursor(self, factory=sqlite3.Cursor):
+        cur = super().cursor(factory)
+        return _TimedCursor(cur, self.observe) if self.observe else cur
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+# -----------------------
+# Query cache
+# -----------------------
+# Read results are cached under (sql, params, versions of the tables the sql
+# reads). Every committed write bumps the version of the tables it touched, so
+# a changed table simply stops matching its old entries - nothing is ever served
+# stale, and untouched tables keep their hits. Writes made outside this process
+# (the API, batch jobs, CLIs) aren't seen table by table; the writer connection's
+# PRAGMA data_version, which changes only when another connection commits, is
+# part of the key, so any of them invalidates everything. The TTL just ages out
+# entries nobody reads.
+# Tables of an attached schema ("archive.loans") are versioned under the schema
+# name: any write to the archive invalidates every read of it.
+
+_READ_TABLES = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)", re.IGNORECASE)
+_WRITE_TABLE = re.compile(r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)",
+                          re.IGNORECASE)
+
+# tables that triggers write to whenever the key table is written
+DERIVED_TABLES = {
+    "loans": ("rollup_daily", "rollup_status", "rollup_due", "loan_search"),
+    "payments": ("rollup_daily",),
+    "users": ("loan_search",),
+}
+
+def tables_read(sql):
+    return sorted({t.lower() for t in _READ_TABLES.findall(sql)})
+
+def table_written(sql):
+    m = _WRITE_TABLE.match(sql)
+    return m.group(1).lower() if m else None
+
+class QueryCache:
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # load outside the lock so one slow query doesn't stall every session
+        value = load()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+class _WriteCursor:
+    # records which tables a write transaction touched (and times each statement)
+    def __init__(self, cur, touched, observe=None):
+        self._cur = cur
+        self._touched = touched
+        self._observe = observe
+
+    def _track(self, sql, call, *args):
+        table = table_written(sql)
+        if table:
+            self._touched.add(table)
+        if not self._observe:
+            return call(sql, *args)
+        t0 = time.perf_counter()
+        result = call(sql, *args)
+        self._observe(sql, time.perf_counter() - t0, max(self._cur.rowcount, 0))
+        return result
+
+    def execute(self, sql, params=()):
+        return self._track(sql, self._cur.execute, params)
+
+    def executemany(self, sql, seq):
+        return self._track(sql, self._cur.executemany, seq)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+class Database:
+    def __init__(self, path, cache_entries=256, cache_ttl=300, observe=None):
+        # observe(sql, seconds, rows) is called for every statement, see perf.Recorder.query
+        self.path = path
+        self.observe = observe
+        self._write_lock = threading.Lock()
+        self._writer = connect(path)
+        migrate(self._writer)
+        self.cache = QueryCache(cache_entries, cache_ttl)
+        self.versions = defaultdict(int)   # table -> bumped on every committed write
+        self.attached = {}                 # schema name -> file, on the writer and every new reader
+
+    def attach(self, name, path):
+        # readers opened before this call don't see the schema; attach before handing them out
+        with self._write_lock:
+            self._writer.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+            self._writer.execute(f"PRAGMA {name}.journal_mode=WAL")
+            self.attached[name] = path
+
+    def reader(self):
+        return connect(self.path, read_only=True, observe=self.observe, attach=self.attached)
+
+    def write(self, fn, *args):
+        # fn(cur, *args) runs inside one transaction; its return value is passed back.
+        # Keep fn short - it holds the only write slot.
+        with self._write_lock:
+            for attempt in range(WRITE_RETRIES):
+                cur = self._writer.cursor()
+                try:
+                    cur.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError as e:
+                    if "locked" not in str(e) and "busy" not in str(e):
+                        raise
+                    time.sleep(0.05 * 2 ** attempt)
+                    continue
+                touched = set()
+                try:
+                    result = fn(_WriteCursor(cur, touched, self.observe), *args)
+                    cur.execute("COMMIT")
+                    for table in touched:
+                        self.versions[table] += 1
+                        for derived in DERIVED_TABLES.get(table, ()):
+                            self.versions[derived] += 1
+                    return result
+                except Exception:
+                    cur.execute("ROLLBACK")
+                    raise
+            raise sqlite3.OperationalError("database is locked (write retries exhausted)")
+
+    def execute(self, sql, params=()):
+        # single-statement write; returns (lastrowid, rowcount)
+        def run(cur):
+            cur.execute(sql, params)
+            return cur.lastrowid, cur.rowcount
+        return self.write(run)
+
+    def external_version(self):
+        # changes whenever another connection - in practice another process - commits
+        # to the database or an attached one; our own commits leave it alone
+        return tuple(self._writer.execute(f"PRAGMA {schema}.data_version").fetchone()[0]
+                     for schema in ("main", *self.attached))
+
+    def cached(self, sql, params, load):
+        # load() runs the query; callers must treat the shared result as read-only
+        key = (sql, tuple(params), tuple((t, self.versions[t]) for t in tables_read(sql)), self.external_version())
+        return self.cache.get_or_load(key, load)
+
+    def close(self):
+        self._writer.close()
+
+# -----------------------
+# Page queries
+# -----------------------
+# Shared by app.py and the query plan check below, so the check always
+# looks at the SQL the pages actually run.
+USER_LOAN_STATS = "SELECT COUNT(*) as total, SUM(amount) as total_amount FROM loans WHERE user_id=?"
+USER_LOANS = "SELECT * FROM loans WHERE user_id=? ORDER BY created_at DESC"
+USER_REPAYABLE_LOANS = "SELECT * FROM loans WHERE user_id=? AND status='approved' AND payment_status!='Paid'"
+LOAN_WITH_USER = ("SELECT loans.*, users.email as user_email, users.name as user_fullname FROM loans "
+                  "LEFT JOIN users ON loans.user_id=users.id")
+LOAN_BY_ID = LOAN_WITH_USER + " WHERE loans.id=?"
+PENDING_LOANS = "SELECT * FROM loans WHERE status='pending' ORDER BY created_at DESC"
+LOAN_STATUS_SUMMARY = rollups.STATUS_SUMMARY
+# IN instead of != 'Paid' lets the (status, payment_status, due_date) index range-scan due_date
+DUE_LOANS = ("SELECT loans.*, users.email as user_email FROM loans LEFT JOIN users ON loans.user_id=users.id "
+             "WHERE loans.due_date <= ? AND loans.status='approved' "
+             "AND loans.payment_status IN ('Unpaid', 'Partially Paid')")
+USER_LOGIN = "SELECT * FROM users WHERE phone=? OR email=?"
+LOAN_INSTALLMENTS = "SELECT inst_no, due_date, amount, principal, interest, paid, paid_at FROM installments WHERE loan_id=? ORDER BY inst_no"
+# unpaid installments falling due between two ISO dates - one range walk of idx_installments_due_paid.
+# CROSS JOIN pins installments as the outer loop (SQLite never reorders it).
+DUE_INSTALLMENTS = ("SELECT installments.loan_id, installments.inst_no, installments.due_date, installments.amount, "
+                    "loans.name, loans.phone FROM installments CROSS JOIN loans ON loans.id=installments.loan_id "
+                    "WHERE installments.due_date BETWEEN ? AND ? AND installments.paid=0 "
+                    "AND loans.status='approved' ORDER BY installments.due_date")
+
+ACCRUAL_SUMMARY = ("SELECT MAX(day) as through, COALESCE(SUM(interest), 0) as interest, "
+                   "COALESCE(SUM(penalty), 0) as penalty FROM accrual_runs")
+
+ADMIN_PAGE_SIZE = 50
+
+def loans_page_query(status=None, date_from=None, date_to=None, min_amount=None, max_amount=None,
+                     after=None, limit=ADMIN_PAGE_SIZE):
+    # Keyset pagination over (created_at, id), newest first. `after` is the
+    # (created_at, id) of the last row of the previous page, so every page is an
+    # index range walk of `limit` rows no matter how deep it is - no OFFSET.
+    # date_from/date_to are ISO dates, inclusive.
+    where, params = [], []
+    if status:
+        where.append("loans.status=?")
+        params.append(status)
+    if date_from:
+        where.append("loans.created_at >= ?")
+        params.append(str(date_from))
+    if date_to:
+        # created_at is a full ISO timestamp, so compare against the next day
+        where.append("loans.created_at < date(?, '+1 day')")
+        params.append(str(date_to))
+    if min_amount:
+        where.append("loans.amount >= ?")
+        params.append(min_amount)
+    if max_amount:
+        where.append("loans.amount <= ?")
+        params.append(max_amount)
+    if after:
+        where.append("(loans.created_at, loans.id) < (?, ?)")
+        params.extend(after)
+    sql = LOAN_WITH_USER
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY loans.created_at DESC, loans.id DESC LIMIT ?"
+    params.append(limit)
+    return sql, tuple(params)
+
+PAGE_QUERIES = {
+    "Dashboard stats": (USER_LOAN_STATS, (1,)),
+    "Dashboard / History loans": (USER_LOANS, (1,)),
+    "Repay": (USER_REPAYABLE_LOANS, (1,)),
+    "Admin All Loans": loans_page_query(),
+    "Admin All Loans (filtered, page 2)": loans_page_query("approved", "2024-01-01", "2024-12-31", 1000, 50000,
+                                                           after=("2024-06-01T00:00:00", 10)),
+    "Admin loan lookup": (LOAN_BY_ID, (1,)),
+    "Admin Pending Approvals": (PENDING_LOANS, ()),
+    "Admin Analytics": (LOAN_STATUS_SUMMARY, ()),
+    "Admin Analytics daily": (rollups.DAILY, ("2000-01-01",)),
+    "Admin Reminders": (DUE_LOANS, ("2000-01-01",)),
+    "Login": (USER_LOGIN, ("0000000000", "0000000000")),
+    "Loan installments": (LOAN_INSTALLMENTS, (1,)),
+    "Admin Reminders installments": (DUE_INSTALLMENTS, ("2000-01-01", "2000-01-08")),
+    "Admin Borrower Search": search.search_query("ali 0300"),
+    "Apply duplicate check": (search.DUPLICATES, ('cnic:"4210112345671" OR phone:"03001234567"', 1)),
+}
+
+def query_plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def unindexed_queries(conn):
+    # a plain "SCAN <table>" step means a full table scan; "SCAN ... USING INDEX"
+    # (index-ordered walk), "SEARCH ..." and scans of a subquery already cut down
+    # to a LIMIT and materialized are fine
+    bad = {}
+    for name, (sql, params) in PAGE_QUERIES.items():
+        plan = query_plan(conn, sql, params)
+        materialized = {step.split()[1] for step in plan if step.startswith("MATERIALIZE")}
+        if any(step.startswith("SCAN") and "INDEX" not in step and step.split()[1] not in materialized
+               for step in plan):
+            bad[name] = plan
+    return bad
+
+if __name__ == "__main__":
+    # python db.py [DB_FILE] - migrate, then fail if any page query scans a table
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else ":memory:")
+    print("schema version", migrate(conn))
+    for name, (sql, params) in PAGE_QUERIES.items():
+        print(f"{name}:")
+        for step in query_plan(conn, sql, params):
+            print("   ", step)
+    bad = unindexed_queries(conn)
+    if bad:
+        print("full table scans:", ", ".join(bad))
+        sys.exit(1)
@@ -0,0 +1,179 @@
+# exports.py
+# Streaming exports. Rows come off one SQLite cursor a chunk at a time and are
+# written straight into a temporary file, so memory holds one chunk however many
+# rows there are. CSV uses the csv module, XLSX openpyxl's write-only workbook and
+# Parquet pyarrow (optional - only offered when it is installed).
+import csv
+import importlib.util
+import io
+import tempfile
+from datetime import date, timedelta
+
+CHUNK_ROWS = 5000
+EXCEL_MAX_ROWS = 1048576   # per sheet, header included; bigger exports continue on a new sheet
+
+# format -> (mime type, extension, module it needs)
+FORMATS = {
+    "csv": ("text/csv", ".csv", None),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx", "openpyxl"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet", "pyarrow"),
+}
+
+def available_formats():
+    return [fmt for fmt, (_, _, module) in FORMATS.items() if module is None or importlib.util.find_spec(module)]
+
+def query_chunks(conn, sql, params=(), chunk_rows=CHUNK_ROWS):
+    # (column names, generator of row lists)
+    cur = conn.execute(sql, params)
+    columns = [d[0] for d in cur.description]
+
+    def chunks():
+        try:
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+    return columns, chunks()
+
+def write_csv(fileobj, columns, chunks):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    text.flush()
+    text.detach()   # leave fileobj open for the caller
+    return count
+
+def write_xlsx(fileobj, columns, chunks, sheet="data"):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)   # rows are streamed to disk, not kept as cell objects
+    ws, on_sheet, sheets, count = None, EXCEL_MAX_ROWS, 0, 0
+    for rows in chunks:
+        for row in rows:
+            if on_sheet >= EXCEL_MAX_ROWS:
+                sheets += 1
+                ws = wb.create_sheet(sheet if sheets == 1 else f"{sheet}_{sheets}")
+                ws.append(columns)
+                on_sheet = 1
+            ws.append(row)
+            on_sheet += 1
+        count += len(rows)
+    if ws is None:
+        wb.create_sheet(sheet).append(columns)
+    wb.save(fileobj)
+    return count
+
+def write_parquet(fileobj, columns, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer, schema, count = None, None, 0
+    for rows in chunks:
+        values = list(zip(*rows))
+        if schema is None:
+            # types come from the first chunk; all-NULL columns are written as strings
+            arrays = [pa.array(v) for v in values]
+            schema = pa.schema([(c, pa.string() if a.type == pa.null() else a.type) for c, a in zip(columns, arrays)])
+            writer = pq.ParquetWriter(fileobj, schema)
+        writer.write_table(pa.Table.from_arrays([pa.array(v, type=f.type) for v, f in zip(values, schema)], schema=schema))
+        count += len(rows)
+    if writer is None:
+        writer = pq.ParquetWriter(fileobj, pa.schema([(c, pa.string()) for c in columns]))
+    writer.close()
+    return count
+
+WRITERS = {"csv": write_csv, "xlsx": write_xlsx, "parquet": write_parquet}
+
+def export(conn, sql, params, fmt, fileobj=None, chunk_rows=CHUNK_ROWS):
+    # Returns (file positioned at 0, row count). Without fileobj an anonymous temp
+    # file is used - it disappears once closed.
+    fileobj = fileobj or tempfile.TemporaryFile()
+    columns, chunks = query_chunks(conn, sql, params, chunk_rows)
+    count = WRITERS[fmt](fileobj, columns, chunks)
+    fileobj.seek(0)
+    return fileobj, count
+
+def file_name(stem, fmt):
+    return stem + FORMATS[fmt][1]
+
+def mime(fmt):
+    return FORMATS[fmt][0]
+
+# -----------------------
+# Full-portfolio export
+# -----------------------
+# output column -> SQL expression; CNICs are masked as everywhere else in the app
+PORTFOLIO_COLUMNS = {
+    "id": "loans.id",
+    "user_id": "loans.user_id",
+    "name": "loans.name",
+    "father_name": "loans.father_name",
+    "phone": "loans.phone",
+    "user_email": "users.email",
+    "cnic": "CASE WHEN length(loans.cnic) >= 5 THEN substr(loans.cnic, 1, 5) || '-XXXXXXX-' || substr(loans.cnic, -1) "
+            "ELSE '****' END",
+    "address": "loans.address",
+    "amount": "loans.amount",
+    "interest_rate": "loans.interest_rate",
+    "total_payable": "loans.total_payable",
+    "amount_paid": "loans.amount_paid",
+    "outstanding": "loans.outstanding",
+    "status": "loans.status",
+    "payment_status": "loans.payment_status",
+    "installment_plan": "loans.installment_plan",
+    "receipt_no": "loans.receipt_no",
+    "created_at": "loans.created_at",
+    "approved_at": "loans.approved_at",
+    "due_date": "loans.due_date",
+}
+DATE_FIELDS = ("created_at", "approved_at", "due_date")
+# The replica keeps these as TIMESTAMP / DATE; written back out in the ISO text the
+# app stores, so an export reads the same from either engine.
+_ISO_TIMESTAMP = ("strftime({c}, '%Y-%m-%dT%H:%M:%S') "
+                  "|| CASE WHEN epoch_us({c}) % 1000000 = 0 THEN '' ELSE strftime({c}, '.%f') END")
+DUCKDB_COLUMNS = {
+    "created_at": _ISO_TIMESTAMP.format(c="loans.created_at"),
+    "approved_at": _ISO_TIMESTAMP.format(c="loans.approved_at"),
+    "due_date": "CAST(loans.due_date AS VARCHAR)",
+}
+
+def portfolio_query(columns=None, statuses=None, payment_statuses=None, date_field="created_at",
+                    date_from=None, date_to=None, engine="sqlite"):
+    # returns (sql, params); dates are inclusive days. engine="duckdb" for the analytics replica
+    columns = [c for c in (columns or PORTFOLIO_COLUMNS) if c in PORTFOLIO_COLUMNS]
+    if not columns:
+        raise ValueError("no known columns selected")
+    if date_field not in DATE_FIELDS:
+        raise ValueError(f"date_field must be one of {DATE_FIELDS}")
+    expressions = {**PORTFOLIO_COLUMNS, **(DUCKDB_COLUMNS if engine == "duckdb" else {})}
+    select = ", ".join(f"{expressions[c]} AS {c}" for c in columns)
+    # NOT INDEXED: walk the table in rowid order, so ORDER BY id needs no sort (and no
+    # memory) whatever the filters; an export reads most of the table anyway
+    sql = f"SELECT {select} FROM loans" + (" NOT INDEXED" if engine == "sqlite" else "")
+    if "user_email" in columns:
+        sql += " LEFT JOIN users ON users.id = loans.user_id"
+    where, params = [], []
+    if engine == "duckdb":
+        where.append("NOT loans.archived")   # the SQLite export reads the live table only
+    if statuses:
+        where.append(f"loans.status IN ({', '.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if payment_statuses:
+        where.append(f"loans.payment_status IN ({', '.join('?' * len(payment_statuses))})")
+        params.extend(payment_statuses)
+    if date_from:
+        where.append(f"loans.{date_field} >= ?")
+        params.append(date_from.isoformat() if isinstance(date_from, date) else date_from)
+    if date_to:
+        # created_at / approved_at carry a time of day, so compare against the next day
+        where.append(f"loans.{date_field} < ?")
+        params.append((date_to + timedelta(days=1)).isoformat() if isinstance(date_to, date) else date_to)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY loans.id"
+    return sql, tuple(params)
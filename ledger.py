@@ -0,0 +1,128 @@
+# ledger.py
+# Payments are an append-only ledger; loans.amount_paid / loans.outstanding are
+# running totals kept in step with it inside the same transaction, so the
+# remaining balance is a single-row read. reconcile() rebuilds the totals from
+# the ledger if they ever drift (manual edits, imports, bugs).
+import sys
+from datetime import datetime
+
+import db
+
+PAID_EPSILON = 0.005  # amounts are rounded to paisa; anything smaller counts as settled
+
+# SQLite evaluates every SET expression against the row's old values.
+APPLY_PAYMENT = """UPDATE loans SET
+                       amount_paid = COALESCE(amount_paid, 0) + :amt,
+                       outstanding = MAX(total_payable - COALESCE(amount_paid, 0) - :amt, 0),
+                       payment_status = CASE WHEN total_payable - COALESCE(amount_paid, 0) - :amt <= :eps
+                                             THEN 'Paid' ELSE 'Partially Paid' END,
+                       receipt_no = CASE WHEN total_payable - COALESCE(amount_paid, 0) - :amt <= :eps
+                                         THEN :receipt ELSE receipt_no END
+                   WHERE id = :loan_id"""
+INSERT_PAYMENT = ("INSERT INTO payments (loan_id, amount, payment_method, paid_at, receipt) "
+                  "VALUES (:loan_id, :amt, :method, :paid_at, :receipt)")
+# settle installments oldest first, as far as the running total covers them
+SETTLE_INSTALLMENTS = """UPDATE installments SET paid=1, paid_at=:paid_at
+                         WHERE loan_id=:loan_id AND paid=0
+                           AND (SELECT SUM(i.amount) FROM installments i
+                                WHERE i.loan_id=installments.loan_id AND i.inst_no <= installments.inst_no)
+                               <= (SELECT amount_paid FROM loans WHERE id=:loan_id) + :eps"""
+
+def _params(loan_id, amount, method, receipt, paid_at):
+    return {"loan_id": loan_id, "amt": amount, "method": method, "receipt": receipt,
+            "paid_at": paid_at or datetime.utcnow().isoformat(), "eps": PAID_EPSILON}
+
+def record_payment(cur, loan_id, amount, method, receipt, paid_at=None):
+    # Call from inside Database.write. Returns (outstanding, payment_status),
+    # or None if the loan doesn't exist (nothing is written then).
+    params = _params(loan_id, amount, method, receipt, paid_at)
+    cur.execute(APPLY_PAYMENT, params)
+    if cur.rowcount == 0:
+        return None
+    cur.execute(INSERT_PAYMENT, params)
+    cur.execute(SETTLE_INSTALLMENTS, params)
+    row = cur.execute("SELECT outstanding, payment_status FROM loans WHERE id=?", (loan_id,)).fetchone()
+    return row[0], row[1]
+
+def record_payments(cur, payments):
+    # Bulk record_payment for settlement files: payments are (loan_id, amount, method,
+    # receipt, paid_at) tuples, applied in order with one executemany per statement.
+    # Call inside Database.write with a bounded chunk. Rows without a receipt or a
+    # positive amount, for unknown or unapproved loans, and receipts already in the
+    # ledger (a file posted twice) are skipped.
+    # Returns (applied rows, {loan_id: (outstanding, payment_status)}, skipped [(row, reason)]).
+    if not payments:
+        return [], {}, []
+    loan_ids = sorted({int(p[0]) for p in payments})
+    receipts = sorted({p[3] for p in payments if p[3]})
+    status = dict(cur.execute(f"SELECT id, status FROM loans WHERE id IN ({','.join('?' * len(loan_ids))})", loan_ids))
+    seen = {r[0] for r in cur.execute(f"SELECT receipt FROM payments WHERE receipt IN ({','.join('?' * len(receipts))})",
+                                      receipts)} if receipts else set()
+    applied, skipped = [], []
+    for p in payments:
+        if int(p[0]) not in status:
+            skipped.append((p, "loan not found"))
+        elif status[int(p[0])] != "approved":
+            skipped.append((p, "loan not approved"))
+        elif not float(p[1]) > 0:
+            skipped.append((p, "amount must be positive"))
+        elif not p[3]:
+            skipped.append((p, "missing receipt"))
+        elif p[3] in seen:
+            skipped.append((p, "duplicate receipt"))
+        else:
+            seen.add(p[3])
+            applied.append(p)
+    if not applied:
+        return [], {}, skipped
+    params = [_params(int(p[0]), float(p[1]), p[2], p[3], p[4]) for p in applied]
+    cur.executemany(APPLY_PAYMENT, params)
+    cur.executemany(INSERT_PAYMENT, params)
+    # once per loan, after all its payments: the pass settles everything the running total covers
+    cur.executemany(SETTLE_INSTALLMENTS, list({p["loan_id"]: p for p in params}.values()))
+    paid_ids = sorted({p["loan_id"] for p in params})
+    balances = {r[0]: (r[1], r[2]) for r in cur.execute(
+        f"SELECT id, outstanding, payment_status FROM loans WHERE id IN ({','.join('?' * len(paid_ids))})", paid_ids)}
+    return applied, balances, skipped
+
+def expected_balances(conn):
+    # one pass over each table; the per-loan arithmetic is done column-wise in pandas
+    import pandas as pd
+    loans = pd.read_sql_query("SELECT id, total_payable, amount_paid, outstanding, payment_status FROM loans", conn)
+    paid = pd.read_sql_query("SELECT loan_id AS id, SUM(amount) AS ledger_paid FROM payments GROUP BY loan_id", conn)
+    df = loans.merge(paid, on="id", how="left")
+    df["ledger_paid"] = df["ledger_paid"].fillna(0.0)
+    df["ledger_outstanding"] = (df["total_payable"].fillna(0.0) - df["ledger_paid"]).clip(lower=0.0).round(2)
+    df["ledger_status"] = "Unpaid"
+    df.loc[df["ledger_paid"] > 0, "ledger_status"] = "Partially Paid"
+    df.loc[(df["ledger_paid"] > 0) & (df["ledger_outstanding"] <= PAID_EPSILON), "ledger_status"] = "Paid"
+    # loans settled before payments were recorded have no ledger rows; trust their Paid flag
+    legacy = (df["payment_status"] == "Paid") & (df["ledger_paid"] == 0)
+    df.loc[legacy, "ledger_outstanding"] = 0.0
+    df.loc[legacy, "ledger_status"] = "Paid"
+    return df
+
+def reconcile(database, conn, fix=True):
+    # Returns the loans whose stored totals disagree with the ledger; with fix=True
+    # they are rewritten in one transaction.
+    df = expected_balances(conn)
+    drift = ((df["amount_paid"].fillna(-1) - df["ledger_paid"]).abs() > PAID_EPSILON) | \
+            ((df["outstanding"].fillna(-1) - df["ledger_outstanding"]).abs() > PAID_EPSILON) | \
+            (df["payment_status"] != df["ledger_status"])
+    drifted = df[drift]
+    if fix and not drifted.empty:
+        rows = list(zip(drifted["ledger_paid"].astype(float), drifted["ledger_outstanding"].astype(float),
+                        drifted["ledger_status"], drifted["id"].astype(int)))
+        database.write(lambda cur: cur.executemany(
+            "UPDATE loans SET amount_paid=?, outstanding=?, payment_status=? WHERE id=?", rows))
+    return drifted
+
+if __name__ == "__main__":
+    # python ledger.py [DB_FILE] [--dry-run]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    database = db.Database(args[0] if args else "loans_pro.db")
+    drifted = reconcile(database, database.reader(), fix="--dry-run" not in sys.argv)
+    print(f"{len(drifted)} loan(s) out of step with the payments ledger")
+    if not drifted.empty:
+        print(drifted[["id", "amount_paid", "ledger_paid", "outstanding", "ledger_outstanding",
+                       "payment_status", "ledger_status"]].to_string(index=False))
@@ -0,0 +1,336 @@
+# notify.py
+# Transactional notification outbox. Pages only INSERT messages into the outbox
+# (ideally in the same transaction as the change they announce); a background
+# Dispatcher drains it in batches - one SMTP connection / HTTP session per
+# batch, a per-channel rate limit, retries with exponential backoff, and a
+# dedupe key so the same reminder is never queued twice.
+#   python notify.py demo   - end-to-end run against a local stub SMTP server and fake SMS sink
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, date
+from email.message import EmailMessage
+
+EMAIL = "email"
+SMS = "sms"
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30      # 30s, 60s, 2m, 4m ...
+POLL_SECONDS = 2.0
+RATE_LIMITS = {EMAIL: 10.0, SMS: 5.0}   # messages per second
+
+# -----------------------
+# Enqueue (called inside Database.write)
+# -----------------------
+INSERT_OUTBOX = """INSERT OR IGNORE INTO outbox (channel, recipient, subject, body, dedupe_key, status, attempts,
+                   next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?)"""
+
+def reminder_key(loan_id, kind, day=None):
+    # one reminder of a kind per loan per day, however often the button is pressed
+    return f"{kind}:{loan_id}:{(day or date.today()).isoformat()}"
+
+def outbox_row(channel, recipient, subject, body, dedupe_key=None):
+    now = datetime.utcnow().isoformat()
+    key = f"{channel}:{dedupe_key}" if dedupe_key else None
+    return (channel, recipient, subject, body, key, now, now)
+
+def enqueue_many(cur, rows):
+    # rows from outbox_row(); messages without a recipient are dropped
+    # returns how many were actually queued (duplicates are ignored)
+    rows = [r for r in rows if r[1]]
+    if not rows:
+        return 0
+    cur.executemany(INSERT_OUTBOX, rows)
+    return cur.rowcount
+
+def enqueue(cur, channel, recipient, subject, body, dedupe_key=None):
+    return enqueue_many(cur, [outbox_row(channel, recipient, subject, body, dedupe_key)])
+
+# -----------------------
+# Senders
+# -----------------------
+# A sender is a context manager: the connection is opened once per batch and
+# send(msg) is called for each message. msg is a dict with recipient/subject/body.
+
+class SmtpSender:
+    def __init__(self, smtp_server, smtp_port, username=None, password=None, from_addr=None, starttls=True, timeout=30):
+        self.server, self.port = smtp_server, smtp_port
+        self.username, self.password = username, password
+        self.from_addr = from_addr or username
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp = None
+
+    def __enter__(self):
+        self._smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        if self.starttls:
+            self._smtp.starttls()
+        if self.username and self.password:
+            self._smtp.login(self.username, self.password)
+        return self
+
+    def send(self, msg):
+        m = EmailMessage()
+        m["From"] = self.from_addr
+        m["To"] = msg["recipient"]
+        m["Subject"] = msg["subject"] or ""
+        m.set_content(msg["body"])
+        self._smtp.send_message(m)
+
+    def __exit__(self, *exc):
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            pass
+        self._smtp = None
+
+class TwilioSmsSender:
+    # Twilio Messages API; base_url can point at any compatible endpoint (e.g. a local sink)
+    def __init__(self, account_sid, auth_token, from_number, base_url="https://api.twilio.com", timeout=15):
+        self.url = f"{base_url}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.auth = (account_sid, auth_token)
+        self.from_number = from_number
+        self.timeout = timeout
+        self._session = None
+
+    def __enter__(self):
+        import requests
+        self._session = requests.Session()
+        self._session.auth = self.auth
+        return self
+
+    def send(self, msg):
+        r = self._session.post(self.url, data={"To": msg["recipient"], "From": self.from_number, "Body": msg["body"]},
+                               timeout=self.timeout)
+        r.raise_for_status()
+
+    def __exit__(self, *exc):
+        self._session.close()
+        self._session = None
+
+# -----------------------
+# Dispatcher
+# -----------------------
+class RateLimiter:
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self._next = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+        self._next = max(self._next, now) + self.interval
+
+class Dispatcher:
+    # senders: {channel: sender or None}. Channels without a sender (notifications
+    # disabled) have their messages marked 'skipped' instead of piling up.
+    def __init__(self, database, senders, batch_size=BATCH_SIZE, rate_limits=None, max_attempts=MAX_ATTEMPTS,
+                 retry_base=RETRY_BASE_SECONDS):
+        self.database = database
+        self.senders = senders
+        self.batch_size = batch_size
+        self.limiters = {ch: RateLimiter(rate) for ch, rate in {**RATE_LIMITS, **(rate_limits or {})}.items()}
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(senders)), thread_name_prefix="outbox")
+        self._stop = threading.Event()
+        self._thread = None
+        # messages claimed by a dispatcher that died mid-batch go back in the queue
+        database.execute("UPDATE outbox SET status='pending' WHERE status='sending'")
+
+    def _claim(self, channel):
+        def claim(cur):
+            rows = cur.execute("""SELECT id, recipient, subject, body, attempts FROM outbox
+                                  WHERE status='pending' AND channel=? AND next_attempt_at <= ?
+                                  ORDER BY next_attempt_at LIMIT ?""",
+                               (channel, datetime.utcnow().isoformat(), self.batch_size)).fetchall()
+            cur.executemany("UPDATE outbox SET status='sending' WHERE id=?", [(r[0],) for r in rows])
+            return [{"id": r[0], "recipient": r[1], "subject": r[2], "body": r[3], "attempts": r[4]} for r in rows]
+        return self.database.write(claim)
+
+    def _send_batch(self, channel, batch):
+        sender = self.senders.get(channel)
+        results = {}
+        if sender is None:
+            return {m["id"]: "skipped" for m in batch}
+        try:
+            with sender:
+                for m in batch:
+                    self.limiters[channel].wait()
+                    try:
+                        sender.send(m)
+                        results[m["id"]] = None
+                    except Exception as e:  # one bad recipient shouldn't fail the batch
+                        results[m["id"]] = str(e) or type(e).__name__
+        except Exception as e:  # connection-level failure: retry whatever wasn't sent
+            for m in batch:
+                results.setdefault(m["id"], str(e) or type(e).__name__)
+        return results
+
+    def _finish(self, batch, results):
+        now = datetime.utcnow()
+        sent, skipped, retry, failed = [], [], [], []
+        for m in batch:
+            err = results[m["id"]]
+            if err is None:
+                sent.append((now.isoformat(), m["id"]))
+            elif err == "skipped":
+                skipped.append((m["id"],))
+            elif m["attempts"] + 1 >= self.max_attempts:
+                failed.append((err, m["id"]))
+            else:
+                delay = self.retry_base * 2 ** m["attempts"]
+                retry.append((err, (now + timedelta(seconds=delay)).isoformat(), m["id"]))
+        def finish(cur):
+            cur.executemany("UPDATE outbox SET status='sent', sent_at=?, attempts=attempts+1, last_error=NULL WHERE id=?", sent)
+            cur.executemany("UPDATE outbox SET status='skipped' WHERE id=?", skipped)
+            cur.executemany("UPDATE outbox SET status='pending', attempts=attempts+1, last_error=?, next_attempt_at=? WHERE id=?", retry)
+            cur.executemany("UPDATE outbox SET status='failed', attempts=attempts+1, last_error=? WHERE id=?", failed)
+        self.database.write(finish)
+        return len(sent)
+
+    def run_once(self):
+        # one batch per channel, channels in parallel; returns messages sent
+        def channel_batch(channel):
+            batch = self._claim(channel)
+            return self._finish(batch, self._send_batch(channel, batch)) if batch else 0
+        return sum(self._pool.map(channel_batch, list(self.senders)))
+
+    def drain(self):
+        total = 0
+        while True:
+            sent = self.run_once()
+            if not sent and not self.pending_now():
+                return total
+            total += sent
+
+    def pending_now(self):
+        conn = self.database.reader()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE status='pending' AND next_attempt_at <= ?",
+                                (datetime.utcnow().isoformat(),)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def start(self, poll_seconds=POLL_SECONDS):
+        if self._thread and self._thread.is_alive():
+            return self
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    busy = self.run_once()
+                except Exception:
+                    busy = 0
+                if not busy:
+                    self._stop.wait(poll_seconds)
+        self._thread = threading.Thread(target=loop, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._pool.shutdown()
+
+def outbox_stats(conn):
+    return dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+# -----------------------
+# Local end-to-end demo
+# -----------------------
+def _stub_smtp_server():
+    # just enough SMTP for smtplib (EHLO/MAIL/RCPT/DATA/QUIT); messages land in .received
+    import socketserver
+
+    received = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(b"220 stub ESMTP\r\n")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                cmd = line.strip().split(b" ")[0].upper()
+                if cmd == b"EHLO":
+                    self.wfile.write(b"250 stub\r\n")
+                elif cmd == b"DATA":
+                    self.wfile.write(b"354 end with .\r\n")
+                    data = []
+                    for body_line in iter(self.rfile.readline, b".\r\n"):
+                        data.append(body_line)
+                    received.append(b"".join(data))
+                    self.wfile.write(b"250 queued\r\n")
+                elif cmd == b"QUIT":
+                    self.wfile.write(b"221 bye\r\n")
+                    return
+                else:
+                    self.wfile.write(b"250 ok\r\n")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.received = received
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _fake_sms_sink():
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs
+
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append(parse_qs(body.decode()))
+            self.send_response(201)
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.received = received
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def demo(n=200):
+    import os
+    import tempfile
+    import db
+
+    smtp, sink = _stub_smtp_server(), _fake_sms_sink()
+    database = db.Database(os.path.join(tempfile.mkdtemp(), "outbox_demo.db"))
+    rows = []
+    for loan_id in range(1, n + 1):
+        key = reminder_key(loan_id, "due")
+        rows.append(outbox_row(EMAIL, f"user{loan_id}@example.com", "Loan Due Reminder", f"Loan {loan_id} is due.", key))
+        rows.append(outbox_row(SMS, f"+92300{loan_id:07d}", None, f"Loan {loan_id} is due.", key))
+    database.write(enqueue_many, rows)
+    database.write(enqueue_many, rows)   # pressing "Send Reminders" twice queues nothing new
+    senders = {
+        EMAIL: SmtpSender("127.0.0.1", smtp.server_address[1], from_addr="noreply@example.com", starttls=False),
+        SMS: TwilioSmsSender("AC_TEST", "token", "+10000000000", base_url=f"http://127.0.0.1:{sink.server_address[1]}"),
+    }
+    dispatcher = Dispatcher(database, senders, rate_limits={EMAIL: 500.0, SMS: 500.0})
+    t0 = time.perf_counter()
+    sent = dispatcher.drain()
+    elapsed = time.perf_counter() - t0
+    dispatcher.stop()
+    print(f"sent {sent} messages in {elapsed:.2f}s ({sent / elapsed:.0f}/s)")
+    print(f"stub SMTP received {len(smtp.received)}, fake SMS sink received {len(sink.received)}")
+    print("outbox:", outbox_stats(database.reader()))
+    smtp.shutdown()
+    sink.shutdown()
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["demo"]:
+        demo()
+    else:
+        print("usage: python notify.py demo")
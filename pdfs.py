@@ -0,0 +1,191 @@
+# pdfs.py
+# Agreement / receipt rendering plus a batch pipeline: documents for many loans
+# are rendered across a process pool and streamed into a ZIP. Every PDF is cached
+# on disk under a hash of exactly the fields it prints, so a document is only
+# rendered again when something on it changes.
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+PDF_CACHE_FOLDER = "pdf_cache"
+TEMPLATE_VERSION = 1   # bump when the layout changes so cached files are re-rendered
+POOL_MIN_DOCS = 500    # below this, starting worker processes costs more than it saves
+
+AGREEMENT = "agreement"
+RECEIPT = "receipt"
+
+def mask_cnic(cnic):
+    # show like 42101-XXXXX-2 (keep first 5 and last 1)
+    if not cnic or len(cnic) < 5:
+        return "****"
+    return cnic[:5] + "-" + "X"*7 + "-" + cnic[-1]
+
+def _new_pdf():
+    from fpdf import FPDF   # only loaded once something is actually rendered
+    pdf = FPDF()
+    pdf.add_page()
+    return pdf
+
+def _pdf_bytes(pdf):
+    # pyfpdf returns a latin-1 str, fpdf2 a bytearray
+    out = pdf.output(dest="S")
+    return out.encode("latin-1") if isinstance(out, str) else bytes(out)
+
+# -----------------------
+# Documents
+# -----------------------
+def agreement_fields(loan_record: dict) -> dict:
+    return {
+        "id": int(loan_record["id"]),
+        "name": loan_record["name"],
+        "father_name": loan_record.get("father_name") or "",
+        "cnic": mask_cnic(loan_record.get("cnic", "")),
+        "amount": loan_record["amount"],
+        "total_payable": loan_record["total_payable"],
+        "due_date": loan_record["due_date"],
+    }
+
+def receipt_fields(loan_record: dict, payments) -> dict:
+    # payments: iterable of (amount, payment_method, paid_at, receipt)
+    return {
+        "id": int(loan_record["id"]),
+        "name": loan_record["name"],
+        "total_payable": loan_record["total_payable"],
+        "amount_paid": loan_record.get("amount_paid") or 0.0,
+        "outstanding": loan_record.get("outstanding"),
+        "payments": [list(p) for p in payments],
+    }
+
+def render_agreement(f: dict) -> bytes:
+    pdf = _new_pdf()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(0, 10, "Loan Agreement", ln=True, align="C")
+    pdf.ln(5)
+    pdf.set_font("Arial", size=10)
+    pdf.multi_cell(0, 7, f"Loan ID: {f['id']}")
+    pdf.multi_cell(0, 7, f"Borrower Name: {f['name']}")
+    pdf.multi_cell(0, 7, f"Father Name: {f['father_name']}")
+    pdf.multi_cell(0, 7, f"CNIC: {f['cnic']}")
+    pdf.multi_cell(0, 7, f"Loan Amount: PKR {f['amount']}")
+    pdf.multi_cell(0, 7, f"Total Payable: PKR {f['total_payable']}")
+    pdf.multi_cell(0, 7, f"Due Date: {f['due_date']}")
+    pdf.ln(10)
+    pdf.multi_cell(0, 7, "Terms & Conditions:")
+    pdf.multi_cell(0, 6, "1. This is a sample agreement for demo purposes only.")
+    pdf.multi_cell(0, 6, "2. The borrower agrees to repay by the due date.")
+    pdf.ln(20)
+    pdf.multi_cell(0, 7, f"Signed: {f['name']}")
+    return _pdf_bytes(pdf)
+
+def render_receipt(f: dict) -> bytes:
+    pdf = _new_pdf()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(0, 10, "Payment Receipt", ln=True, align="C")
+    pdf.ln(5)
+    pdf.set_font("Arial", size=10)
+    pdf.multi_cell(0, 7, f"Loan ID: {f['id']}")
+    pdf.multi_cell(0, 7, f"Borrower Name: {f['name']}")
+    pdf.multi_cell(0, 7, f"Total Payable: PKR {f['total_payable']}")
+    pdf.ln(5)
+    for amount, method, paid_at, receipt in f["payments"]:
+        pdf.multi_cell(0, 6, f"{str(paid_at)[:10]}  PKR {amount}  {method}  {receipt}")
+    pdf.ln(5)
+    pdf.multi_cell(0, 7, f"Total Paid: PKR {f['amount_paid']}")
+    pdf.multi_cell(0, 7, f"Outstanding: PKR {f['outstanding']}")
+    return _pdf_bytes(pdf)
+
+RENDERERS = {AGREEMENT: render_agreement, RECEIPT: render_receipt}
+
+def generate_pdf_agreement(loan_record: dict):
+    output = io.BytesIO(render_agreement(agreement_fields(loan_record)))
+    output.seek(0)
+    return output
+
+# -----------------------
+# Content-addressed cache
+# -----------------------
+def cache_key(kind, fields):
+    payload = json.dumps([TEMPLATE_VERSION, kind, fields], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def cache_path(key, folder=PDF_CACHE_FOLDER):
+    return os.path.join(folder, key[:2], key + ".pdf")
+
+def _render_to_cache(job):
+    # runs in a worker process; write-then-rename so readers never see half a file
+    kind, fields, path = job
+    data = RENDERERS[kind](fields)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+def render_cached(kind, fields, folder=PDF_CACHE_FOLDER):
+    path = cache_path(cache_key(kind, fields), folder)
+    if not os.path.exists(path):
+        _render_to_cache((kind, fields, path))
+    return path
+
+# -----------------------
+# Batch pipeline
+# -----------------------
+def documents_for(conn, loan_ids, kinds=(AGREEMENT, RECEIPT)):
+    # (kind, fields, zip_name) for each loan; receipts only for loans with payments
+    cols = "id, name, father_name, cnic, amount, total_payable, due_date, amount_paid, outstanding"
+    docs = []
+    for start in range(0, len(loan_ids), 500):   # stay under SQLite's bound-parameter limit
+        chunk = [int(i) for i in loan_ids[start:start + 500]]
+        marks = ",".join("?" * len(chunk))
+        loans = conn.execute(f"SELECT {cols} FROM loans WHERE id IN ({marks})", chunk).fetchall()
+        payments = {}
+        if RECEIPT in kinds:
+            for row in conn.execute(f"SELECT loan_id, amount, payment_method, paid_at, receipt FROM payments "
+                                    f"WHERE loan_id IN ({marks}) ORDER BY loan_id, paid_at", chunk):
+                payments.setdefault(row[0], []).append(row[1:])
+        names = [c.strip() for c in cols.split(",")]
+        for row in loans:
+            rec = dict(zip(names, row))
+            if AGREEMENT in kinds:
+                docs.append((AGREEMENT, agreement_fields(rec), f"agreement_loan_{rec['id']}.pdf"))
+            if RECEIPT in kinds and rec["id"] in payments:
+                docs.append((RECEIPT, receipt_fields(rec, payments[rec["id"]]), f"receipt_loan_{rec['id']}.pdf"))
+    return docs
+
+def render_batch(docs, workers=4, folder=PDF_CACHE_FOLDER):
+    # Yields (zip_name, path) as documents become available: cache hits first,
+    # then misses in order as the pool finishes them.
+    misses = []
+    for kind, fields, name in docs:
+        path = cache_path(cache_key(kind, fields), folder)
+        if os.path.exists(path):
+            yield name, path
+        else:
+            misses.append(((kind, fields, path), name))
+    if not misses:
+        return
+    if workers <= 1 or len(misses) < POOL_MIN_DOCS:
+        for job, name in misses:
+            yield name, _render_to_cache(job)
+    else:
+        # spawn: the Streamlit server is multi-threaded, forking it is not safe
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            chunksize = max(1, len(misses) // (workers * 4))
+            for (job, name), path in zip(misses, pool.map(_render_to_cache, [j for j, _ in misses], chunksize=chunksize)):
+                yield name, path
+
+def write_zip(docs, fileobj, workers=4, folder=PDF_CACHE_FOLDER):
+    # PDFs are already compressed, so they are stored, not deflated
+    count = 0
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, path in render_batch(docs, workers, folder):
+            zf.write(path, arcname=name)
+            count += 1
+    return count
@@ -0,0 +1,138 @@
+# perf.py
+# In-process performance instrumentation. Every SQL statement (through the
+# Database's observe hook), every page render and a few expensive actions (PDFs,
+# exports) are recorded per key as a latency histogram plus a window of recent
+# samples for p50/p95/p99. Statements slower than the threshold also go to a
+# rotating log file. Everything lives in memory for the life of the server process.
+import logging
+import logging.handlers
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+SLOW_LOG_FILE = "slow_queries.log"
+SLOW_LOG_BYTES = 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+RECENT_SAMPLES = 1000   # per key; percentiles are over this window
+# histogram bucket upper bounds in ms (the last bucket is everything slower)
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+QUERY = "query"
+PAGE = "page"
+TASK = "task"   # PDF rendering, exports, bulk jobs
+
+def percentile(values, p):
+    # nearest rank
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def normalize_sql(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+def bucket_labels():
+    bounds = [f"<{b:g}ms" for b in BUCKETS_MS]
+    return bounds + [f">={BUCKETS_MS[-1]:g}ms"]
+
+class _Series:
+    __slots__ = ("count", "total", "max", "rows", "buckets", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, seconds, rows):
+        ms = seconds * 1000
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.rows += rows or 0
+        i = 0
+        while i < len(BUCKETS_MS) and ms >= BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.recent.append(ms)
+
+class Recorder:
+    def __init__(self, slow_ms=200, log_path=SLOW_LOG_FILE):
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.started = time.time()
+        self._series = {}   # (kind, name) -> _Series
+        self._lock = threading.Lock()
+        self._slow_log = None
+        if log_path:
+            self._slow_log = logging.getLogger(f"udhar.slow.{log_path}")
+            self._slow_log.propagate = False
+            if not self._slow_log.handlers:
+                handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=SLOW_LOG_BYTES,
+                                                               backupCount=SLOW_LOG_BACKUPS, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                self._slow_log.addHandler(handler)
+            self._slow_log.setLevel(logging.INFO)
+
+    def record(self, kind, name, seconds, rows=None):
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None:
+                series = self._series[(kind, name)] = _Series()
+            series.add(seconds, rows)
+
+    def query(self, sql, seconds, rows):
+        # Database observe hook. Only the statement text is kept - parameters carry
+        # phone numbers, CNICs and password hashes.
+        sql = normalize_sql(sql)
+        self.record(QUERY, sql, seconds, rows)
+        if self._slow_log and seconds * 1000 >= self.slow_ms:
+            self._slow_log.info("%.1fms rows=%d %s", seconds * 1000, rows or 0, sql)
+
+    @contextmanager
+    def timed(self, kind, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - t0)
+
+    def summary(self, kind):
+        # one dict per key, slowest p95 first
+        with self._lock:
+            items = [(name, s.count, s.total, s.max, s.rows, list(s.recent))
+                     for (k, name), s in self._series.items() if k == kind]
+        out = []
+        for name, count, total, worst, rows, recent in items:
+            out.append({"name": name, "count": count,
+                        "p50_ms": round(percentile(recent, 50), 2),
+                        "p95_ms": round(percentile(recent, 95), 2),
+                        "p99_ms": round(percentile(recent, 99), 2),
+                        "max_ms": round(worst, 2),
+                        "mean_ms": round(total / count, 2),
+                        "total_ms": round(total, 1),
+                        "avg_rows": round(rows / count, 1)})
+        return sorted(out, key=lambda r: r["p95_ms"], reverse=True)
+
+    def histogram(self, kind, name):
+        with self._lock:
+            series = self._series.get((kind, name))
+            return list(series.buckets) if series else [0] * (len(BUCKETS_MS) + 1)
+
+    def slow_log_tail(self, lines=50):
+        if not self.log_path:
+            return []
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                return list(deque(f, maxlen=lines))
+        except OSError:
+            return []
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self.started = time.time()
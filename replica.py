@@ -0,0 +1,272 @@
+# replica.py
+# Optional DuckDB analytics replica (pip install duckdb). Heavy admin reports and
+# the portfolio export read a columnar copy of loans, payments and users in
+# loans_analytics.duckdb instead of the SQLite file Apply Loan and Repay write to.
+#
+# Refreshes are incremental:
+#   - rows with an id above the last copied one (per table watermark) are new;
+#   - loans and users change in place, so triggers log the ids of updated and
+#     deleted rows in replica_changes (db migration 10); logged loans are
+#     re-copied, and the log is trimmed once the replica has committed. If the
+#     batch jobs capped the log past what the replica had seen, loans and users
+#     are re-copied in full.
+# Payments are append-only. Archived loans (see archive.py) stay in the replica,
+# flagged archived: they are copied from the archive schema when it is attached.
+#
+# DuckDB lets one process open the file for writing; the app owns it while it
+# runs, so use the CLI only when the app is stopped.
+#   python replica.py [DB_FILE] [--report cohorts|rate_bands]
+import argparse
+import importlib.util
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import archive
+import db
+
+REPLICA_FILE = "loans_analytics.duckdb"
+REFRESH_AFTER_S = 60    # pages refresh a replica older than this before reading it
+CHUNK_ROWS = 50000
+IN_CHUNK = 500          # ids per IN (...) lookup
+
+def available():
+    return importlib.util.find_spec("duckdb") is not None
+
+def replica_path(db_path, name=REPLICA_FILE):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), name)
+
+# column -> DuckDB type; SQLite values are cast on the way in
+TABLES = {
+    "loans": {"id": "BIGINT", "user_id": "BIGINT", "name": "VARCHAR", "father_name": "VARCHAR", "phone": "VARCHAR",
+              "cnic": "VARCHAR", "address": "VARCHAR", "amount": "DOUBLE", "interest_rate": "DOUBLE",
+              "total_payable": "DOUBLE", "amount_paid": "DOUBLE", "outstanding": "DOUBLE", "penalty_accrued": "DOUBLE",
+              "status": "VARCHAR", "payment_status": "VARCHAR", "installment_plan": "VARCHAR", "receipt_no": "VARCHAR",
+              "created_at": "TIMESTAMP", "approved_at": "TIMESTAMP", "due_date": "DATE", "archived": "BOOLEAN"},
+    "payments": {"id": "BIGINT", "loan_id": "BIGINT", "amount": "DOUBLE", "payment_method": "VARCHAR",
+                 "paid_at": "TIMESTAMP", "receipt": "VARCHAR"},
+    "users": {"id": "BIGINT", "name": "VARCHAR", "email": "VARCHAR", "created_at": "TIMESTAMP"},
+}
+# tables whose rows change in place; SQLite triggers (db migration 10) log them in replica_changes
+MUTABLE = ("loans", "users")
+
+class Replica:
+    def __init__(self, path):
+        import duckdb
+        self.path = path
+        self.con = duckdb.connect(path)
+        self._lock = threading.Lock()   # one refresh at a time; reads don't wait for it
+        self.refreshed_at = None        # monotonic time of the last refresh
+        self.last_refresh = {}
+        self.con.execute("CREATE TABLE IF NOT EXISTS watermarks (name VARCHAR PRIMARY KEY, value BIGINT)")
+        for table, columns in TABLES.items():
+            cols = ", ".join(f"{c} {t}" for c, t in columns.items())
+            self.con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+            have = {r[0] for r in self.con.execute(f"DESCRIBE {table}").fetchall()}
+            if set(columns) - have:
+                # a replica made before a column was added: rebuild the table with it
+                self.con.execute(f"DROP TABLE {table}")
+                self.con.execute(f"CREATE TABLE {table} ({cols})")
+                self.con.execute("DELETE FROM watermarks WHERE name = ?", (table,))
+
+    def cursor(self):
+        # one per thread / query; closing it leaves the replica open
+        return self.con.cursor()
+
+    def query(self, sql, params=()):
+        cur = self.cursor()
+        try:
+            return cur.execute(sql, params).df()
+        finally:
+            cur.close()
+
+    def watermarks(self):
+        return dict(self.con.execute("SELECT name, value FROM watermarks").fetchall())
+
+    def _sources(self, database, table):
+        # the live table, plus its archived rows when the archive is attached
+        archived = archive.SCHEMA in database.attached and table in archive.TABLES
+        return ["main"] + ([archive.SCHEMA] if archived else [])
+
+    def _select(self, table, schema):
+        # the SQLite columns of TABLES[table]; archived is which schema the row came from
+        return ", ".join(f"{int(schema == archive.SCHEMA)} AS archived" if c == "archived" else c
+                         for c in TABLES[table])
+
+    def _load(self, cur, reader, table, sql, params):
+        # appends the rows sql returns; returns (rows, highest id)
+        import pandas as pd
+        columns = TABLES[table]
+        select = ", ".join(f"TRY_CAST({c} AS {t}) AS {c}" for c, t in columns.items())
+        count, max_id = 0, None
+        for chunk in pd.read_sql_query(sql, reader, params=params, chunksize=CHUNK_ROWS):
+            cur.register("chunk", chunk)
+            cur.execute(f"INSERT INTO {table} SELECT {select} FROM chunk")
+            cur.unregister("chunk")
+            count += len(chunk)
+            if len(chunk):
+                max_id = max(max_id or 0, int(chunk["id"].max()))
+        return count, max_id
+
+    def refresh(self, database):
+        # copies everything new or changed since the last refresh; returns what it did
+        with self._lock:
+            t0 = time.perf_counter()
+            marks = self.watermarks()
+            stats = {"new": {}, "changed": {}}
+            reader = database.reader()
+            cur = self.cursor()
+            try:
+                reader.execute("BEGIN")   # one snapshot of SQLite for the whole copy
+                # the last change logged (the log may have been trimmed empty)
+                seq = reader.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'replica_changes'), 0)"
+                                     ).fetchone()[0]
+                cur.execute("BEGIN TRANSACTION")
+                # the first change not yet copied - with an empty log, the next one to come
+                first = reader.execute("SELECT COALESCE(MIN(seq), (SELECT seq + 1 FROM sqlite_sequence "
+                                       "WHERE name = 'replica_changes')) FROM replica_changes").fetchone()[0]
+                stats["reloaded"] = "changes" in marks and first is not None and first > marks["changes"] + 1
+                if stats["reloaded"]:
+                    # db.trim_replica_changes dropped changes we never saw
+                    for table in MUTABLE:
+                        cur.execute(f"DELETE FROM {table}")
+                        marks[table] = 0
+                for table in TABLES:
+                    since = marks.get(table, 0)
+                    new, top = 0, since
+                    for schema in self._sources(database, table):
+                        n, max_id = self._load(cur, reader, table,
+                                               f"SELECT {self._select(table, schema)} FROM {schema}.{table} "
+                                               f"WHERE id > ? ORDER BY id", (since,))
+                        new += n
+                        top = max(top, max_id or 0)
+                    stats["new"][table] = new
+                    cur.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (table, top))
+                    if table not in MUTABLE:
+                        continue
+                    # rows above the old watermark were just copied as they are now
+                    ids = [r[0] for r in reader.execute(
+                        "SELECT DISTINCT row_id FROM replica_changes WHERE tbl = ? AND seq > ? AND seq <= ? AND row_id <= ?",
+                        (table, marks.get("changes", 0), seq, since))]
+                    for start in range(0, len(ids), IN_CHUNK):
+                        chunk = ids[start:start + IN_CHUNK]
+                        placeholders = ",".join("?" * len(chunk))
+                        # gone from every source (deleted, not archived): drop it here too
+                        cur.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", chunk)
+                        for schema in self._sources(database, table):
+                            self._load(cur, reader, table, f"SELECT {self._select(table, schema)} FROM {schema}.{table} "
+                                                           f"WHERE id IN ({placeholders})", chunk)
+                    stats["changed"][table] = len(ids)
+                cur.execute("INSERT OR REPLACE INTO watermarks VALUES ('changes', ?)", (seq,))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            finally:
+                reader.execute("COMMIT")
+                reader.close()
+                cur.close()
+            # the replica has these changes now; a crash before this line only means re-copying them
+            database.write(lambda c: c.execute("DELETE FROM replica_changes WHERE seq <= ?", (seq,)))
+            self.refreshed_at = time.monotonic()
+            stats["seconds"] = round(time.perf_counter() - t0, 3)
+            stats["at"] = datetime.now().strftime("%H:%M:%S")
+            self.last_refresh = stats
+            return stats
+
+    def refresh_if_stale(self, database, max_age=REFRESH_AFTER_S):
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at > max_age:
+            return self.refresh(database)
+        return None
+
+    def close(self):
+        self.con.close()
+
+# -----------------------
+# Reports
+# -----------------------
+# Each report has a SQLite and a DuckDB version returning the same columns, so
+# the pages fall back to SQLite without the replica and the benchmark can time
+# both. {loans} / {payments} in the SQLite versions are the live tables, or live
+# plus archived rows when the archive is attached (report_params), as the replica has.
+
+# share of each monthly cohort's total payable collected by N months after origination
+COHORTS_SQLITE = """
+WITH cohort AS (
+    SELECT id, substr(created_at, 1, 7) AS cohort,
+           CAST(substr(created_at, 1, 4) AS INTEGER) * 12 + CAST(substr(created_at, 6, 2) AS INTEGER) AS month_idx,
+           total_payable
+    FROM {loans} WHERE status IN ('approved', 'paid') AND created_at >= ?),
+sizes AS (SELECT cohort, COUNT(*) AS loans, SUM(total_payable) AS payable FROM cohort GROUP BY cohort),
+paid AS (SELECT cohort.cohort,
+                CAST(substr(payments.paid_at, 1, 4) AS INTEGER) * 12 + CAST(substr(payments.paid_at, 6, 2) AS INTEGER)
+                - cohort.month_idx AS month_no,
+                SUM(payments.amount) AS amount
+         FROM {payments} AS payments JOIN cohort ON cohort.id = payments.loan_id GROUP BY 1, 2)
+SELECT paid.cohort, paid.month_no, sizes.loans,
+       ROUND(SUM(paid.amount) OVER (PARTITION BY paid.cohort ORDER BY paid.month_no) / sizes.payable, 4) AS repaid_share
+FROM paid JOIN sizes ON sizes.cohort = paid.cohort
+ORDER BY paid.cohort, paid.month_no"""
+COHORTS_DUCKDB = """
+WITH cohort AS (
+    SELECT id, date_trunc('month', created_at) AS cohort, total_payable
+    FROM loans WHERE status IN ('approved', 'paid') AND created_at >= CAST(? AS TIMESTAMP)),
+sizes AS (SELECT cohort, COUNT(*) AS loans, SUM(total_payable) AS payable FROM cohort GROUP BY cohort),
+paid AS (SELECT cohort.cohort, date_diff('month', cohort.cohort, payments.paid_at) AS month_no,
+                SUM(payments.amount) AS amount
+         FROM payments JOIN cohort ON cohort.id = payments.loan_id GROUP BY 1, 2)
+SELECT strftime(paid.cohort, '%Y-%m') AS cohort, paid.month_no, sizes.loans,
+       ROUND(SUM(paid.amount) OVER (PARTITION BY paid.cohort ORDER BY paid.month_no) / sizes.payable, 4) AS repaid_share
+FROM paid JOIN sizes ON sizes.cohort = paid.cohort
+ORDER BY paid.cohort, paid.month_no"""
+
+# collected / payable and the share overdue, per 5-point interest-rate band
+# (+1e-9: 0.35 * 100 / 5 is 6.999... in floating point)
+RATE_BANDS_SQLITE = """
+SELECT CAST(interest_rate * 100 / 5 + 1e-9 AS INTEGER) * 5 AS band_from, COUNT(*) AS loans,
+       SUM(total_payable) AS payable, SUM(COALESCE(amount_paid, 0)) AS collected,
+       ROUND(SUM(COALESCE(amount_paid, 0)) / SUM(total_payable), 4) AS collection_rate,
+       ROUND(AVG(CASE WHEN COALESCE(payment_status, '') != 'Paid' AND due_date < ? THEN 1.0 ELSE 0 END), 4) AS overdue_share
+FROM {loans} WHERE status IN ('approved', 'paid')
+GROUP BY 1 ORDER BY 1"""
+RATE_BANDS_DUCKDB = """
+SELECT CAST(floor(interest_rate * 100 / 5 + 1e-9) AS INTEGER) * 5 AS band_from, COUNT(*) AS loans,
+       SUM(total_payable) AS payable, SUM(COALESCE(amount_paid, 0)) AS collected,
+       ROUND(SUM(COALESCE(amount_paid, 0)) / SUM(total_payable), 4) AS collection_rate,
+       ROUND(AVG(CASE WHEN COALESCE(payment_status, '') != 'Paid' AND due_date < CAST(? AS DATE) THEN 1.0 ELSE 0 END), 4)
+       AS overdue_share
+FROM loans WHERE status IN ('approved', 'paid')
+GROUP BY 1 ORDER BY 1"""
+
+COHORT_MONTHS = 12
+
+def report_params(today=None, archive_schema=None):
+    # {report: (sqlite sql, duckdb sql, params)}. With the archive attached, pass its
+    # schema name so the SQLite versions count archived loans too, as the replica does.
+    today = today or date.today()
+    since = (today.replace(day=1) - timedelta(days=31 * (COHORT_MONTHS - 1))).replace(day=1).isoformat()
+    # live tables unqualified, so the query cache still sees "loans" / "payments" read
+    sources = {"loans": "loans", "payments": "payments"}
+    if archive_schema:
+        sources = {t: f"(SELECT * FROM {t} UNION ALL SELECT * FROM {archive_schema}.{t})" for t in sources}
+    return {"cohorts": (COHORTS_SQLITE.format(**sources), COHORTS_DUCKDB, (since,)),
+            "rate_bands": (RATE_BANDS_SQLITE.format(**sources), RATE_BANDS_DUCKDB, (today.isoformat(),))}
+
+def band_label(band_from):
+    return f"{int(band_from)}-{int(band_from) + 5}%"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the DuckDB analytics replica")
+    parser.add_argument("db_file", nargs="?", default="loans_pro.db")
+    parser.add_argument("--replica", default=None, help=f"replica file (default {REPLICA_FILE} next to DB_FILE)")
+    parser.add_argument("--report", choices=["cohorts", "rate_bands"], default=None, help="print a report after refreshing")
+    args = parser.parse_args()
+    database = db.Database(args.db_file)
+    if os.path.exists(archive.archive_path(database.path)):
+        archive.attach(database)
+    replica = Replica(args.replica or replica_path(args.db_file))
+    print(replica.refresh(database))
+    if args.report:
+        _, sql, params = report_params()[args.report]
+        print(replica.query(sql, params).to_string(index=False))
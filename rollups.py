@@ -0,0 +1,152 @@
+# rollups.py
+# Precomputed portfolio analytics. The rollup tables are kept current by
+# triggers on loans and payments (created in db migration 6), so every write
+# path - pages, batch jobs, imports - updates them in its own transaction.
+# Reads touch a few hundred rollup rows instead of the whole loans table.
+#   python rollups.py [DB_FILE]   - rebuild every rollup from scratch in one pass
+import sys
+
+# a loan counts towards outstanding / aging while approved and not fully paid
+def open_loan(row=None):
+    p = f"{row}." if row else ""
+    return f"{p}status='approved' AND COALESCE({p}payment_status, '') != 'Paid'"
+
+TABLES = ["""
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    day TEXT PRIMARY KEY,
+    originated_count INTEGER DEFAULT 0,
+    originated_amount REAL DEFAULT 0,
+    disbursed_count INTEGER DEFAULT 0,
+    disbursed_amount REAL DEFAULT 0,
+    payment_count INTEGER DEFAULT 0,
+    collected_amount REAL DEFAULT 0
+)""", """
+CREATE TABLE IF NOT EXISTS rollup_status (
+    status TEXT PRIMARY KEY,
+    loan_count INTEGER DEFAULT 0,
+    amount REAL DEFAULT 0
+)""", """
+CREATE TABLE IF NOT EXISTS rollup_due (
+    due_date TEXT PRIMARY KEY,
+    loan_count INTEGER DEFAULT 0,
+    principal REAL DEFAULT 0,
+    outstanding REAL DEFAULT 0
+)"""]
+
+def _bump_status(row, sign):
+    return f"""INSERT INTO rollup_status (status, loan_count, amount)
+               SELECT COALESCE({row}.status, ''), {sign}1, {sign}COALESCE({row}.amount, 0) WHERE 1
+               ON CONFLICT(status) DO UPDATE SET loan_count = loan_count + excluded.loan_count,
+                                                 amount = amount + excluded.amount;"""
+
+def _bump_due(row, sign):
+    return f"""INSERT INTO rollup_due (due_date, loan_count, principal, outstanding)
+               SELECT {row}.due_date, {sign}1, {sign}COALESCE({row}.amount, 0), {sign}COALESCE({row}.outstanding, 0)
+               WHERE {open_loan(row)}
+               ON CONFLICT(due_date) DO UPDATE SET loan_count = loan_count + excluded.loan_count,
+                                                   principal = principal + excluded.principal,
+                                                   outstanding = outstanding + excluded.outstanding;"""
+
+def _bump_daily(day, columns, where="1"):
+    cols = ", ".join(columns)
+    values = ", ".join(v for v in columns.values())
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in columns)
+    return f"""INSERT INTO rollup_daily (day, {cols}) SELECT {day}, {values} WHERE {where}
+               ON CONFLICT(day) DO UPDATE SET {updates};"""
+
+TRIGGERS = [f"""
+CREATE TRIGGER IF NOT EXISTS trg_rollup_loans_insert AFTER INSERT ON loans BEGIN
+    {_bump_daily("date(NEW.created_at)", {"originated_count": "1", "originated_amount": "COALESCE(NEW.amount, 0)"})}
+    {_bump_daily("date(COALESCE(NEW.approved_at, NEW.created_at))",
+                 {"disbursed_count": "1", "disbursed_amount": "COALESCE(NEW.amount, 0)"},
+                 where="NEW.status IN ('approved', 'paid')")}
+    {_bump_status("NEW", "+")}
+    {_bump_due("NEW", "+")}
+END""", f"""
+CREATE TRIGGER IF NOT EXISTS trg_rollup_loans_update
+AFTER UPDATE OF status, payment_status, amount, outstanding, due_date ON loans BEGIN
+    {_bump_status("OLD", "-")}
+    {_bump_status("NEW", "+")}
+    {_bump_due("OLD", "-")}
+    {_bump_due("NEW", "+")}
+    DELETE FROM rollup_due WHERE due_date IN (OLD.due_date, NEW.due_date) AND loan_count = 0;
+END""", f"""
+CREATE TRIGGER IF NOT EXISTS trg_rollup_loans_approved
+AFTER UPDATE OF status ON loans
+WHEN NEW.status IN ('approved', 'paid') AND COALESCE(OLD.status, '') NOT IN ('approved', 'paid') BEGIN
+    {_bump_daily("date(COALESCE(NEW.approved_at, datetime('now')))",
+                 {"disbursed_count": "1", "disbursed_amount": "COALESCE(NEW.amount, 0)"})}
+END""", f"""
+CREATE TRIGGER IF NOT EXISTS trg_rollup_loans_delete AFTER DELETE ON loans BEGIN
+    {_bump_status("OLD", "-")}
+    {_bump_due("OLD", "-")}
+    DELETE FROM rollup_due WHERE due_date = OLD.due_date AND loan_count = 0;
+END""", f"""
+CREATE TRIGGER IF NOT EXISTS trg_rollup_payments_insert AFTER INSERT ON payments BEGIN
+    {_bump_daily("date(NEW.paid_at)", {"payment_count": "1", "collected_amount": "COALESCE(NEW.amount, 0)"})}
+END"""]
+
+# full rebuild - the same numbers the triggers maintain, computed in one pass per table.
+# {loans} / {payments} are the live tables, or the live plus archived rows (see rebuild).
+REBUILD = [
+    "DELETE FROM rollup_daily",
+    "DELETE FROM rollup_status",
+    "DELETE FROM rollup_due",
+    """INSERT INTO rollup_daily (day, originated_count, originated_amount)
+       SELECT date(created_at), COUNT(*), COALESCE(SUM(amount), 0) FROM {loans} GROUP BY date(created_at)""",
+    """INSERT INTO rollup_daily (day, disbursed_count, disbursed_amount)
+       SELECT date(COALESCE(approved_at, created_at)), COUNT(*), COALESCE(SUM(amount), 0) FROM {loans}
+       WHERE status IN ('approved', 'paid') GROUP BY 1 HAVING 1
+       ON CONFLICT(day) DO UPDATE SET disbursed_count = excluded.disbursed_count,
+                                      disbursed_amount = excluded.disbursed_amount""",
+    """INSERT INTO rollup_daily (day, payment_count, collected_amount)
+       SELECT date(paid_at), COUNT(*), COALESCE(SUM(amount), 0) FROM {payments} GROUP BY 1 HAVING 1
+       ON CONFLICT(day) DO UPDATE SET payment_count = excluded.payment_count,
+                                      collected_amount = excluded.collected_amount""",
+    """INSERT INTO rollup_status (status, loan_count, amount)
+       SELECT COALESCE(status, ''), COUNT(*), COALESCE(SUM(amount), 0) FROM {loans} GROUP BY 1""",
+    f"""INSERT INTO rollup_due (due_date, loan_count, principal, outstanding)
+        SELECT due_date, COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(outstanding), 0) FROM {{loans}}
+        WHERE {open_loan()} GROUP BY due_date""",
+]
+
+def rebuild(cur, archive_schema=None):
+    # Call inside Database.write. With the archive attached, pass its schema name:
+    # archived loans and payments keep counting, as they did when the triggers saw them.
+    sources = {"loans": "loans", "payments": "payments"}
+    if archive_schema:
+        sources = {t: f"(SELECT * FROM main.{t} UNION ALL SELECT * FROM {archive_schema}.{t})" for t in sources}
+    for sql in REBUILD:
+        cur.execute(sql.format(**sources))
+
+# -----------------------
+# Reads for the Analytics page
+# -----------------------
+STATUS_SUMMARY = "SELECT status, loan_count as count, amount as sum_amount FROM rollup_status WHERE loan_count > 0 ORDER BY status"
+DAILY = ("SELECT day, originated_count, originated_amount, disbursed_amount, collected_amount FROM rollup_daily "
+         "WHERE day >= ? ORDER BY day")
+TOTALS = ("SELECT COALESCE(SUM(disbursed_amount), 0) as disbursed, COALESCE(SUM(collected_amount), 0) as collected, "
+          "COALESCE(SUM(originated_count), 0) as originated FROM rollup_daily")
+# aging is relative to today, so it is bucketed at read time over one row per due date
+AGING = """SELECT CASE WHEN days_late <= 0 THEN 'current'
+                       WHEN days_late <= 30 THEN '1-30'
+                       WHEN days_late <= 60 THEN '31-60'
+                       ELSE '60+' END as bucket,
+                  SUM(loan_count) as loans, SUM(principal) as principal, SUM(outstanding) as outstanding
+           FROM (SELECT CAST(julianday(?) - julianday(due_date) AS INTEGER) as days_late, loan_count, principal, outstanding
+                 FROM rollup_due)
+           GROUP BY bucket
+           ORDER BY MIN(days_late)"""
+AGING_BUCKETS = ["current", "1-30", "31-60", "60+"]
+
+if __name__ == "__main__":
+    import os
+    import archive
+    import db
+    database = db.Database(sys.argv[1] if len(sys.argv) > 1 else "loans_pro.db")
+    schema = None
+    if os.path.exists(archive.archive_path(database.path)):
+        archive.attach(database)
+        schema = archive.SCHEMA
+    database.write(rebuild, schema)
+    print("rollups rebuilt")
@@ -0,0 +1,107 @@
+# search.py
+# Borrower search. loan_search is an FTS5 index with one row per loan (rowid =
+# loans.id) over the borrower's name, father name, phone, CNIC and account email,
+# kept in step by triggers on loans and users (created in db migration 8). CNICs
+# and phones are indexed both as typed and as bare digits, so "42101-1234567-1",
+# "4210112345671" and a prefix like "42101" all find the same loan.
+import re
+
+SEARCH_PAGE_SIZE = 25
+
+def _as_typed_and_digits(expr):
+    value = f"COALESCE({expr}, '')"
+    digits_only = f"replace(replace(replace(replace({value}, '-', ''), ' ', ''), '+', ''), '.', '')"
+    return f"{value} || ' ' || {digits_only}"
+
+def _row(row):
+    # indexed values for the loan in trigger row OLD / NEW
+    return (f"{row}.id, {row}.name, {row}.father_name, {_as_typed_and_digits(f'{row}.phone')}, "
+            f"{_as_typed_and_digits(f'{row}.cnic')}, (SELECT email FROM users WHERE users.id = {row}.user_id)")
+
+COLUMNS = "rowid, name, father_name, phone, cnic, email"
+
+TABLES = ["""
+CREATE VIRTUAL TABLE IF NOT EXISTS loan_search USING fts5(
+    name, father_name, phone, cnic, email,
+    tokenize = "unicode61 remove_diacritics 2 tokenchars '@.'",
+    prefix = '2 3 4'
+)""",
+# rank = weighted bm25: name hits above phone / CNIC, then email, then father name
+"INSERT INTO loan_search (loan_search, rank) VALUES ('rank', 'bm25(10.0, 2.0, 5.0, 5.0, 3.0)')"]
+
+TRIGGERS = [f"""
+CREATE TRIGGER IF NOT EXISTS trg_search_loans_insert AFTER INSERT ON loans BEGIN
+    INSERT INTO loan_search ({COLUMNS}) VALUES ({_row("NEW")});
+END""", f"""
+CREATE TRIGGER IF NOT EXISTS trg_search_loans_update
+AFTER UPDATE OF name, father_name, phone, cnic, user_id ON loans BEGIN
+    DELETE FROM loan_search WHERE rowid = OLD.id;
+    INSERT INTO loan_search ({COLUMNS}) VALUES ({_row("NEW")});
+END""", """
+CREATE TRIGGER IF NOT EXISTS trg_search_loans_delete AFTER DELETE ON loans BEGIN
+    DELETE FROM loan_search WHERE rowid = OLD.id;
+END""", """
+CREATE TRIGGER IF NOT EXISTS trg_search_users_email AFTER UPDATE OF email ON users BEGIN
+    UPDATE loan_search SET email = NEW.email WHERE rowid IN (SELECT id FROM loans WHERE user_id = NEW.id);
+END"""]
+
+REBUILD = [
+    "DELETE FROM loan_search",
+    f"""INSERT INTO loan_search ({COLUMNS})
+        SELECT loans.id, loans.name, loans.father_name, {_as_typed_and_digits("loans.phone")},
+               {_as_typed_and_digits("loans.cnic")}, users.email
+        FROM loans LEFT JOIN users ON users.id = loans.user_id""",
+]
+
+def rebuild(cur):
+    # call inside Database.write
+    for sql in REBUILD:
+        cur.execute(sql)
+
+# -----------------------
+# Queries
+# -----------------------
+def match_expression(text):
+    # free text -> FTS5 query: every word must match, each as a prefix.
+    # Words are quoted, so FTS5 operators and punctuation in the input are inert.
+    words = [w.replace('"', "") for w in re.split(r"\s+", text or "") if w.replace('"', "")]
+    return " ".join(f'"{w}"*' for w in words)
+
+# the page is picked inside FTS5 (ORDER BY rank on the index alone), then joined
+SEARCH = """SELECT loans.id, loans.name, loans.father_name, loans.phone, loans.cnic, users.email as user_email,
+                   loans.amount, loans.status, loans.payment_status, loans.created_at
+            FROM (SELECT rowid, rank FROM loan_search WHERE loan_search MATCH ? ORDER BY rank LIMIT ? OFFSET ?) AS hits
+            JOIN loans ON loans.id = hits.rowid
+            LEFT JOIN users ON users.id = loans.user_id
+            ORDER BY hits.rank"""
+
+def search_query(text, page=0, page_size=SEARCH_PAGE_SIZE):
+    # (sql, params), or None when there is nothing to search for; fetches one extra row to tell if there is a next page
+    expr = match_expression(text)
+    if not expr:
+        return None
+    return SEARCH, (expr, page_size + 1, page * page_size)
+
+def digits(value):
+    return re.sub(r"\D", "", value or "")
+
+# loans of other borrowers with the same CNIC or phone, found through the index
+DUPLICATES = """SELECT loans.id, loans.user_id, loans.name, loans.phone, loans.cnic, loans.status
+                FROM loan_search JOIN loans ON loans.id = loan_search.rowid
+                WHERE loan_search MATCH ? AND COALESCE(loans.user_id, -1) != ?
+                LIMIT 50"""
+
+def find_duplicates(conn, cnic, phone, user_id):
+    # {"cnic": [rows], "phone": [rows]}; exact digit matches only
+    cnic_d, phone_d = digits(cnic), digits(phone)
+    terms = [f'cnic:"{cnic_d}"'] if cnic_d else []
+    terms += [f'phone:"{phone_d}"'] if phone_d else []
+    found = {"cnic": [], "phone": []}
+    if not terms:
+        return found
+    for row in conn.execute(DUPLICATES, (" OR ".join(terms), user_id if user_id is not None else -1)):
+        if cnic_d and digits(row[4]) == cnic_d:
+            found["cnic"].append(row)
+        if phone_d and digits(row[3]) == phone_d:
+            found["phone"].append(row)
+    return found
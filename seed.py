@@ -0,0 +1,228 @@
+# seed.py
+# Synthetic portfolio for load tests and benchmarks: users, loans (with their
+# installment schedules), payments and uploaded images, generated column-wise in
+# NumPy and written in large transactions through the normal Database, so the
+# rollup triggers and ledger totals come out exactly as the app would leave them.
+#   python seed.py DB_FILE [--loans 100000] [--uploads 50] [--seed 7]
+import argparse
+import hashlib
+import io
+import time
+from datetime import datetime
+
+import numpy as np
+
+import amortization
+import db
+import ledger
+import storage
+
+CHUNK = 50000             # loans per write transaction
+LOANS_PER_USER = 3        # on average; a few heavy borrowers hold many more
+HISTORY_DAYS = 730        # loans are created across the last two years
+SEED_PASSWORD = "password"
+
+# status, and payment_status of approved loans before / after their due date
+STATUS_MIX = {"approved": 0.78, "pending": 0.08, "rejected": 0.14}
+PAYMENT_MIX_NOT_DUE = {"Unpaid": 0.60, "Partially Paid": 0.30, "Paid": 0.10}
+PAYMENT_MIX_PAST_DUE = {"Paid": 0.70, "Partially Paid": 0.15, "Unpaid": 0.15}
+DURATIONS = {30: 0.35, 60: 0.20, 90: 0.20, 180: 0.15, 365: 0.10}
+RATES = {0.08: 0.15, 0.10: 0.35, 0.12: 0.20, 0.18: 0.20, 0.24: 0.10}
+EMI_SHARE = 0.35
+INSTALLMENT_COUNTS = {2: 0.15, 3: 0.35, 4: 0.20, 6: 0.20, 12: 0.10}
+REDUCING_SHARE = 0.30     # of installment loans
+METHODS = ["Mock - Easypaisa", "Mock - JazzCash"]
+
+FIRST_NAMES = ["Ali", "Ahmed", "Fatima", "Ayesha", "Usman", "Zainab", "Bilal", "Hina", "Hamza", "Sana",
+               "Imran", "Maryam", "Faisal", "Nadia", "Tariq", "Sadia", "Kamran", "Rabia", "Asad", "Mehwish"]
+LAST_NAMES = ["Khan", "Ahmed", "Malik", "Hussain", "Butt", "Chaudhry", "Qureshi", "Sheikh", "Raza", "Iqbal"]
+CITIES = ["Karachi", "Lahore", "Islamabad", "Rawalpindi", "Faisalabad", "Multan", "Peshawar", "Quetta"]
+
+def _pick(rng, mix, size):
+    keys = list(mix)
+    return np.asarray(keys)[rng.choice(len(keys), size=size, p=np.asarray(list(mix.values())) / sum(mix.values()))]
+
+def _iso(seconds):
+    # epoch seconds -> ISO strings like datetime.utcnow().isoformat()
+    return np.datetime_as_string(np.asarray(seconds, dtype="int64").astype("datetime64[s]"), unit="s")
+
+def make_uploads(rng, count, folder=storage.UPLOAD_FOLDER):
+    # distinct small JPEGs stored through the upload store, thumbnails included
+    from PIL import Image, ImageDraw
+    paths = []
+    for i in range(count):
+        img = Image.new("RGB", (640, 400), tuple(int(v) for v in rng.integers(40, 220, 3)))
+        ImageDraw.Draw(img).text((20, 20), f"synthetic upload {i}", fill=(255, 255, 255))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=70)
+        path = storage.save_stream(io.BytesIO(buf.getvalue()), f"seed_{i}.jpg", folder)
+        for width in storage.DISPLAY_WIDTHS:
+            storage.thumbnail(path, width, folder)
+        paths.append(path)
+    return paths
+
+def _users(rng, first_id, count):
+    pwd = hashlib.sha256(SEED_PASSWORD.encode("utf-8")).hexdigest()
+    ids = np.arange(first_id, first_id + count)
+    first = np.asarray(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), count)]
+    last = np.asarray(LAST_NAMES)[rng.integers(0, len(LAST_NAMES), count)]
+    created = _iso(time.time() - HISTORY_DAYS * 86400 - rng.integers(0, 180 * 86400, count))
+    return [(int(i), f"{f} {l}", f"03{i:09d}", f"user{i}@example.com", pwd, 0, c)
+            for i, f, l, c in zip(ids, first, last, created)]
+
+def _loan_chunk(rng, first_id, count, user_ids, user_names, uploads, now):
+    n = count
+    ids = np.arange(first_id, first_id + n)
+    borrower = (len(user_ids) * rng.random(n) ** 2).astype(int)   # skewed: low user ids borrow most
+    uid = user_ids[borrower]
+    amount = np.clip(np.round(rng.lognormal(np.log(25000), 0.8, n) / 500) * 500, 1000, 500000)
+    rate = _pick(rng, RATES, n).astype(float)
+    days = _pick(rng, DURATIONS, n).astype(int)
+    status = _pick(rng, STATUS_MIX, n)
+    created = now - rng.integers(0, HISTORY_DAYS * 86400, n)
+    pending = status == "pending"
+    created[pending] = now - rng.integers(0, 14 * 86400, pending.sum())   # still in the review queue
+    approved_at = created + rng.integers(3600, 3 * 86400, n)
+    due = (created // 86400 + days).astype("datetime64[D]")
+    today = np.datetime64(datetime.utcfromtimestamp(now).date(), "D")
+
+    n_inst = np.where(rng.random(n) < EMI_SHARE, _pick(rng, INSTALLMENT_COUNTS, n).astype(int), 0)
+    reducing = (n_inst > 1) & (rng.random(n) < REDUCING_SHARE)
+    total = np.round(amount + amount * rate * days / 365.0, 2)     # calculate_total_simple
+    start = (created // 86400).astype("datetime64[D]")
+    emi = np.flatnonzero(n_inst > 1)
+    inst = None
+    if emi.size:
+        flat_i, red_i = emi[~reducing[emi]], emi[reducing[emi]]
+        parts = []
+        for method, idx in ((amortization.FLAT, flat_i), (amortization.REDUCING, red_i)):
+            if idx.size:
+                s = amortization.schedules(method, amount[idx], rate[idx], days[idx], n_inst[idx], start[idx])
+                s["loan"] = idx[s["loan"]]
+                parts.append(s)
+        inst = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        order = np.lexsort((inst["inst_no"], inst["loan"]))
+        inst = {k: v[order] for k, v in inst.items()}
+        if red_i.size:
+            total[red_i] = np.round(np.bincount(inst["loan"], weights=inst["amount"], minlength=n)[red_i], 2)
+
+    # repayment state follows the due date: most overdue loans are settled, most current ones are not
+    pay_status = np.full(n, "Unpaid", dtype=object)
+    approved = status == "approved"
+    past_due = due < today
+    for mask, mix in ((approved & past_due, PAYMENT_MIX_PAST_DUE), (approved & ~past_due, PAYMENT_MIX_NOT_DUE)):
+        pay_status[mask] = _pick(rng, mix, mask.sum())
+    paid_amount = np.where(pay_status == "Paid", total,
+                           np.where(pay_status == "Partially Paid", np.round(total * rng.uniform(0.1, 0.9, n), 2), 0.0))
+    outstanding = np.round(np.maximum(total - paid_amount, 0.0), 2)
+
+    # 1-3 payments per paying loan, spread between approval and the due date (or now)
+    payers = np.flatnonzero(paid_amount > 0)
+    k = rng.integers(1, 4, payers.size)
+    p_loan = np.repeat(payers, k)
+    p_idx = np.arange(p_loan.size) - np.repeat(np.cumsum(k) - k, k)
+    p_k = np.repeat(k, k)
+    share = np.round(paid_amount[p_loan] / p_k, 2)
+    last = p_idx == p_k - 1
+    share[last] = np.round(paid_amount[p_loan[last]] - share[last] * (p_k[last] - 1), 2)
+    window_end = np.minimum(due.astype("datetime64[s]").astype("int64") + 86400, now)
+    span = np.maximum(window_end - approved_at, 3600)
+    paid_at = approved_at[p_loan] + (span[p_loan] * (p_idx + 1) / (p_k + 1)).astype("int64")
+    last_paid = np.zeros(n, dtype="int64")
+    np.maximum.at(last_paid, p_loan, paid_at)
+
+    # installments are settled oldest first, as far as the amount paid covers them
+    installments = []
+    if inst is not None:
+        csum = np.cumsum(inst["amount"])
+        group_start = np.r_[0, np.flatnonzero(np.diff(inst["loan"])) + 1]
+        offsets = np.repeat(csum[group_start] - inst["amount"][group_start],
+                            np.diff(np.r_[group_start, inst["loan"].size]))
+        settled = (csum - offsets) <= paid_amount[inst["loan"]] + ledger.PAID_EPSILON
+        settled_at = np.where(settled, _iso(last_paid[inst["loan"]]), None)
+        installments = list(zip(ids[inst["loan"]].tolist(), inst["inst_no"].tolist(),
+                                np.datetime_as_string(inst["due_date"], unit="D").tolist(), inst["amount"].tolist(),
+                                inst["principal"].tolist(), inst["interest"].tolist(),
+                                settled.astype(int).tolist(), settled_at.tolist()))
+
+    names = user_names[borrower]
+    cnic = rng.integers(10000, 99999, n), rng.integers(1000000, 9999999, n), rng.integers(1, 9, n)
+    city = np.asarray(CITIES)[rng.integers(0, len(CITIES), n)]
+    father = np.asarray(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), n)]
+    has_img = rng.random(n) < 0.9 if uploads else np.zeros(n, dtype=bool)
+    img = rng.integers(0, max(len(uploads), 1), (n, 2))
+    created_s, due_s, approved_s = _iso(created), np.datetime_as_string(due, unit="D"), _iso(approved_at)
+    plan = np.where(n_inst > 1, np.char.add(n_inst.astype(str), np.where(reducing, " installments (reducing)",
+                                                                          " installments (flat)")), None)
+    loans = []
+    for i in range(n):
+        settled = pay_status[i] == "Paid"
+        loans.append((int(ids[i]), int(uid[i]), names[i], f"{father[i]} {names[i].split()[-1]}", f"03{uid[i]:09d}",
+                      f"{cnic[0][i]}-{cnic[1][i]}-{cnic[2][i]}", f"House {i % 500 + 1}, {city[i]}",
+                      uploads[img[i, 0]] if has_img[i] else None, uploads[img[i, 1]] if has_img[i] else None,
+                      float(amount[i]), float(rate[i]), float(total[i]), status[i], due_s[i], created_s[i],
+                      pay_status[i], f"TXN-SEED{ids[i]:08d}" if settled else None, plan[i],
+                      float(paid_amount[i]), float(outstanding[i]),
+                      approved_s[i] if status[i] == "approved" else None))
+    paid_at_s = _iso(paid_at)
+    methods = np.asarray(METHODS)[rng.integers(0, len(METHODS), p_loan.size)]
+    payments = [(int(ids[l]), float(a), m, t, f"TXN-SEED{ids[l]:08d}-{j + 1}")
+                for l, a, m, t, j in zip(p_loan, share, methods, paid_at_s, p_idx)]
+    return loans, payments, installments
+
+LOAN_COLUMNS = ("id, user_id, name, father_name, phone, cnic, address, user_image_path, cnic_image_path, amount, "
+                "interest_rate, total_payable, status, due_date, created_at, payment_status, receipt_no, "
+                "installment_plan, amount_paid, outstanding, approved_at")
+INSERT_LOAN = f"INSERT INTO loans ({LOAN_COLUMNS}) VALUES ({', '.join('?' * len(LOAN_COLUMNS.split(',')))})"
+INSERT_USER = "INSERT INTO users (id, name, phone, email, password_hash, is_admin, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)"
+INSERT_PAYMENT = "INSERT INTO payments (loan_id, amount, payment_method, paid_at, receipt) VALUES (?, ?, ?, ?, ?)"
+INSERT_INSTALLMENT = ("INSERT INTO installments (loan_id, inst_no, due_date, amount, principal, interest, paid, paid_at) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+def generate(database, loans=100000, uploads=50, seed=7, upload_folder=storage.UPLOAD_FOLDER, progress=None):
+    # Appends to whatever is already in the database. Returns row counts.
+    rng = np.random.default_rng(seed)
+    now = int(time.time())
+    paths = make_uploads(rng, uploads, upload_folder) if uploads else []
+    reader = database.reader()
+    next_user, next_loan = (row[0] + 1 for row in
+                            (reader.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone(),
+                             reader.execute("SELECT COALESCE(MAX(id), 0) FROM loans").fetchone()))
+    reader.close()
+    n_users = max(1, loans // LOANS_PER_USER)
+    users = _users(rng, next_user, n_users)
+    for start in range(0, len(users), CHUNK):
+        database.write(lambda cur, rows: cur.executemany(INSERT_USER, rows), users[start:start + CHUNK])
+    user_ids = np.asarray([u[0] for u in users])
+    user_names = np.asarray([u[1] for u in users], dtype=object)
+    counts = {"users": n_users, "loans": 0, "payments": 0, "installments": 0, "uploads": len(paths)}
+    for start in range(0, loans, CHUNK):
+        size = min(CHUNK, loans - start)
+        loan_rows, payment_rows, inst_rows = _loan_chunk(rng, next_loan + start, size, user_ids, user_names, paths, now)
+
+        def insert(cur):
+            cur.executemany(INSERT_LOAN, loan_rows)
+            cur.executemany(INSERT_PAYMENT, payment_rows)
+            cur.executemany(INSERT_INSTALLMENT, inst_rows)
+        database.write(insert)
+        counts["loans"] += len(loan_rows)
+        counts["payments"] += len(payment_rows)
+        counts["installments"] += len(inst_rows)
+        if progress:
+            progress(counts)
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill a database with a synthetic loan portfolio")
+    parser.add_argument("db_file", nargs="?", default="loans_pro.db")
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--uploads", type=int, default=50, help="distinct images shared by the loans")
+    parser.add_argument("--upload-folder", default=storage.UPLOAD_FOLDER)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    database = db.Database(args.db_file)
+    t0 = time.perf_counter()
+    counts = generate(database, args.loans, args.uploads, args.seed, args.upload_folder,
+                      progress=lambda c: print(f"  {c['loans']:,} loans", flush=True))
+    database.close()
+    print(", ".join(f"{v:,} {k}" for k, v in counts.items()), f"in {time.perf_counter() - t0:.1f}s")
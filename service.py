@@ -0,0 +1,341 @@
+# service.py
+# The loan operations behind the pages, usable without Streamlit: signup and
+# login, loan applications (one or a batch), repayments (one or a settlement
+# file), approve / reject and due reminders. app.py and the HTTP API (api.py)
+# both call these; each write is one Database.write transaction, and batches are
+# written with executemany a chunk at a time so the write slot is never held long.
+#
+# Problems the caller should show the user raise ServiceError with a readable
+# message; status is the matching HTTP code. NumPy (amortization) is imported by
+# the functions that build schedules, so importing this module stays cheap.
+import hashlib
+import math
+import random
+import sqlite3
+import string
+from datetime import date, datetime, timedelta
+
+import db
+import ledger
+import notify
+import search
+
+MIN_AMOUNT, MAX_AMOUNT = 1000.0, 100_000_000.0   # loans and single payments
+MAX_RATE = 5.0           # annual, as a fraction
+MIN_DAYS, MAX_DAYS = 7, 365
+MAX_INSTALLMENTS = 12
+BATCH_CHUNK = 500        # rows per write transaction in the batch operations
+PAYMENT_METHODS = ["Mock - Easypaisa", "Mock - JazzCash"]
+
+class ServiceError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# -----------------------
+# Users
+# -----------------------
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+def verify_password(password: str, hashed: str) -> bool:
+    return hash_password(password) == hashed
+
+def random_txn() -> str:
+    return "TXN-" + ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+def ensure_admin(cur, admin: dict) -> None:
+    # call inside Database.write; creates the default admin if there is none
+    cur.execute("SELECT COUNT(*) as cnt FROM users WHERE is_admin=1")
+    if cur.fetchone()[0] == 0:
+        cur.execute("INSERT OR IGNORE INTO users (name, phone, email, password_hash, is_admin, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    ("Admin", admin["phone"], admin["email"], hash_password(admin["password"]), 1,
+                     datetime.utcnow().isoformat()))
+
+def signup(database, name: str, phone: str, email: str | None, password: str) -> int:
+    # returns the new user's id
+    if not name or not phone or not password:
+        raise ServiceError("Name, phone and password are required.")
+    try:
+        user_id, _ = database.execute(
+            "INSERT INTO users (name, phone, email, password_hash, is_admin, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, phone, email, hash_password(password), 0, datetime.utcnow().isoformat()))
+    except sqlite3.IntegrityError:
+        raise ServiceError("Phone or Email already registered.", 409)
+    return user_id
+
+def login(conn, login: str, password: str) -> dict:
+    # by phone or email; returns the session user
+    row = conn.execute(db.USER_LOGIN, (login, login)).fetchone()
+    if not row:
+        raise ServiceError("User not found.", 404)
+    if not verify_password(password, row[4]):
+        raise ServiceError("Invalid password.", 401)
+    return {"id": row[0], "name": row[1], "phone": row[2], "email": row[3], "is_admin": row[5]}
+
+# -----------------------
+# Loan applications
+# -----------------------
+INSERT_LOAN = """INSERT INTO loans (user_id, name, father_name, phone, cnic, address,
+                 user_image_path, cnic_image_path, amount, interest_rate, total_payable,
+                 status, due_date, created_at, payment_status, receipt_no, installment_plan,
+                 amount_paid, outstanding)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+# fields of an application (the keys of a batch item); the first seven are required
+APPLICATION_FIELDS = ["user_id", "name", "phone", "cnic", "amount", "duration_days", "interest_rate",
+                      "father_name", "address", "installments", "interest_model", "user_email",
+                      "user_image_path", "cnic_image_path"]
+TEXT_FIELDS = ["name", "phone", "cnic", "father_name", "address", "interest_model", "user_email",
+               "user_image_path", "cnic_image_path"]
+
+def _number(item, key, kind=float):
+    # item[key] as a finite float, or for kind=int a whole number that fits an SQLite INTEGER
+    try:
+        value = float(item[key])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise ServiceError(f"{key} must be a number.")
+    if not math.isfinite(value):
+        raise ServiceError(f"{key} must be a finite number.")
+    if kind is int and not (value.is_integer() and abs(value) < 2**63):
+        raise ServiceError(f"{key} must be a whole number.")
+    return kind(value)
+
+def _text(item, keys):
+    # text fields must be strings (or absent) - anything else can't be stored or searched
+    for key in keys:
+        if item.get(key) is not None and not isinstance(item[key], str):
+            raise ServiceError(f"{key} must be text.")
+
+def check_application(conn, app: dict, users: set | None = None) -> list[str]:
+    # Raises ServiceError for an application that can't be submitted; returns warnings.
+    # users: ids known to exist (submit_loans looks a batch's users up in one query).
+    import amortization
+    if not isinstance(app, dict):
+        raise ServiceError("An application must be an object.")
+    _text(app, TEXT_FIELDS)
+    if not str(app.get("name") or "").strip() or not str(app.get("phone") or "").strip() \
+            or not str(app.get("cnic") or "").strip():
+        raise ServiceError("Name, Phone & CNIC required.")
+    missing = [key for key in APPLICATION_FIELDS[:7] if app.get(key) is None]
+    if missing:
+        raise ServiceError(f"Missing {', '.join(missing)}.")
+    user_id = _number(app, "user_id", int)
+    if users is None:
+        users = {r[0] for r in conn.execute("SELECT id FROM users WHERE id=?", (user_id,))}
+    if user_id not in users:
+        raise ServiceError(f"User {user_id} not found.", 404)
+    if not MIN_AMOUNT <= _number(app, "amount") <= MAX_AMOUNT:
+        raise ServiceError(f"Loan amount must be PKR {MIN_AMOUNT:,.0f} - {MAX_AMOUNT:,.0f}.")
+    if not MIN_DAYS <= _number(app, "duration_days", int) <= MAX_DAYS:
+        raise ServiceError(f"Duration must be {MIN_DAYS}-{MAX_DAYS} days.")
+    if not 0 <= _number(app, "interest_rate") <= MAX_RATE:
+        raise ServiceError(f"interest_rate must be 0 - {MAX_RATE:g} (a yearly fraction).")
+    installments = _number(app, "installments", int) if app.get("installments") is not None else 0
+    if not 0 <= installments <= MAX_INSTALLMENTS:
+        raise ServiceError(f"At most {MAX_INSTALLMENTS} installments.")
+    if app.get("interest_model", amortization.FLAT) not in (amortization.FLAT, amortization.REDUCING):
+        raise ServiceError(f"interest_model must be {amortization.FLAT} or {amortization.REDUCING}.")
+    duplicates = search.find_duplicates(conn, str(app["cnic"]), str(app["phone"]), user_id)
+    if duplicates["cnic"]:
+        # a CNIC belongs to one person - another account using it needs an admin to look first
+        raise ServiceError(f"This CNIC is already on another borrower's loan (loan ID {duplicates['cnic'][0][0]}). "
+                           "Please contact support.", 409)
+    if duplicates["phone"]:
+        return [f"This phone number is also used on {len(duplicates['phone'])} other borrower's loan(s)."]
+    return []
+
+def _insert_applications(cur, apps):
+    # Call inside Database.write. Loans, installment rows and "submitted" notifications
+    # for a chunk of checked applications; returns [(loan_id, total_payable)].
+    import numpy as np
+    import amortization
+    amount = np.array([_number(a, "amount") for a in apps])
+    rate = np.array([_number(a, "interest_rate") for a in apps])
+    days = np.array([_number(a, "duration_days", int) for a in apps])
+    count = np.array([_number(a, "installments", int) if a.get("installments") is not None else 0 for a in apps])
+    total = np.array([amortization.calculate_total_simple(p, r, int(d)) for p, r, d in zip(amount, rate, days)])
+    # schedules are computed per interest model, all loans of a model at once
+    schedules = {}
+    for method in (amortization.FLAT, amortization.REDUCING):
+        idx = np.flatnonzero((count > 1) & np.array([a.get("interest_model", amortization.FLAT) == method for a in apps]))
+        if len(idx):
+            sched = amortization.schedules(method, amount[idx], rate[idx], days[idx], count[idx])
+            schedules[method] = (idx, sched)
+            if method == amortization.REDUCING:
+                total[idx] = np.round(np.bincount(sched["loan"], weights=sched["amount"], minlength=len(idx)), 2)
+    created_at = datetime.utcnow().isoformat()
+    today = date.today()
+    rows = []
+    for a, p, r, t, d, n in zip(apps, amount.tolist(), rate.tolist(), total.tolist(), days.tolist(), count.tolist()):
+        plan = f"{n} installments ({a.get('interest_model', amortization.FLAT)})" if n > 1 else None
+        rows.append((_number(a, "user_id", int), a["name"], a.get("father_name"), a["phone"], a["cnic"], a.get("address"),
+                     a.get("user_image_path"), a.get("cnic_image_path"), p, r,
+                     t, "pending", (today + timedelta(days=d)).isoformat(), created_at, "Unpaid", None, plan, 0.0, t))
+    cur.executemany(INSERT_LOAN, rows)
+    # one writer and AUTOINCREMENT: the chunk's ids are the last len(rows) ones handed out
+    last = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+    ids = np.arange(last - len(rows) + 1, last + 1)
+    for idx, sched in schedules.values():
+        cur.executemany(amortization.INSERT_INSTALLMENTS, amortization.installment_rows(ids[idx], sched))
+    messages = []
+    for a, loan_id in zip(apps, ids.tolist()):
+        messages.append(notify.outbox_row(notify.EMAIL, a.get("user_email"), "Loan Submitted",
+                                          f"Your loan for PKR {a['amount']} submitted.", f"submitted:{loan_id}"))
+        messages.append(notify.outbox_row(notify.SMS, a["phone"], None,
+                                          f"Your loan application of PKR {a['amount']} submitted.", f"submitted:{loan_id}"))
+    notify.enqueue_many(cur, messages)
+    return list(zip(ids.tolist(), total.tolist()))
+
+def insert_loan(database, app: dict) -> tuple[int, float]:
+    # an application already through check_application; returns (loan_id, total_payable)
+    [(loan_id, total)] = database.write(_insert_applications, [app])
+    return loan_id, total
+
+def apply_loan(database, conn, app: dict) -> dict:
+    # one application (keys: APPLICATION_FIELDS); returns {loan_id, total_payable, warnings}
+    warnings = check_application(conn, app)
+    loan_id, total = insert_loan(database, app)
+    return {"loan_id": loan_id, "total_payable": total, "warnings": warnings}
+
+def submit_loans(database, conn, apps: list[dict], chunk: int = BATCH_CHUNK) -> dict:
+    # Bulk submission. Every application is checked like apply_loan; the valid ones
+    # are written BATCH_CHUNK per transaction. A CNIC may appear twice in a batch
+    # only for the same user. Returns {submitted: [{index, loan_id, total_payable}],
+    # rejected: [{index, error}], warnings: [{index, warning}]}.
+    result = {"submitted": [], "rejected": [], "warnings": []}
+    valid, cnic_owner = [], {}
+    user_ids = set()
+    for app in apps:
+        try:
+            user_ids.add(_number(app, "user_id", int))
+        except (ServiceError, TypeError):
+            pass    # check_application rejects it
+    users = set()
+    for start in range(0, len(user_ids), 900):   # under SQLite's bound-parameter limit
+        part = sorted(user_ids)[start:start + 900]
+        users.update(r[0] for r in conn.execute(f"SELECT id FROM users WHERE id IN ({','.join('?' * len(part))})", part))
+    for i, app in enumerate(apps):
+        try:
+            warnings = check_application(conn, app, users)
+            user_id = _number(app, "user_id", int)
+            owner = cnic_owner.setdefault(search.digits(app["cnic"]), user_id)
+            if owner != user_id:
+                raise ServiceError("CNIC used by another borrower earlier in this batch.", 409)
+        except ServiceError as e:
+            result["rejected"].append({"index": i, "error": str(e)})
+            continue
+        result["warnings"] += [{"index": i, "warning": w} for w in warnings]
+        valid.append((i, app))
+    for start in range(0, len(valid), chunk):
+        part = valid[start:start + chunk]
+        written = database.write(_insert_applications, [app for _, app in part])
+        result["submitted"] += [{"index": i, "loan_id": loan_id, "total_payable": total}
+                                for (i, _), (loan_id, total) in zip(part, written)]
+    return result
+
+# -----------------------
+# Decisions and repayments
+# -----------------------
+def decide_loan(database, loan_id: int, approve: bool) -> bool:
+    # approve or reject a loan and notify the borrower; False if there is no such loan
+    def decide(cur):
+        row = cur.execute("SELECT loans.phone, users.email FROM loans LEFT JOIN users ON users.id = loans.user_id "
+                          "WHERE loans.id=?", (loan_id,)).fetchone()
+        if not row:
+            return False
+        if approve:
+            cur.execute("UPDATE loans SET status='approved', approved_at=? WHERE id=?", (datetime.utcnow().isoformat(), loan_id))
+        else:
+            cur.execute("UPDATE loans SET status='rejected' WHERE id=?", (loan_id,))
+        word = "approved" if approve else "rejected"
+        notify.enqueue_many(cur, [
+            notify.outbox_row(notify.EMAIL, row[1], f"Loan {word.capitalize()}", f"Your loan ID {loan_id} {word}."),
+            notify.outbox_row(notify.SMS, row[0], None, f"Loan {loan_id} {word}.")])
+        return True
+    return database.write(decide)
+
+def _payment_messages(cur, balances, applied):
+    # receipt notifications for applied (loan_id, amount, method, receipt, paid_at) rows
+    ids = sorted(balances)
+    contacts = {r[0]: (r[1], r[2]) for r in cur.execute(
+        f"SELECT loans.id, users.email, loans.phone FROM loans LEFT JOIN users ON users.id = loans.user_id "
+        f"WHERE loans.id IN ({','.join('?' * len(ids))})", ids)} if ids else {}
+    rows = []
+    for loan_id, amount, _, receipt, _ in applied:
+        email, phone = contacts.get(int(loan_id), (None, None))
+        rows.append(notify.outbox_row(notify.EMAIL, email, "Payment Received",
+                                      f"Payment of PKR {amount} received. Receipt {receipt}", f"payment:{receipt}"))
+        rows.append(notify.outbox_row(notify.SMS, phone, None, f"Payment PKR {amount} received. Receipt {receipt}",
+                                      f"payment:{receipt}"))
+    return rows
+
+def repay(database, loan_id: int, amount: float, method: str, receipt: str | None = None) -> dict:
+    # one payment; returns {receipt, outstanding, payment_status}
+    if not 0 < amount <= MAX_AMOUNT:
+        raise ServiceError(f"Payment amount must be positive and at most PKR {MAX_AMOUNT:,.0f}.")
+    receipt = receipt or random_txn()
+    def pay(cur):
+        applied, balances, skipped = ledger.record_payments(cur, [(loan_id, amount, method, receipt, None)])
+        if skipped:
+            return skipped[0][1]
+        notify.enqueue_many(cur, _payment_messages(cur, balances, applied))
+        return balances[loan_id]
+    result = database.write(pay)
+    if isinstance(result, str):
+        raise ServiceError(result.capitalize() + ".", 404 if result == "loan not found" else 409)
+    return {"receipt": receipt, "outstanding": result[0], "payment_status": result[1]}
+
+def post_payments(database, payments: list, chunk: int = BATCH_CHUNK) -> dict:
+    # Bulk repayments, e.g. a wallet settlement file: (loan_id, amount, method, receipt,
+    # paid_at or None) rows, BATCH_CHUNK per transaction. Every row needs the wallet's
+    # receipt; receipts already in the ledger are skipped, so re-posting a file is
+    # harmless. Rows ledger.record_payments won't take are skipped too.
+    # Returns {posted, skipped: [{row, reason}]}.
+    posted, skipped = 0, []
+    for start in range(0, len(payments), chunk):
+        part = payments[start:start + chunk]
+        def post(cur):
+            applied, balances, skips = ledger.record_payments(cur, part)
+            notify.enqueue_many(cur, _payment_messages(cur, balances, applied))
+            return len(applied), skips
+        n, skips = database.write(post)
+        posted += n
+        skipped += [{"row": list(row), "reason": reason} for row, reason in skips]
+    return {"posted": posted, "skipped": skipped}
+
+def parse_settlement(text: str, method: str = PAYMENT_METHODS[0]) -> list:
+    # CSV with a header: loan_id, amount, receipt, and optionally paid_at and method
+    import csv
+    return [payment_row(r, method, f"Settlement file line {i}")
+            for i, r in enumerate(csv.DictReader(text.splitlines()), start=2)]
+
+def payment_row(item: dict, method: str = PAYMENT_METHODS[0], where: str = "Payment") -> tuple:
+    # a post_payments row from a settlement line or JSON object
+    if not isinstance(item, dict):
+        raise ServiceError(f"{where}: expected an object with loan_id, amount and receipt.")
+    try:
+        loan_id, amount = _number(item, "loan_id", int), _number(item, "amount")
+        _text(item, ["method", "receipt", "paid_at"])
+    except ServiceError as e:
+        raise ServiceError(f"{where}: {e}")
+    if amount > MAX_AMOUNT:
+        raise ServiceError(f"{where}: amount above PKR {MAX_AMOUNT:,.0f}.")
+    return (loan_id, amount, item.get("method") or method,
+            (item.get("receipt") or "").strip() or None, item.get("paid_at") or None)
+
+# -----------------------
+# Reminders
+# -----------------------
+def queue_reminders(database, conn, days_ahead: int = 7) -> int:
+    # email + SMS for every open loan due within days_ahead; returns how many were queued.
+    # Repeat calls the same day are no-ops. No loan runs longer than MAX_DAYS.
+    if not 0 <= days_ahead <= MAX_DAYS:
+        raise ServiceError(f"days_ahead must be 0-{MAX_DAYS}.")
+    target = (date.today() + timedelta(days=days_ahead)).isoformat()
+    rows = []
+    for loan_id, email, phone, due in conn.execute(
+            f"SELECT id, user_email, phone, due_date FROM ({db.DUE_LOANS})", (target,)):
+        key = notify.reminder_key(int(loan_id), "due")
+        rows.append(notify.outbox_row(notify.EMAIL, email, "Loan Due Reminder", f"Loan {loan_id} is due on {due}.", key))
+        rows.append(notify.outbox_row(notify.SMS, phone, None, f"Loan {loan_id} due on {due}.", key))
+    return database.write(notify.enqueue_many, rows)
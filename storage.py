@@ -0,0 +1,81 @@
+# storage.py
+# Content-addressed upload store. Uploads are streamed to disk in chunks while
+# being hashed, then filed as uploads/<aa>/<bb>/<sha256>.<ext>, so the same
+# image uploaded twice is stored once and two uploads can never collide on a
+# name. Display-size thumbnails are derived once and cached next to them.
+import hashlib
+import os
+import tempfile
+
+UPLOAD_FOLDER = "uploads"
+CHUNK_SIZE = 1024 * 1024
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+DISPLAY_WIDTHS = (120, 150, 300)   # widths the Admin and History pages show images at
+THUMB_QUALITY = 80
+
+def _extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext in ALLOWED_EXTENSIONS else ".bin"
+
+def blob_path(digest, ext, folder=UPLOAD_FOLDER):
+    return os.path.join(folder, digest[:2], digest[2:4], digest + ext)
+
+def save_stream(fileobj, filename, folder=UPLOAD_FOLDER):
+    # fileobj: anything with read(n) - Streamlit's UploadedFile, an open file, BytesIO
+    os.makedirs(folder, exist_ok=True)
+    if hasattr(fileobj, "seek"):
+        fileobj.seek(0)
+    sha = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+                out.write(chunk)
+        path = blob_path(sha.hexdigest(), _extension(filename), folder)
+        if os.path.exists(path):
+            os.unlink(tmp)   # already stored
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return path
+
+def thumbnail_path(path, width, folder=UPLOAD_FOLDER):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(folder, "thumbs", str(width), stem[:2], stem + ".jpg")
+
+def thumbnail(path, width, folder=UPLOAD_FOLDER):
+    # path of a JPEG at most `width` px wide; made on first use, then served from disk.
+    # Falls back to the original if it can't be decoded as an image.
+    if not path or not os.path.exists(path):
+        return path
+    thumb = thumbnail_path(path, width, folder)
+    if os.path.exists(thumb):
+        return thumb
+    from PIL import Image, ImageOps
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (width, width * 4))   # JPEG: decode at reduced scale, much cheaper
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((width, width * 4))
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(thumb), suffix=".part")
+            with os.fdopen(fd, "wb") as out:
+                img.save(out, "JPEG", quality=THUMB_QUALITY, optimize=True)
+            os.replace(tmp, thumb)
+    except (OSError, Image.DecompressionBombError):
+        return path
+    return thumb
+
+def save_upload(uploaded_file, folder=UPLOAD_FOLDER):
+    if uploaded_file is None:
+        return None
+    path = save_stream(uploaded_file, uploaded_file.name, folder)
+    # derive the display sizes now so the first admin review is already cheap
+    for width in DISPLAY_WIDTHS:
+        thumbnail(path, width, folder)
+    return path
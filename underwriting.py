@@ -0,0 +1,171 @@
+# underwriting.py
+# Rule-based decisions for the pending queue. Every pending loan is loaded with
+# its borrower's history in two queries, each rule is evaluated as one column-wise
+# comparison over all of them, and the approve / reject decisions are written in
+# one transaction together with their notifications. Manual-review loans stay
+# pending for an admin.
+#   python underwriting.py [DB_FILE] [--apply]   - preview (default) or apply
+import operator
+import os
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+import archive
+import db
+import notify
+
+APPROVE = "approve"
+REJECT = "reject"
+REVIEW = "review"
+
+# (rule, feature, operator, threshold, decision when it holds). Any reject rule
+# beats any review rule; a loan no rule fires on is approved - unless one of
+# LOAN_FEATURES is missing: no comparison holds on NaN, so those go to review.
+DEFAULT_RULES = [
+    ("amount above hard limit", "amount", ">", 250000, REJECT),
+    ("interest rate outside product range", "interest_rate", ">", 0.36, REJECT),
+    ("term longer than a year", "duration_days", ">", 365, REJECT),
+    ("two or more loans overdue", "overdue_loans", ">=", 2, REJECT),
+    ("large amount", "amount", ">", 100000, REVIEW),
+    ("open exposure after approval", "exposure_after", ">", 300000, REVIEW),
+    ("a loan overdue", "overdue_loans", ">=", 1, REVIEW),
+    ("first loan above starter limit", "first_loan_amount", ">", 50000, REVIEW),
+]
+LOAN_FEATURES = ["amount", "interest_rate", "duration_days"]
+RULE_COLUMNS = ["rule", "feature", "operator", "threshold", "decision"]
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "==": operator.eq}
+
+PENDING = """SELECT loans.id, loans.user_id, loans.name, loans.phone, users.email AS user_email, loans.amount,
+                    loans.interest_rate, CAST(julianday(loans.due_date) - julianday(date(loans.created_at)) AS INTEGER)
+                    AS duration_days, loans.created_at
+             FROM loans LEFT JOIN users ON users.id = loans.user_id
+             WHERE loans.status = 'pending'
+             ORDER BY loans.created_at, loans.id"""
+# history of every borrower with something pending, as of `today`; {loans} is their
+# live loans, plus their archived ones (paid-off loans move there, see load_pending)
+PENDING_BORROWERS = "user_id IN (SELECT user_id FROM loans WHERE status = 'pending')"
+BORROWER_HISTORY = """SELECT user_id,
+                             SUM(CASE WHEN status = 'approved' AND COALESCE(payment_status, '') != 'Paid'
+                                      THEN COALESCE(outstanding, total_payable, 0) ELSE 0 END) AS open_exposure,
+                             SUM(status = 'approved' AND COALESCE(payment_status, '') != 'Paid' AND due_date < ?) AS overdue_loans,
+                             SUM(payment_status = 'Paid') AS paid_loans,
+                             SUM(status = 'rejected') AS rejected_loans
+                      FROM {loans}
+                      GROUP BY user_id"""
+HISTORY_COLUMNS = ["open_exposure", "overdue_loans", "paid_loans", "rejected_loans"]
+FEATURES = LOAN_FEATURES + HISTORY_COLUMNS + ["exposure_after", "first_loan_amount"]
+
+def load_pending(conn, today=None, archive_schema=None):
+    # with the archive attached, pass its schema: a repeat borrower's paid loans are there
+    import pandas as pd
+    loans = pd.read_sql_query(PENDING, conn)
+    # filtered on each side of the UNION, so both use their user_id index
+    tables = ["loans"] + ([f"{archive_schema}.loans"] if archive_schema else [])
+    source = "(" + " UNION ALL ".join(f"SELECT * FROM {t} WHERE {PENDING_BORROWERS}" for t in tables) + ")"
+    history = pd.read_sql_query(BORROWER_HISTORY.format(loans=source), conn,
+                                params=((today or date.today()).isoformat(),))
+    df = loans.merge(history, on="user_id", how="left")
+    df[HISTORY_COLUMNS] = df[HISTORY_COLUMNS].fillna(0)
+    # derived features; exposure counts every pending loan of the borrower, as if all were approved
+    df["exposure_after"] = df["open_exposure"] + df.groupby("user_id")["amount"].transform("sum")
+    df["first_loan_amount"] = np.where(df["paid_loans"] == 0, df["amount"], 0.0)
+    return df
+
+def evaluate(df, rules=DEFAULT_RULES):
+    # adds decision and reasons columns; one vectorised comparison per rule
+    fired = []   # (name, mask) per rule, in order - names needn't be unique
+    reject = np.zeros(len(df), dtype=bool)
+    review = np.zeros(len(df), dtype=bool)
+    for feature in LOAN_FEATURES:
+        mask = df[feature].isna().to_numpy()
+        fired.append((f"{feature} missing", mask))
+        review |= mask
+    for name, feature, op, threshold, outcome in rules:
+        mask = OPERATORS[op](df[feature].to_numpy(dtype=float), float(threshold))
+        fired.append((name, mask))
+        if outcome == REJECT:
+            reject |= mask
+        else:
+            review |= mask
+    df = df.copy()
+    df["decision"] = np.where(reject, REJECT, np.where(review, REVIEW, APPROVE))
+    names = np.array([f"{name}; " for name, _ in fired], dtype=object)
+    # True * "name; " == "name; ", False * ... == "" - joined per row by the sum
+    df["reasons"] = (np.column_stack([mask for _, mask in fired]) * names).sum(axis=1)
+    df["reasons"] = df["reasons"].str.rstrip("; ")
+    return df
+
+def preview(conn, rules=DEFAULT_RULES, today=None, archive_schema=None):
+    # dry run: (decisions DataFrame, {"load_ms", "evaluate_ms"})
+    t0 = time.perf_counter()
+    df = load_pending(conn, today, archive_schema)
+    t1 = time.perf_counter()
+    decided = evaluate(df, rules)
+    t2 = time.perf_counter()
+    return decided, {"load_ms": round((t1 - t0) * 1000, 2), "evaluate_ms": round((t2 - t1) * 1000, 2)}
+
+def summary(decided):
+    counts = decided["decision"].value_counts()
+    return {d: int(counts.get(d, 0)) for d in (APPROVE, REJECT, REVIEW)}
+
+MESSAGES = {
+    APPROVE: ("Loan Approved", "Your loan ID {id} approved.", "Loan {id} approved."),
+    REJECT: ("Loan Rejected", "Your loan ID {id} rejected.", "Loan {id} rejected."),
+}
+
+def apply_decisions(cur, decided, decided_at=None):
+    # Call inside Database.write. Only loans still pending are changed, so a stale
+    # preview can't overturn a decision made since. Returns {decision: loans changed}.
+    decided_at = decided_at or datetime.utcnow().isoformat()
+    final = decided[decided["decision"] != REVIEW]
+    ids = [int(i) for i in final["id"]]
+    still_pending = set()
+    for start in range(0, len(ids), 500):   # SQLite's bound-parameter limit
+        chunk = ids[start:start + 500]
+        still_pending.update(r[0] for r in cur.execute(
+            f"SELECT id FROM loans WHERE status='pending' AND id IN ({','.join('?' * len(chunk))})", chunk))
+    final = final[final["id"].isin(still_pending)]
+    approve = final[final["decision"] == APPROVE]
+    reject = final[final["decision"] == REJECT]
+    cur.executemany("UPDATE loans SET status='approved', approved_at=? WHERE id=?",
+                    [(decided_at, int(i)) for i in approve["id"]])
+    cur.executemany("UPDATE loans SET status='rejected' WHERE id=?", [(int(i),) for i in reject["id"]])
+    rows = []
+    for loan_id, decision, email, phone in zip(final["id"], final["decision"], final["user_email"], final["phone"]):
+        email, phone = (v if isinstance(v, str) else None for v in (email, phone))   # NaN when missing
+        subject, email_body, sms_body = MESSAGES[decision]
+        key = f"decision:{int(loan_id)}"
+        rows.append(notify.outbox_row(notify.EMAIL, email, subject, email_body.format(id=loan_id), key))
+        rows.append(notify.outbox_row(notify.SMS, phone, None, sms_body.format(id=loan_id), key))
+    notify.enqueue_many(cur, rows)
+    return {APPROVE: len(approve), REJECT: len(reject)}
+
+def rules_from_table(table):
+    # rows edited in the admin page (a DataFrame of RULE_COLUMNS) -> rules; incomplete rows are ignored
+    rules = []
+    for r in table.itertuples(index=False):
+        try:
+            threshold = float(r.threshold)
+        except (TypeError, ValueError):
+            continue
+        if r.feature in FEATURES and r.operator in OPERATORS and r.decision in (REJECT, REVIEW) and threshold == threshold:
+            # a cleared name cell comes back as NaN / None
+            name = r.rule.strip() if isinstance(r.rule, str) else ""
+            rules.append((name or f"{r.feature} {r.operator} {threshold:g}", r.feature, r.operator, threshold, r.decision))
+    return rules
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    database = db.Database(args[0] if args else "loans_pro.db")
+    schema = None
+    if os.path.exists(archive.archive_path(database.path)):
+        archive.attach(database)
+        schema = archive.SCHEMA
+    decided, timings = preview(database.reader(), archive_schema=schema)
+    print(f"{len(decided)} pending loan(s): {summary(decided)}")
+    print(f"load {timings['load_ms']} ms, rule evaluation {timings['evaluate_ms']} ms")
+    if "--apply" in sys.argv:
+        print("applied:", database.write(apply_decisions, decided))